@@ -4,7 +4,6 @@
 import io
 import os
 
-import numpy as np
 import polars as pl
 import streamlit as st
 
@@ -261,7 +260,7 @@ async def create(sv: rm_variables.SessionVariable, workflow=None) -> None:
                             sv.matching_sentence_pair_embedding_threshold.value
                         )
                         sv.matching_merged_df.value = mer.build_model_df(attsa)
-                        all_sentences_data = mer.sentences_vector_data
+                        all_sentences_data = mer.sentences_vector_data.to_dicts()
 
                         pb = st.progress(0, "Embedding text batches...")
 
@@ -275,23 +274,13 @@ async def create(sv: rm_variables.SessionVariable, workflow=None) -> None:
                         callback.on_batch_change = on_embedding_batch_change
 
                         functions_embedder = functions.embedder(local_embedding)
-                        data_embeddings = await functions_embedder.embed_store_many(
-                            all_sentences_data, [callback], sv_home.save_cache.value
+                        mer.embeddings = await functions_embedder.embed_store_many(
+                            all_sentences_data,
+                            [callback],
+                            sv_home.save_cache.value,
+                            aligned=True,
                         )
-
-                        all_sentences = [x["text"] for x in all_sentences_data]
-                        all_embeddings = [
-                            np.array(
-                                next(
-                                    d["vector"]
-                                    for d in data_embeddings
-                                    if d["text"] == f
-                                )
-                            )
-                            for f in all_sentences
-                        ]
-                        mer.embeddings = all_embeddings
-                        mer.all_sentences = all_sentences
+                        mer.all_sentences = mer.sentences_vector_data["text"].to_list()
 
                         pb.empty()
                         sv.matching_matches_df.value = mer.detect_record_groups(
@@ -3,34 +3,114 @@
 #
 import asyncio
 import logging
+import time
+from collections.abc import Callable
 
 from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
 
 logger = logging.getLogger(__name__)
 
+PROGRESS_MIN_INTERVAL = 0.1
+
+
+class ProgressTracker:
+    """
+    Counts completed work for one batch job and reports it to sinks as it changes.
+
+    Sinks are objects with an on_progress(tracker) method, such as ProgressBatchCallback.
+    Reports are driven by completions rather than polling, and are coalesced to at most one per
+    min_interval seconds.
+    """
+
+    def __init__(
+        self,
+        total: int,
+        min_interval: float = PROGRESS_MIN_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.total = total
+        self.completed = 0
+        self.min_interval = min_interval
+        self.clock = clock
+        self.start_time = clock()
+        self._changed = asyncio.Event()
+
+    def advance(self, count: int = 1) -> None:
+        self.completed += count
+        self._changed.set()
+
+    @property
+    def elapsed(self) -> float:
+        return self.clock() - self.start_time
+
+    @property
+    def rate(self) -> float | None:
+        """Completed units per second so far."""
+        elapsed = self.elapsed
+        if self.completed == 0 or elapsed <= 0:
+            return None
+        return self.completed / elapsed
+
+    @property
+    def eta(self) -> float | None:
+        """Estimated seconds until all units are completed, at the rate so far."""
+        rate = self.rate
+        if rate is None:
+            return None
+        return max(self.total - self.completed, 0) / rate
+
+    def report(self, sinks: list) -> None:
+        for sink in sinks:
+            sink.on_progress(self)
+
+    async def track(self, tasks: list[asyncio.Task], sinks: list) -> None:
+        """Report progress to the sinks whenever it changes, until all the tasks are done."""
+        remaining = len(tasks)
+
+        def on_task_done(_) -> None:
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0:
+                self._changed.set()
+
+        for task in tasks:
+            task.add_done_callback(on_task_done)
+        reported = 0
+        while remaining > 0:
+            await self._changed.wait()
+            self._changed.clear()
+            if self.completed != reported:
+                reported = self.completed
+                self.report(sinks)
+            if remaining > 0:
+                await asyncio.sleep(self.min_interval)
+        if self.completed != reported or self.completed == self.total:
+            self.report(sinks)
+
 
 class BaseBatchAsync:
-    total_tasks: int = 1
-    completed_tasks: int = 0
-    previous_completed_tasks: int = 0
+    progress: ProgressTracker | None = None
+
+    def start_progress(self, total: int) -> ProgressTracker:
+        """Start counting progress for a new batch job of this instance."""
+        self.progress = ProgressTracker(total)
+        return self.progress
+
+    @property
+    def total_tasks(self) -> int:
+        return self.progress.total if self.progress is not None else 0
+
+    @property
+    def completed_tasks(self) -> int:
+        return self.progress.completed if self.progress is not None else 0
 
     async def track_progress(
         self, tasks: list[asyncio.Task], callbacks: list[ProgressBatchCallback]
     ):
-        while not all(task.done() for task in tasks):
-            await asyncio.sleep(0.1)
-            if self.completed_tasks != self.previous_completed_tasks:
-                for callback in callbacks:
-                    callback.on_batch_change(self.completed_tasks, self.total_tasks)
-                self.previous_completed_tasks = self.completed_tasks
-
-        if self.completed_tasks != self.previous_completed_tasks:
-            for callback in callbacks:
-                callback.on_batch_change(self.completed_tasks, self.total_tasks)
-
-        if self.completed_tasks == self.total_tasks:
-            for callback in callbacks:
-                callback.on_batch_change(self.completed_tasks, self.total_tasks)
-
-    def progress_callback(self) -> None:
-        self.completed_tasks += 1
+        if self.progress is None:
+            self.start_progress(len(tasks))
+        await self.progress.track(tasks, callbacks)
+
+    def progress_callback(self, count: int = 1) -> None:
+        if self.progress is not None:
+            self.progress.advance(count)
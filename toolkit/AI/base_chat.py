@@ -4,44 +4,90 @@
 
 
 import asyncio
+import json
 
+import openai
 from tqdm.asyncio import tqdm_asyncio
 
 from toolkit.AI.base_batch_async import BaseBatchAsync
 from toolkit.AI.client import OpenAIClient
-from toolkit.AI.defaults import DEFAULT_CONCURRENT_COROUTINES
+from toolkit.AI.defaults import DEFAULT_CONCURRENT_COROUTINES, DEFAULT_RATE_LIMIT_RETRIES
+from toolkit.AI.rate_scheduler import get_retry_after, scheduler_registry
+from toolkit.AI.tokenizers import get_encoder
 from toolkit.helpers.decorators import retry_with_backoff
 from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
 
 
 class BaseChat(BaseBatchAsync, OpenAIClient):
     def __init__(
-        self, configuration=None, concurrent_coroutines=DEFAULT_CONCURRENT_COROUTINES
+        self,
+        configuration=None,
+        concurrent_coroutines=DEFAULT_CONCURRENT_COROUTINES,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
     ) -> None:
         OpenAIClient.__init__(self, configuration)
-        self.semaphore = asyncio.Semaphore(concurrent_coroutines)
+        # shared with every other chat client of the deployment
+        self.scheduler = scheduler_registry.get_scheduler(
+            self.configuration,
+            requests_per_minute=requests_per_minute
+            or self.configuration.requests_per_minute,
+            tokens_per_minute=tokens_per_minute or self.configuration.tokens_per_minute,
+            max_concurrency=concurrent_coroutines,
+        )
+
+    def estimate_tokens(self, messages, llm_kwargs) -> int:
+        """Estimate the tokens a request counts against the budget: its prompt plus max_tokens."""
+        if self.scheduler.tokens_per_minute is None:
+            return 0
+        max_tokens = llm_kwargs.get("max_tokens", self.configuration.max_tokens) or 0
+        text = json.dumps(messages)
+        try:
+            prompt_tokens = len(get_encoder().encode(text))
+        except Exception:
+            # without encoding data, assume about four characters per token
+            prompt_tokens = len(text) // 4
+        return prompt_tokens + max_tokens
 
-    @retry_with_backoff()
+    @retry_with_backoff(retries=DEFAULT_RATE_LIMIT_RETRIES)
     async def generate_text_async(self, messages, callbacks, **llm_kwargs):
-        async with self.semaphore:
-            try:
-                chat = await self.generate_chat_async(messages, **llm_kwargs)
-                if callbacks:
-                    self.progress_callback()
-            except Exception as e:
-                print(f"Error validating report: {e}")
-                msg = f"Problem in OpenAI response. {e}"
-                raise Exception(msg) from e
-            return chat
-
-    @retry_with_backoff()
+        record = await self.scheduler.acquire(self.estimate_tokens(messages, llm_kwargs))
+        usage = None
+        succeeded = False
+        try:
+            chat, usage = await self.generate_chat_with_usage_async(
+                messages, **llm_kwargs
+            )
+            succeeded = True
+        except openai.RateLimitError as e:
+            # pauses later attempts, which the retry decorator makes
+            self.scheduler.throttle(record, get_retry_after(e))
+            record = None
+            print(f"Error validating report: {e}")
+            msg = f"Problem in OpenAI response. {e}"
+            raise Exception(msg) from e
+        except Exception as e:
+            print(f"Error validating report: {e}")
+            msg = f"Problem in OpenAI response. {e}"
+            raise Exception(msg) from e
+        finally:
+            # also runs on cancellation, which is not an Exception
+            if record is not None:
+                if succeeded:
+                    self.scheduler.release(record, getattr(usage, "total_tokens", None))
+                else:
+                    self.scheduler.fail(record)
+        if callbacks:
+            self.progress_callback()
+        return chat
+
     async def generate_texts_async(
         self,
         messages_list: list[list[dict[str, str]]],
         callbacks: list[ProgressBatchCallback] | None = None,
         **llm_kwargs,
     ):
-        self.total_tasks = len(messages_list)
+        self.start_progress(len(messages_list))
         tasks = [
             asyncio.create_task(
                 self.generate_text_async(messages, callbacks, **llm_kwargs)
@@ -54,3 +100,36 @@ class BaseChat(BaseBatchAsync, OpenAIClient):
         if callbacks:
             await progress_task
         return result
+
+    async def generate_texts_as_completed(
+        self,
+        messages_list: list[list[dict[str, str]]],
+        callbacks: list[ProgressBatchCallback] | None = None,
+        **llm_kwargs,
+    ):
+        """
+        Yield (index, response) pairs as each request finishes, rather than all at once.
+
+        Closing the generator early, e.g. with contextlib.aclosing, cancels the outstanding requests.
+        """
+        self.start_progress(len(messages_list))
+
+        async def generate_indexed(index, messages):
+            return index, await self.generate_text_async(messages, callbacks, **llm_kwargs)
+
+        tasks = [
+            asyncio.create_task(generate_indexed(index, messages))
+            for index, messages in enumerate(messages_list)
+        ]
+        if callbacks:
+            progress_task = asyncio.create_task(self.track_progress(tasks, callbacks))
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+            if callbacks:
+                await progress_task
+        finally:
+            outstanding = [task for task in tasks if not task.done()]
+            for task in outstanding:
+                task.cancel()
+            await asyncio.gather(*outstanding, return_exceptions=True)
@@ -4,11 +4,13 @@
 import asyncio
 import json
 import logging
+import time
 from abc import ABC, abstractmethod
 from typing import Any
 
 import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 from tqdm.asyncio import tqdm_asyncio
 
 from toolkit.AI.base_batch_async import BaseBatchAsync
@@ -17,15 +19,27 @@ from toolkit.AI.defaults import (
     DEFAULT_CONCURRENT_COROUTINES,
     DEFAULT_LLM_MAX_TOKENS,
     EMBEDDING_BATCHES_NUMBER,
+    EMBEDDING_REQUEST_MAX_TEXTS,
+    EMBEDDING_REQUEST_MAX_TOKENS,
+)
+from toolkit.AI.utils import (
+    get_token_count,
+    get_token_counts,
+    hash_text,
+    hash_texts,
+)
+from toolkit.AI.vector_store import (
+    VectorStore,
+    to_vector_array,
+    to_vector_matrix,
 )
-from toolkit.AI.utils import get_token_count, hash_text
-from toolkit.AI.vector_store import VectorStore
 from toolkit.helpers.constants import CACHE_PATH
-from toolkit.helpers.decorators import retry_with_backoff
+from toolkit.helpers.decorators import is_retryable, retry_with_backoff
 from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
 
 logger = logging.getLogger(__name__)
 
+# Legacy cache format; new caches use embedding_schema(dimension)
 schema = pa.schema(
     [
         pa.field("hash", pa.string()),
@@ -35,6 +49,67 @@ schema = pa.schema(
     ]
 )
 
+
+def _is_input_error(error: BaseException) -> bool:
+    """
+    Whether a failed embedding request may succeed with fewer texts: it was rejected for its input
+    (400, 413 or 422), or failed locally, e.g. returning the wrong number of embeddings.
+    """
+    if is_retryable(error):
+        return False
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code is None or status_code in (400, 413, 422)
+
+
+def embedding_schema(dimension: int) -> pa.Schema:
+    return pa.schema(
+        [
+            pa.field("hash", pa.string()),
+            pa.field("text", pa.string()),
+            pa.field("vector", pa.list_(pa.float32(), dimension)),
+            pa.field("additional_details", pa.string()),
+        ]
+    )
+
+
+def migrate_embedding_cache(db_name: str = "embeddings", db_path=CACHE_PATH) -> int:
+    """
+    Rewrite a legacy float64 cache table as float32 fixed-size vectors.
+
+    Rows whose vector length differs from the most common one (e.g. written by
+    another embedding model) cannot be stored in the fixed-size format and are
+    dropped. Returns the number of rows migrated.
+    """
+    vector_store = VectorStore(db_name, db_path, index_column="hash")
+    if vector_store.table is None:
+        return 0
+    if pa.types.is_fixed_size_list(vector_store.table.schema.field("vector").type):
+        return 0
+    dataset = vector_store.table.to_lance()
+    lengths = pc.list_value_length(dataset.to_table(columns=["vector"])["vector"])
+    if len(lengths) == 0:
+        return 0
+    counts = pc.value_counts(lengths).to_pylist()
+    dimension = max(counts, key=lambda x: x["counts"])["values"]
+    target_schema = embedding_schema(dimension)
+
+    def migrated_batches():
+        for batch in dataset.to_batches():
+            batch_lengths = pc.list_value_length(batch["vector"])
+            batch = batch.filter(pc.equal(batch_lengths, dimension))
+            yield from pa.Table.from_batches([batch]).cast(target_schema).to_batches()
+
+    migrated = sum(x["counts"] for x in counts if x["values"] == dimension)
+    logger.info("Migrating %s rows of %s to %s dims", migrated, db_name, dimension)
+    vector_store.overwrite(
+        pa.RecordBatchReader.from_batches(target_schema, migrated_batches()),
+        target_schema,
+    )
+    return migrated
+
+
 class BaseEmbedder(ABC, BaseBatchAsync):
     def __init__(
         self,
@@ -42,9 +117,13 @@ class BaseEmbedder(ABC, BaseBatchAsync):
         db_path=CACHE_PATH,
         max_tokens=DEFAULT_LLM_MAX_TOKENS,
         concurrent_coroutines=DEFAULT_CONCURRENT_COROUTINES,
+        max_batch_texts=EMBEDDING_REQUEST_MAX_TEXTS,
+        max_batch_tokens=EMBEDDING_REQUEST_MAX_TOKENS,
     ) -> None:
-        self.vector_store = VectorStore(db_name, db_path, schema)
+        self.vector_store = VectorStore(db_name, db_path, index_column="hash")
         self.max_tokens = max_tokens
+        self.max_batch_texts = max_batch_texts
+        self.max_batch_tokens = max_batch_tokens
         self.semaphore = asyncio.Semaphore(concurrent_coroutines)
 
     @retry_with_backoff()
@@ -81,18 +160,123 @@ class BaseEmbedder(ABC, BaseBatchAsync):
                 self.progress_callback()
             return embedding, data
 
+    def _prepare_batch_item(self, data: VectorData, tokens: int | None = None) -> int:
+        """Hash, truncate and serialize an item in place, returning its token count."""
+        if not data.get("hash"):
+            data["hash"] = hash_text(data["text"])
+        try:
+            if tokens is None:
+                tokens = get_token_count(data["text"])
+            if tokens > self.max_tokens:
+                data["text"] = data["text"][: self.max_tokens]
+                tokens = get_token_count(data["text"])
+                logger.info("Truncated text to max tokens")
+        except Exception:
+            tokens = len(data["text"])
+        data["additional_details"] = json.dumps(
+            data["additional_details"] if "additional_details" in data else {}
+        )
+        return tokens
+
+    def pack_batches(self, data: list[VectorData]) -> list[list[VectorData]]:
+        """Pack items into request batches bounded by text count and total tokens."""
+        batches = []
+        batch = []
+        batch_tokens = 0
+        try:
+            item_tokens = get_token_counts([item["text"] for item in data])
+        except Exception:
+            item_tokens = [None] * len(data)
+        for item, tokens in zip(data, item_tokens):
+            tokens = self._prepare_batch_item(item, tokens)
+            if len(batch) > 0 and (
+                len(batch) >= self.max_batch_texts
+                or batch_tokens + tokens > self.max_batch_tokens
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += tokens
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    @retry_with_backoff()
+    async def _request_embeddings_async(self, texts: list[str]) -> list[list[float]]:
+        async with self.semaphore:
+            return await asyncio.wait_for(
+                self._generate_embeddings_async(texts), timeout=90
+            )
+
+    async def embed_batch_async(
+        self,
+        batch: list[VectorData],
+        has_callback=False,
+    ) -> list[VectorData]:
+        """
+        Embed a packed batch in one request, splitting it in half if the request is rejected for its
+        input. Transient failures are retried by _request_embeddings_async and then raised.
+        """
+        try:
+            embeddings = await self._request_embeddings_async(
+                [item["text"] for item in batch]
+            )
+            if len(embeddings) != len(batch):
+                msg = f"Expected {len(batch)} embeddings, got {len(embeddings)}"
+                raise ValueError(msg)
+        except Exception as e:
+            if len(batch) == 1 or not _is_input_error(e):
+                msg = f"Problem in embedding generation. {e}"
+                raise Exception(msg) from e
+            logger.info("Splitting failed batch of %s texts: %s", len(batch), e)
+            middle = len(batch) // 2
+            first, second = await asyncio.gather(
+                self.embed_batch_async(batch[:middle], has_callback),
+                self.embed_batch_async(batch[middle:], has_callback),
+            )
+            return first + second
+
+        for item, embedding in zip(batch, embeddings, strict=True):
+            item["vector"] = embedding
+        if has_callback:
+            self.progress_callback(len(batch))
+        return batch
+
+    def _save_embeddings(self, items: list[VectorData], vectors: np.ndarray) -> None:
+        """Store items with their (n, dim) vectors, creating the table if needed."""
+        table = pa.table(
+            {
+                "hash": [item["hash"] for item in items],
+                "text": [item["text"] for item in items],
+                "vector": to_vector_array(vectors),
+                "additional_details": [item["additional_details"] for item in items],
+            }
+        )
+        if self.vector_store.table is None:
+            self.vector_store.create_table(embedding_schema(vectors.shape[1]))
+        try:
+            table = table.cast(self.vector_store.table.schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            # e.g. a cache written by a model with another dimension
+            logger.warning("Not caching embeddings: %s", e)
+            return
+        self.vector_store.save(table)
+
+    def _search_cache(self, hashes: list[str]) -> pa.Table:
+        if self.vector_store.table is None:
+            return pa.table({"hash": pa.array([], pa.string())})
+        return self.vector_store.search_many(list(dict.fromkeys(hashes)))
+
     @retry_with_backoff()
     def embed_store_one(
         self, text: str, cache_data=True, additional_detail: Any = "{}"
     ) -> Any | list[float]:
         text_hashed = hash_text(text)
-        existing_embedding = (
-            self.vector_store.search_by_column(text_hashed, "hash")
-            if cache_data
-            else []
-        )
-        if len(existing_embedding) > 0:
-            return existing_embedding.get("vector")[0]
+        if cache_data:
+            existing = self._search_cache([text_hashed])
+            if existing.num_rows > 0:
+                return to_vector_matrix(existing["vector"])[0]
 
         tokens = get_token_count(text)
         if tokens > self.max_tokens:
@@ -107,55 +291,76 @@ class BaseEmbedder(ABC, BaseBatchAsync):
                 "vector": embedding,
                 "additional_details": json.dumps(additional_detail),
             }
-            self.vector_store.save([data]) if cache_data else None
+            if cache_data:
+                vectors = np.array([embedding], dtype=np.float32)
+                self._save_embeddings([data], vectors)
         except Exception as e:
             msg = f"Problem in embedding generation. {e}"
             raise Exception(msg)
         return embedding
 
-    @retry_with_backoff()
     async def embed_store_many(
         self,
         data: list[VectorData],
         callbacks: list[ProgressBatchCallback] | None = None,
         cache_data=True,
-    ) -> np.ndarray[Any, np.dtype[Any]]:
-        self.total_tasks = len(data)
-        final_embeddings = []
-        loaded_texts = []
+        batched=True,
+        aligned=False,
+    ) -> list[VectorData] | np.ndarray:
+        """
+        Embed items, loading those already in the cache and storing the new ones.
+
+        Returns the embedded items, or with aligned=True an (n, dim) float32 matrix whose rows
+        are the vectors of the input items in input order. Each embedding request is retried on
+        its own, so the call as a whole is not: retrying it would request every batch again.
+        """
+        self.start_progress(len(data))
+        start_time = time.perf_counter()
+        loaded_count = 0
+        new_count = 0
         all_data = []
+        batch_matrices = []
 
         for i in range(0, len(data), (EMBEDDING_BATCHES_NUMBER)):
             batch_data = data[i : i + (EMBEDDING_BATCHES_NUMBER)]
+            new_items = batch_data
+            new_positions = list(range(len(batch_data)))
+            hash_all_texts: list[str] = []
+            hash_to_cached = {}
 
             if cache_data:
-                hash_all_texts = [hash_text(item["text"]) for item in batch_data]
-                existing = self.vector_store.search_by_column(hash_all_texts, "hash")
-
-                if len(existing.get("vector")) > 0 and cache_data:
-                    existing_texts = existing.sort_values("text")
-                    for item in existing_texts.to_numpy():
-                        all_data.append(
-                            {
-                                "hash": item[0],
-                                "text": item[1],
-                                "vector": item[2],
-                                "additional_details": item[3]
-                                if len(item) > 3
-                                else "{}",
-                            }
-                        )
-                        loaded_texts.append(item[1])
-                        final_embeddings.append(item[2])
-
-            new_items = [
-                item for item in batch_data if item["text"] not in loaded_texts
-            ]
+                hash_all_texts = hash_texts([item["text"] for item in batch_data])
+                existing = self._search_cache(hash_all_texts)
+
+                if existing.num_rows > 0:
+                    cached_vectors = to_vector_matrix(existing["vector"])
+                    columns = ["hash", "text", "additional_details"]
+                    for item, vector in zip(
+                        existing.select(columns).to_pylist(), cached_vectors, strict=True
+                    ):
+                        item["vector"] = vector
+                        all_data.append(item)
+                        hash_to_cached[item["hash"]] = vector
+                    loaded_count += existing.num_rows
+                    new_positions = [
+                        position
+                        for position, text_hash in enumerate(hash_all_texts)
+                        if text_hash not in hash_to_cached
+                    ]
+                    new_items = [batch_data[position] for position in new_positions]
+
+            vectors = None
             if len(new_items) > 0:
-                tasks = [
-                    asyncio.create_task(self.embed_one_async(item, callbacks))
-                    for item in new_items
-                ]
+                if batched:
+                    tasks = [
+                        asyncio.create_task(self.embed_batch_async(batch, callbacks))
+                        for batch in self.pack_batches(new_items)
+                    ]
+                else:
+                    tasks = [
+                        asyncio.create_task(self.embed_one_async(item, callbacks))
+                        for item in new_items
+                    ]
                 if callbacks:
                     progress_task = asyncio.create_task(
                         self.track_progress(tasks, callbacks)
@@ -163,22 +368,56 @@ class BaseEmbedder(ABC, BaseBatchAsync):
                 result = await tqdm_asyncio.gather(*tasks)
                 if callbacks:
                     await progress_task
-                embeddings = [embedding[0] for embedding in result]
-                new_data = [embedding[1] for embedding in result]
+                if batched:
+                    new_data = [item for batch in result for item in batch]
+                else:
+                    new_data = [embedding[1] for embedding in result]
+                vectors = np.array(
+                    [item["vector"] for item in new_data], dtype=np.float32
+                )
+                for item, vector in zip(new_data, vectors, strict=True):
+                    item["vector"] = vector
                 all_data.extend(new_data)
+                new_count += len(new_data)
 
-                final_embeddings.extend(embeddings)
                 if cache_data:
-                    self.vector_store.save(new_data)
-                    self.vector_store.update_duckdb_data()
+                    self._save_embeddings(new_data, vectors)
+
+            if aligned:
+                # new_data keeps the order of new_items, so rows map back by position
+                batch_matrix = np.empty(
+                    (len(batch_data), self._vector_dimension(vectors, hash_to_cached)),
+                    dtype=np.float32,
+                )
+                if vectors is not None:
+                    batch_matrix[new_positions] = vectors
+                for position, text_hash in enumerate(hash_all_texts):
+                    if text_hash in hash_to_cached:
+                        batch_matrix[position] = hash_to_cached[text_hash]
+                batch_matrices.append(batch_matrix)
 
-        print(f"Got {len(loaded_texts)} existing texts")
-        logger.info("Got %s existing texts", len(loaded_texts))
-        print(f"Got {len(final_embeddings) - len(loaded_texts)} new texts")
-        logger.info("Got %s new texts", len(final_embeddings) - len(loaded_texts))
+        print(f"Got {loaded_count} existing texts")
+        logger.info("Got %s existing texts", loaded_count)
+        print(f"Got {new_count} new texts")
+        logger.info("Got %s new texts", new_count)
+        elapsed = time.perf_counter() - start_time
+        if new_count > 0 and elapsed > 0:
+            rate = new_count / elapsed
+            print(f"Embedded {new_count} texts at {rate:.1f} texts/sec")
+            logger.info("Embedded %s texts at %.1f texts/sec", new_count, rate)
 
+        if aligned:
+            if len(batch_matrices) == 0:
+                return np.empty((0, 0), dtype=np.float32)
+            return np.vstack(batch_matrices)
         return all_data
 
+    @staticmethod
+    def _vector_dimension(vectors: np.ndarray | None, hash_to_cached: dict) -> int:
+        if vectors is not None:
+            return vectors.shape[1]
+        return len(next(iter(hash_to_cached.values())))
+
     @abstractmethod
     def _generate_embedding(self, text: str) -> list[float]:
         """Generate an embedding for a single text"""
@@ -186,3 +425,7 @@ class BaseEmbedder(ABC, BaseBatchAsync):
     @abstractmethod
     async def _generate_embedding_async(self, text: str) -> list:
         """Generate async embeddings for text"""
+
+    async def _generate_embeddings_async(self, texts: list[str]) -> list[list[float]]:
+        """Generate async embeddings for a batch of texts, in input order"""
+        return [await self._generate_embedding_async(text) for text in texts]
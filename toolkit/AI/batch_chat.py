@@ -0,0 +1,173 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+import json
+import logging
+
+from toolkit.AI.base_batch_async import BaseBatchAsync
+from toolkit.AI.base_chat import BaseChat
+from toolkit.AI.client import OpenAIClient
+from toolkit.AI.defaults import (
+    DEFAULT_BATCH_COMPLETION_WINDOW,
+    DEFAULT_BATCH_MAX_REQUESTS,
+    DEFAULT_BATCH_POLL_INTERVAL,
+)
+from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
+
+logger = logging.getLogger(__name__)
+
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchChat(BaseBatchAsync, OpenAIClient):
+    """
+    Runs independent chat requests through an OpenAI-style batch endpoint instead of in real time.
+
+    Requests are written to JSONL files of up to max_requests lines, uploaded and submitted as
+    batches, which are polled until they finish. Responses are mapped back to request order, and
+    requests the batch did not complete are re-run in real time.
+    """
+
+    def __init__(
+        self,
+        configuration=None,
+        poll_interval: float = DEFAULT_BATCH_POLL_INTERVAL,
+        max_requests: int = DEFAULT_BATCH_MAX_REQUESTS,
+        completion_window: str = DEFAULT_BATCH_COMPLETION_WINDOW,
+    ) -> None:
+        OpenAIClient.__init__(self, configuration)
+        self.poll_interval = poll_interval
+        self.max_requests = max_requests
+        self.completion_window = completion_window
+
+    @property
+    def chat_completions_url(self) -> str:
+        if self.configuration.api_type == "Azure OpenAI":
+            return "/chat/completions"
+        return "/v1/chat/completions"
+
+    def build_batch_file(
+        self, messages_list: list[list[dict[str, str]]], offset: int = 0, **llm_kwargs
+    ) -> bytes:
+        """Write chat requests as batch JSONL lines, with custom ids giving their positions."""
+        llm_kwargs.pop("stream", None)
+        body = {
+            "model": self.configuration.model,
+            "temperature": llm_kwargs.pop("temperature", self.configuration.temperature),
+            "max_tokens": llm_kwargs.pop("max_tokens", self.configuration.max_tokens),
+            **llm_kwargs,
+        }
+        lines = [
+            json.dumps(
+                {
+                    "custom_id": f"request-{offset + mx}",
+                    "method": "POST",
+                    "url": self.chat_completions_url,
+                    "body": {**body, "messages": messages},
+                }
+            )
+            for mx, messages in enumerate(messages_list)
+        ]
+        return ("\n".join(lines) + "\n").encode()
+
+    async def submit_batch(
+        self, messages_list: list[list[dict[str, str]]], offset: int = 0, **llm_kwargs
+    ) -> dict:
+        batch_file = self.build_batch_file(messages_list, offset, **llm_kwargs)
+        uploaded = await self.async_client.files.create(
+            file=("batch.jsonl", batch_file), purpose="batch"
+        )
+        batch = await self.async_client.post(
+            "/batches",
+            body={
+                "input_file_id": uploaded.id,
+                "endpoint": self.chat_completions_url,
+                "completion_window": self.completion_window,
+            },
+            cast_to=object,
+        )
+        logger.info("Submitted batch %s of %s requests", batch["id"], len(messages_list))
+        return batch
+
+    async def get_batch(self, batch_id: str) -> dict:
+        return await self.async_client.get(f"/batches/{batch_id}", cast_to=object)
+
+    async def wait_for_batch(self, batch_id: str, on_poll=None) -> dict:
+        """Poll a batch until it reaches a terminal status, calling on_poll with each state."""
+        while True:
+            batch = await self.get_batch(batch_id)
+            if on_poll is not None:
+                on_poll(batch)
+            if batch["status"] in BATCH_TERMINAL_STATUSES:
+                return batch
+            await asyncio.sleep(self.poll_interval)
+
+    async def read_batch_results(self, batch: dict) -> dict[int, str]:
+        """Map the successful responses of a finished batch to the positions of their requests."""
+        results = {}
+        for file_id in [batch.get("output_file_id"), batch.get("error_file_id")]:
+            if not file_id:
+                continue
+            content = await self.async_client.files.content(file_id)
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    logger.warning(
+                        "Batch request %s failed: %s",
+                        result.get("custom_id"),
+                        result.get("error") or response.get("body"),
+                    )
+                    continue
+                index = int(result["custom_id"].removeprefix("request-"))
+                choice = response["body"]["choices"][0]
+                results[index] = choice["message"]["content"] or ""
+        return results
+
+    async def generate_texts_async(
+        self,
+        messages_list: list[list[dict[str, str]]],
+        callbacks: list[ProgressBatchCallback] | None = None,
+        **llm_kwargs,
+    ) -> list[str]:
+        self.start_progress(len(messages_list))
+        batches = [
+            await self.submit_batch(
+                messages_list[offset : offset + self.max_requests],
+                offset,
+                **llm_kwargs,
+            )
+            for offset in range(0, len(messages_list), self.max_requests)
+        ]
+        batch_to_completed = {}
+
+        def on_poll(batch):
+            counts = batch.get("request_counts") or {}
+            completed = counts.get("completed", 0) + counts.get("failed", 0)
+            self.progress_callback(completed - batch_to_completed.get(batch["id"], 0))
+            batch_to_completed[batch["id"]] = completed
+            if callbacks:
+                self.progress.report(callbacks)
+
+        finished = await asyncio.gather(
+            *[self.wait_for_batch(batch["id"], on_poll) for batch in batches]
+        )
+        results = {}
+        for batch in finished:
+            if batch["status"] == "failed":
+                msg = f"Batch {batch['id']} failed: {batch.get('errors')}"
+                raise Exception(msg)
+            results.update(await self.read_batch_results(batch))
+
+        missing = [mx for mx in range(len(messages_list)) if mx not in results]
+        if len(missing) > 0:
+            logger.info("Re-running %s incomplete batch requests in real time", len(missing))
+            realtime_chat = BaseChat(self.configuration)
+            responses = await realtime_chat.generate_texts_async(
+                [messages_list[mx] for mx in missing], **llm_kwargs
+            )
+            results.update(zip(missing, responses))
+        return [results[mx] for mx in range(len(messages_list))]
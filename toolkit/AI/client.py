@@ -3,13 +3,12 @@
 #
 import logging
 
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
-
 from toolkit.AI.classes import LLMCallback
 
-from .defaults import API_BASE_REQUIRED_FOR_AZURE, DEFAULT_EMBEDDING_MODEL
+from .client_registry import client_registry
+from .defaults import DEFAULT_EMBEDDING_MODEL
 from .openai_configuration import OpenAIConfiguration
+from .response_cache import get_response_cache, request_key
 
 log = logging.getLogger(__name__)
 
@@ -18,61 +17,36 @@ class OpenAIClient:
 
     _client = None
     _async_client = None
+    response_cache = None
 
     def __init__(self, configuration: OpenAIConfiguration | None = None) -> None:
         self.configuration = configuration or OpenAIConfiguration()
+        if self.configuration.response_cache:
+            self.response_cache = get_response_cache()
         self._create_openai_client()
 
+    def _response_cache_key(self, messages, temperature, max_tokens, kwargs) -> str | None:
+        """Key a chat request in the response cache; only deterministic requests are cached."""
+        if self.response_cache is None or temperature != 0:
+            return None
+        return request_key(
+            model=self.configuration.model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            messages=messages,
+            **kwargs,
+        )
+
     def _create_openai_client(self) -> None:
-        """Create a new OpenAI client instance."""
-        if self.configuration.api_type == "Azure OpenAI":
-            api_base = self.configuration.api_base
-            if api_base is None:
-                raise ValueError(API_BASE_REQUIRED_FOR_AZURE)
-            log.info(
-                "Creating Azure OpenAI client api_base=%s",
-                api_base,
-            )
+        """Get the shared OpenAI client instance for the configuration."""
+        self._client = client_registry.get_client(self.configuration)
 
-            if self.configuration.az_auth_type == "Managed Identity":
-                token_provider = get_bearer_token_provider(
-                    DefaultAzureCredential(),
-                    "https://cognitiveservices.azure.com/.default",
-                )
-
-                self._client = AzureOpenAI(
-                    api_version=self.configuration.api_version,
-                    # Azure-Specifics
-                    azure_ad_token_provider=token_provider,
-                    azure_endpoint=api_base,
-                )
-                self._async_client = AsyncAzureOpenAI(
-                    api_version=self.configuration.api_version,
-                    # Azure-Specifics
-                    azure_ad_token_provider=token_provider,
-                    azure_endpoint=api_base,
-                )
-            else:
-                self._client = AsyncAzureOpenAI(
-                    api_version=self.configuration.api_version,
-                    # Azure-Specifics
-                    azure_endpoint=api_base,
-                    api_key=self.configuration.api_key,
-                )
-                self._async_client = AzureOpenAI(
-                    api_version=self.configuration.api_version,
-                    # Azure-Specifics
-                    azure_endpoint=api_base,
-                    api_key=self.configuration.api_key,
-                )
-        else:
-            log.info("Creating OpenAI client")
-            self._client = OpenAI(
-                api_key=self.configuration.api_key,
-            )
-            self._async_client = AsyncOpenAI(
-                api_key=self.configuration.api_key,
-            )
+    @property
+    def async_client(self):
+        """The async OpenAI client, shared per configuration on the running event loop."""
+        if self._async_client is not None:
+            return self._async_client
+        return client_registry.get_async_client(self.configuration)
 
     def generate_chat(
         self,
@@ -92,6 +66,13 @@ class OpenAIClient:
                 kwargs.pop("temperature")
             else:
                 temperature = self.configuration.temperature
+            cache_key = self._response_cache_key(messages, temperature, max_tokens, kwargs)
+            if cache_key is not None:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    for callback in callbacks or []:
+                        callback.on_llm_new_token(cached)
+                    return cached
             response = self._client.chat.completions.create(
                 model=self.configuration.model,
                 temperature=temperature,
@@ -112,9 +93,11 @@ class OpenAIClient:
                                 show += "▌"
                             for callback in callbacks:
                                 callback.on_llm_new_token(show)
-                return full_response
-
-            return response.choices[0].message.content or ""  # type: ignore
+            else:
+                full_response = response.choices[0].message.content or ""  # type: ignore
+            if cache_key is not None:
+                self.response_cache.set(cache_key, full_response)
+            return full_response
         except Exception as e:
             print(f"Error validating report: {e}")
             msg = f"Problem in OpenAI response. {e}"
@@ -125,6 +108,15 @@ class OpenAIClient:
         messages: list[str],
         **kwargs,
     ):
+        content, _ = await self.generate_chat_with_usage_async(messages, **kwargs)
+        return content
+
+    async def generate_chat_with_usage_async(
+        self,
+        messages: list[str],
+        **kwargs,
+    ):
+        """Generate a chat response, also returning its token usage (None when served from cache)."""
         if "max_tokens" in kwargs.keys():
             max_tokens = kwargs["max_tokens"]
             kwargs.pop("max_tokens")
@@ -137,7 +129,12 @@ class OpenAIClient:
             temperature = self.configuration.temperature
         if "stream" in kwargs.keys():
             kwargs.pop("stream")
-        response = await self._async_client.chat.completions.create(
+        cache_key = self._response_cache_key(messages, temperature, max_tokens, kwargs)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached, None
+        response = await self.async_client.chat.completions.create(
             model=self.configuration.model,
             temperature=temperature,
             max_tokens=max_tokens,
@@ -145,7 +142,10 @@ class OpenAIClient:
             stream=False,
             **kwargs,
         )
-        return response.choices[0].message.content or ""  # type: ignore
+        content = response.choices[0].message.content or ""  # type: ignore
+        if cache_key is not None:
+            self.response_cache.set(cache_key, content)
+        return content, getattr(response, "usage", None)
 
     def generate_embedding(
         self, text: str, model: str = DEFAULT_EMBEDDING_MODEL
@@ -161,5 +161,11 @@ class OpenAIClient:
     async def generate_embedding_async(
         self, text: list[str], model: str = DEFAULT_EMBEDDING_MODEL
     ) -> list[float]:
-        embedding = await self._async_client.embeddings.create(input=text, model=model)
-        return embedding.data[0].embedding
\ No newline at end of file
+        embedding = await self.async_client.embeddings.create(input=text, model=model)
+        return embedding.data[0].embedding
+
+    async def generate_embeddings_async(
+        self, texts: list[str], model: str = DEFAULT_EMBEDDING_MODEL
+    ) -> list[list[float]]:
+        response = await self.async_client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda x: x.index)]
@@ -0,0 +1,149 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+import importlib.util
+import logging
+import threading
+import weakref
+
+import httpx
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
+
+from .defaults import (
+    API_BASE_REQUIRED_FOR_AZURE,
+    DEFAULT_HTTP_KEEPALIVE_EXPIRY,
+    DEFAULT_HTTP_MAX_CONNECTIONS,
+    DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+)
+from .openai_configuration import OpenAIConfiguration
+
+log = logging.getLogger(__name__)
+
+AZURE_TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of OpenAI clients, keyed by connection configuration.
+
+    Clients with the same endpoint and credentials share one pooled HTTP client, and Managed
+    Identity clients share one token provider. Async clients are kept per event loop, as their
+    connections cannot be used from another loop.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_HTTP_KEEPALIVE_EXPIRY,
+        http2: bool | None = None,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._token_provider = None
+        self.configure(max_connections, max_keepalive_connections, keepalive_expiry, http2)
+
+    def configure(
+        self,
+        max_connections: int = DEFAULT_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = DEFAULT_HTTP_KEEPALIVE_EXPIRY,
+        http2: bool | None = None,
+    ) -> None:
+        """
+        Set the connection pool limits for clients created from now on, dropping existing clients.
+
+        HTTP/2 is used by default when the optional h2 package is installed.
+        """
+        with self._lock:
+            self.limits = httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            )
+            self.http2 = (
+                importlib.util.find_spec("h2") is not None if http2 is None else http2
+            )
+            self._clients = {}
+            self._async_clients = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def configuration_key(configuration: OpenAIConfiguration) -> tuple:
+        return (
+            configuration.api_type,
+            configuration.api_base,
+            configuration.api_version,
+            configuration.az_auth_type,
+            configuration.api_key,
+        )
+
+    def get_token_provider(self):
+        with self._lock:
+            if self._token_provider is None:
+                self._token_provider = get_bearer_token_provider(
+                    DefaultAzureCredential(), AZURE_TOKEN_SCOPE
+                )
+            return self._token_provider
+
+    def get_client(self, configuration: OpenAIConfiguration) -> OpenAI | AzureOpenAI:
+        key = self.configuration_key(configuration)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._create_client(configuration, is_async=False)
+            with self._lock:
+                client = self._clients.setdefault(key, client)
+        return client
+
+    def get_async_client(
+        self, configuration: OpenAIConfiguration
+    ) -> AsyncOpenAI | AsyncAzureOpenAI:
+        """Return the async client for the configuration on the running event loop."""
+        loop = asyncio.get_running_loop()
+        key = self.configuration_key(configuration)
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = clients.setdefault(
+                key, self._create_client(configuration, is_async=True)
+            )
+        return client
+
+    def _create_client(self, configuration: OpenAIConfiguration, is_async: bool):
+        http_client_class = httpx.AsyncClient if is_async else httpx.Client
+        http_client = http_client_class(
+            limits=self.limits, http2=self.http2, follow_redirects=True
+        )
+        if configuration.api_type == "Azure OpenAI":
+            api_base = configuration.api_base
+            if api_base is None:
+                raise ValueError(API_BASE_REQUIRED_FOR_AZURE)
+            log.info("Creating Azure OpenAI client api_base=%s", api_base)
+            client_class = AsyncAzureOpenAI if is_async else AzureOpenAI
+            if configuration.az_auth_type == "Managed Identity":
+                return client_class(
+                    api_version=configuration.api_version,
+                    # Azure-Specifics
+                    azure_ad_token_provider=self.get_token_provider(),
+                    azure_endpoint=api_base,
+                    http_client=http_client,
+                )
+            return client_class(
+                api_version=configuration.api_version,
+                # Azure-Specifics
+                azure_endpoint=api_base,
+                api_key=configuration.api_key,
+                http_client=http_client,
+            )
+        log.info("Creating OpenAI client")
+        client_class = AsyncOpenAI if is_async else OpenAI
+        return client_class(api_key=configuration.api_key, http_client=http_client)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clients = {}
+            self._async_clients = weakref.WeakKeyDictionary()
+
+
+client_registry = ClientRegistry()
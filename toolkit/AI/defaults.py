@@ -8,6 +8,8 @@ DEFAULT_LLM_MODEL = "gpt-4o"
 DEFAULT_LLM_MAX_TOKENS = 4000
 DEFAULT_AZ_AUTH_TYPE = "Azure Key"
 EMBEDDING_BATCHES_NUMBER = 600
+EMBEDDING_REQUEST_MAX_TEXTS = 256
+EMBEDDING_REQUEST_MAX_TOKENS = 100000
 #
 # Text Embedding Parameters
 DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
@@ -15,6 +17,7 @@ DEFAULT_TEMPERATURE = 0
 DEFAULT_MAX_INPUT_TOKENS = 128000
 DEFAULT_OPENAI_VERSION = "2023-12-01-preview"
 DEFAULT_LOCAL_EMBEDDING_MODEL = "all-distilroberta-v1"
+DEFAULT_LOCAL_EMBEDDING_BATCH_SIZE = 32
 
 API_BASE_REQUIRED_FOR_AZURE = "api_base is required for Azure OpenAI client"
 
@@ -22,5 +25,19 @@ CHUNK_SIZE = 500
 CHUNK_OVERLAP = 0
 
 DEFAULT_REPORT_BATCH_SIZE = 100
+HASH_CHUNK_SIZE = 10000
 
 DEFAULT_CONCURRENT_COROUTINES = 50
+DEFAULT_RATE_LIMIT_RETRIES = 6
+DEFAULT_RATE_LIMIT_BACKOFF = 5
+
+DEFAULT_BATCH_POLL_INTERVAL = 30
+DEFAULT_BATCH_MAX_REQUESTS = 50000
+DEFAULT_BATCH_COMPLETION_WINDOW = "24h"
+
+DEFAULT_HTTP_MAX_CONNECTIONS = 100
+DEFAULT_HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_HTTP_KEEPALIVE_EXPIRY = 60
+
+DEFAULT_RESPONSE_CACHE_FILE = "llm_responses.sqlite"
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
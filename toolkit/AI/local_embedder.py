@@ -11,6 +11,7 @@ from toolkit.AI.base_embedder import BaseEmbedder
 from toolkit.AI.defaults import (
     DEFAULT_CONCURRENT_COROUTINES,
     DEFAULT_LLM_MAX_TOKENS,
+    DEFAULT_LOCAL_EMBEDDING_BATCH_SIZE,
     DEFAULT_LOCAL_EMBEDDING_MODEL,
 )
 from toolkit.helpers.constants import CACHE_PATH
@@ -24,9 +25,11 @@ class LocalEmbedder(BaseEmbedder):
         max_tokens=DEFAULT_LLM_MAX_TOKENS,
         concurrent_coroutines: int | None = DEFAULT_CONCURRENT_COROUTINES + 100,
         model: str | None = DEFAULT_LOCAL_EMBEDDING_MODEL,
+        encode_batch_size: int = DEFAULT_LOCAL_EMBEDDING_BATCH_SIZE,
     ):
         super().__init__(db_name, db_path, max_tokens, concurrent_coroutines)
         self.local_client = SentenceTransformer(model)
+        self.encode_batch_size = encode_batch_size
 
     def _generate_embedding(self, text: str | list[str]) -> list | Any:
         return self.local_client.encode(text).tolist()
@@ -34,4 +37,11 @@ class LocalEmbedder(BaseEmbedder):
     async def _generate_embedding_async(self, text: str) -> list | Any:
         await asyncio.sleep(0)
 
-        return self._generate_embedding(text)
\ No newline at end of file
+        return self._generate_embedding(text)
+
+    async def _generate_embeddings_async(self, texts: list[str]) -> list | Any:
+        await asyncio.sleep(0)
+
+        return self.local_client.encode(
+            texts, batch_size=self.encode_batch_size
+        ).tolist()
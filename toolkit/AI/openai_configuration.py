@@ -35,6 +35,9 @@ class OpenAIConfiguration:
     _api_type: str
     _az_auth_type: str
     _embedding_model: str
+    _response_cache: bool
+    _requests_per_minute: int | None
+    _tokens_per_minute: int | None
 
     def __init__(
         self,
@@ -58,6 +61,13 @@ class OpenAIConfiguration:
         self._embedding_model = config.get(
             "embedding_model", self._get_embedding_model()
         )
+        self._response_cache = config.get("response_cache", self._get_response_cache())
+        self._requests_per_minute = config.get(
+            "requests_per_minute", self._get_rate_limit("OPENAI_REQUESTS_PER_MINUTE")
+        )
+        self._tokens_per_minute = config.get(
+            "tokens_per_minute", self._get_rate_limit("OPENAI_TOKENS_PER_MINUTE")
+        )
 
     def _get_openai_type(self):
         return os.environ.get("OPENAI_TYPE", "OpenAI")
@@ -80,6 +90,13 @@ class OpenAIConfiguration:
     def _get_api_key(self):
         return os.environ.get("OPENAI_API_KEY", "")
 
+    def _get_response_cache(self):
+        return os.environ.get("OPENAI_RESPONSE_CACHE", "").lower() in ("1", "true")
+
+    def _get_rate_limit(self, variable: str):
+        value = os.environ.get(variable, "")
+        return int(value) if value.isdigit() else None
+
     @property
     def api_key(self) -> str:
         """API key property definition."""
@@ -125,3 +142,18 @@ class OpenAIConfiguration:
     def az_auth_type(self) -> str:
         """Type of the Azure OpenAI connection."""
         return self._az_auth_type
+
+    @property
+    def response_cache(self) -> bool:
+        """Whether deterministic chat responses are cached on disk."""
+        return self._response_cache
+
+    @property
+    def requests_per_minute(self) -> int | None:
+        """Requests allowed per minute by the deployment, if known."""
+        return self._requests_per_minute
+
+    @property
+    def tokens_per_minute(self) -> int | None:
+        """Tokens allowed per minute by the deployment, if known."""
+        return self._tokens_per_minute
@@ -31,4 +31,9 @@ class OpenAIEmbedder(BaseEmbedder):
     async def _generate_embedding_async(self, text: str) -> list[float]:
         return await self.openai_client.generate_embedding_async(
             text, model=self.configuration.embedding_model
-        )
\ No newline at end of file
+        )
+
+    async def _generate_embeddings_async(self, texts: list[str]) -> list[list[float]]:
+        return await self.openai_client.generate_embeddings_async(
+            texts, model=self.configuration.embedding_model
+        )
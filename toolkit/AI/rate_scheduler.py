@@ -0,0 +1,255 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from email.utils import parsedate_to_datetime
+
+from .client_registry import ClientRegistry
+from .defaults import (
+    DEFAULT_CONCURRENT_COROUTINES,
+    DEFAULT_RATE_LIMIT_BACKOFF,
+)
+from .openai_configuration import OpenAIConfiguration
+
+logger = logging.getLogger(__name__)
+
+RATE_WINDOW_SECONDS = 60
+
+
+def get_retry_after(error: Exception) -> float | None:
+    """Read the seconds to wait from the Retry-After headers of a throttled response, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+
+class RateLimitScheduler:
+    """
+    Admits requests within requests-per-minute and tokens-per-minute budgets, with adaptive concurrency.
+
+    Concurrency grows additively with each successful request and shrinks multiplicatively when a
+    request is throttled, when all requests also pause for the server's Retry-After time.
+    Token use is estimated on admission and corrected with the response usage. A scheduler may be
+    shared by requests on several event loops: waiting requests are woken on their own loop.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        max_concurrency: int = DEFAULT_CONCURRENT_COROUTINES,
+        min_concurrency: int = 1,
+        decrease_factor: float = 0.5,
+        backoff: float = DEFAULT_RATE_LIMIT_BACKOFF,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+        self.backoff = backoff
+        self.clock = clock
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = -math.inf
+        self.throttled_requests = 0
+        self._window = deque()
+        self._window_tokens = 0
+        self._lock = threading.Lock()
+        self._waiters = set()
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(self.min_concurrency, int(self.concurrency))
+
+    def _expire(self, now: float) -> None:
+        while self._window and self._window[0][0] <= now - RATE_WINDOW_SECONDS:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _wait_time(self, tokens: int) -> float:
+        """Seconds until the request may be admitted; inf means until a request finishes."""
+        now = self.clock()
+        self._expire(now)
+        waits = []
+        if now < self.paused_until:
+            waits.append(self.paused_until - now)
+        if self.in_flight >= self.concurrency_limit:
+            waits.append(math.inf)
+        window_full = (
+            self.requests_per_minute is not None
+            and len(self._window) >= self.requests_per_minute
+        ) or (
+            self.tokens_per_minute is not None
+            and self._window_tokens > 0
+            and self._window_tokens + tokens > self.tokens_per_minute
+        )
+        if window_full:
+            waits.append(self._window[0][0] + RATE_WINDOW_SECONDS - now)
+        if len(waits) == 0:
+            return 0
+        return min(waits)
+
+    async def acquire(self, tokens: int = 0) -> list:
+        """Wait until a request of an estimated number of tokens fits the budgets, and admit it."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    self.in_flight += 1
+                    record = [self.clock(), tokens]
+                    self._window.append(record)
+                    self._window_tokens += tokens
+                    return record
+                waiter = loop.create_future()
+                self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=None if math.isinf(wait) else wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    self._waiters.discard(waiter)
+
+    def _finish(self, record: list, used_tokens: int | None) -> None:
+        """Finish a request with the lock held, waking the waiting requests to check again."""
+        self.in_flight -= 1
+        if used_tokens is not None and self._window and record[0] >= self._window[0][0]:
+            self._window_tokens += used_tokens - record[1]
+            record[1] = used_tokens
+        waiters, self._waiters = self._waiters, set()
+        for waiter in waiters:
+            loop = waiter.get_loop()
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_wake, waiter)
+
+    def release(self, record: list, used_tokens: int | None = None) -> None:
+        """Finish a successful request, recording its actual token use and growing concurrency."""
+        with self._lock:
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency_limit
+            )
+            self._finish(record, used_tokens)
+
+    def fail(self, record: list) -> None:
+        """Finish a request that failed for reasons other than throttling."""
+        with self._lock:
+            self._finish(record, None)
+
+    def throttle(self, record: list, retry_after: float | None = None) -> None:
+        """Finish a throttled request, pausing all requests and shrinking concurrency."""
+        with self._lock:
+            now = self.clock()
+            self.throttled_requests += 1
+            self.paused_until = max(
+                self.paused_until,
+                now + (retry_after if retry_after is not None else self.backoff),
+            )
+            # requests sent before the last decrease were throttled by the same burst
+            if record[0] > self.last_decrease:
+                self.concurrency = max(
+                    self.min_concurrency, self.concurrency * self.decrease_factor
+                )
+                self.last_decrease = now
+                logger.info(
+                    "Throttled; pausing %.1fs with concurrency %s",
+                    self.paused_until - now,
+                    self.concurrency_limit,
+                )
+            self._finish(record, None)
+
+    def set_limits(
+        self,
+        requests_per_minute: int | None,
+        tokens_per_minute: int | None,
+        max_concurrency: int,
+    ) -> None:
+        """Change the budgets and maximum concurrency, keeping the requests counted so far."""
+        with self._lock:
+            self.requests_per_minute = requests_per_minute
+            self.tokens_per_minute = tokens_per_minute
+            self.max_concurrency = max_concurrency
+            self.concurrency = min(self.concurrency, float(max_concurrency))
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class SchedulerRegistry:
+    """
+    Process-wide registry of rate limit schedulers, one per deployment.
+
+    Chat clients of the same deployment, endpoint and credentials share its scheduler, so that
+    concurrent jobs share its request and token budgets and its adaptive concurrency instead of
+    each starting from a full budget.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._schedulers = {}
+
+    @staticmethod
+    def deployment_key(configuration: OpenAIConfiguration) -> tuple:
+        return (*ClientRegistry.configuration_key(configuration), configuration.model)
+
+    def get_scheduler(
+        self,
+        configuration: OpenAIConfiguration,
+        requests_per_minute: int | None = None,
+        tokens_per_minute: int | None = None,
+        max_concurrency: int = DEFAULT_CONCURRENT_COROUTINES,
+    ) -> RateLimitScheduler:
+        """Return the deployment's scheduler, applying the given limits if they changed."""
+        key = self.deployment_key(configuration)
+        with self._lock:
+            scheduler = self._schedulers.get(key)
+            if scheduler is None:
+                scheduler = RateLimitScheduler(
+                    requests_per_minute=requests_per_minute,
+                    tokens_per_minute=tokens_per_minute,
+                    max_concurrency=max_concurrency,
+                )
+                self._schedulers[key] = scheduler
+                return scheduler
+        limits = (requests_per_minute, tokens_per_minute, max_concurrency)
+        if limits != (
+            scheduler.requests_per_minute,
+            scheduler.tokens_per_minute,
+            scheduler.max_concurrency,
+        ):
+            scheduler.set_limits(*limits)
+        return scheduler
+
+    def clear(self) -> None:
+        with self._lock:
+            self._schedulers = {}
+
+
+scheduler_registry = SchedulerRegistry()
@@ -0,0 +1,124 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import cache
+
+from toolkit.AI.defaults import (
+    DEFAULT_RESPONSE_CACHE_FILE,
+    DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+)
+from toolkit.helpers.constants import CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(**request) -> str:
+    """Hash a chat request canonically, so equal requests share a key whatever the argument order."""
+    canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Content-addressed store of LLM responses in SQLite, evicting least recently used entries.
+
+    Once the stored responses exceed max_bytes, the least recently read or written ones are removed
+    until they fit again.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_PATH, DEFAULT_RESPONSE_CACHE_FILE),
+        max_bytes: int = DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT, size INTEGER, last_access REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+            )
+        self._total_bytes = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT SUM(size) FROM responses").fetchone()
+        return row[0] or 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+        return row[0]
+
+    def set(self, key: str, response: str) -> None:
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock, self._connection:
+            previous = self._connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+        self._total_bytes += size - (previous[0] if previous else 0)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        # other processes may share the file, so recount before evicting
+        self._total_bytes = self._stored_bytes()
+        excess = self._total_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        evicted_keys = []
+        evicted_bytes = 0
+        with self._lock, self._connection:
+            for key, size in self._connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_access"
+            ):
+                evicted_keys.append((key,))
+                evicted_bytes += size
+                if evicted_bytes >= excess:
+                    break
+            self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        self._total_bytes -= evicted_bytes
+        logger.info("Evicted %s cached responses", len(evicted_keys))
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+        self._total_bytes = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+@cache
+def get_response_cache(
+    path: str = os.path.join(CACHE_PATH, DEFAULT_RESPONSE_CACHE_FILE),
+    max_bytes: int = DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+) -> ResponseCache:
+    """Return the response cache shared across the process for a path."""
+    return ResponseCache(path, max_bytes)
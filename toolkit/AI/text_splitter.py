@@ -1,18 +1,53 @@
 # Copyright (c) 2024 Microsoft Corporation. All rights reserved.
 # Licensed under the MIT license. See LICENSE file in the project.
 #
+from collections.abc import Iterable, Iterator
+from functools import cache
+
 import semchunk
-import tiktoken
 
 from .defaults import CHUNK_SIZE, DEFAULT_LLM_MODEL
+from .tokenizers import get_encoder
 
 
 class TextSplitter:
     def __init__(self, chunk_size: int = CHUNK_SIZE, model: str = DEFAULT_LLM_MODEL):
         self.chunk_size = chunk_size
         self._chunk = semchunk.chunkerify(
-            tiktoken.encoding_for_model(model), chunk_size
+            get_encoder(model=model), chunk_size
         )
 
     def split(self, text: str):  # -> Any:
         return self._chunk(text)
+
+    def split_stream(self, texts: Iterable[str], separator: str = "") -> Iterator[str]:
+        """
+        Split a stream of texts as if they were joined by separator, yielding chunks as they are produced.
+
+        The unfinished last chunk of each text is carried over into the next, so chunks can span text boundaries.
+        The chunks hold the same text as splitting the joined text at once, each within chunk_size, but chunk
+        boundaries near the text boundaries may differ, since the splitter only sees part of the text there.
+        """
+        carry = ""
+        last_chunk = None
+        for text in texts:
+            if not text:
+                continue
+            buffer = carry + separator + text if carry else text
+            chunks = self.split(buffer)
+            if len(chunks) == 0:
+                carry = ""
+                continue
+            yield from chunks[:-1]
+            last_chunk = chunks[-1]
+            start = buffer.rfind(last_chunk)
+            carry = buffer[start:] if start >= 0 else last_chunk
+        # with no text left to carry into, the last chunk is final as split
+        if last_chunk is not None:
+            yield last_chunk
+
+
+@cache
+def get_text_splitter(chunk_size: int = CHUNK_SIZE, model: str = DEFAULT_LLM_MODEL) -> TextSplitter:
+    """Return a TextSplitter shared across the process for a chunk size and model."""
+    return TextSplitter(chunk_size, model)
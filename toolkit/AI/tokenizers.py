@@ -0,0 +1,18 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+"""Process-wide registry of tiktoken encoders, built once per encoding or model."""
+
+from functools import cache
+
+import tiktoken
+
+from toolkit.AI.defaults import DEFAULT_ENCODING
+
+
+@cache
+def get_encoder(encoding: str | None = None, model: str | None = None) -> tiktoken.Encoding:
+    """Return the tiktoken encoder for a model, or else for an encoding name."""
+    if model:
+        return tiktoken.encoding_for_model(model)
+    return tiktoken.get_encoding(encoding or DEFAULT_ENCODING)
@@ -7,14 +7,16 @@
 import hashlib
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from typing import Any
 
-import tiktoken
-
-from toolkit.AI.defaults import DEFAULT_ENCODING, DEFAULT_REPORT_BATCH_SIZE
+from toolkit.AI.defaults import DEFAULT_REPORT_BATCH_SIZE, HASH_CHUNK_SIZE
+from toolkit.AI.tokenizers import get_encoder
 from toolkit.AI.validation_prompt import GROUNDEDNESS_PROMPT
 from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
 from toolkit.AI.base_chat import BaseChat
+from toolkit.AI.batch_chat import BatchChat
 from toolkit.AI.client import OpenAIClient
 
 log = logging.getLogger(__name__)
@@ -29,24 +31,76 @@ async def generate_text_async(ai_configuration, messages, **kwargs):
         messages, **kwargs
     )
 
+CHAT_BACKENDS = ("realtime", "batch")
+
+
+def _check_backend(backend: str) -> None:
+    if backend not in CHAT_BACKENDS:
+        msg = f"Unknown chat backend {backend}, expected one of {CHAT_BACKENDS}"
+        raise ValueError(msg)
+
+
 async def map_generate_text(
     ai_configuration,
     messages_list,
     callbacks: list[ProgressBatchCallback] | None = None,
+    backend: str = "realtime",
     **kwargs,
 ):
+    """
+    Generate a response to each of the messages.
+
+    backend="batch" runs them as a batch API job, which can take up to the batch completion
+    window, so it is only for offline jobs; interactive callers keep the realtime default.
+    """
+    _check_backend(backend)
+    if backend == "batch":
+        return await BatchChat(ai_configuration).generate_texts_async(
+            messages_list, callbacks, **kwargs
+        )
     return await BaseChat(ai_configuration).generate_texts_async(
         messages_list, callbacks, **kwargs
     )
 
+async def map_generate_text_as_completed(
+    ai_configuration,
+    messages_list,
+    callbacks: list[ProgressBatchCallback] | None = None,
+    backend: str = "realtime",
+    **kwargs,
+):
+    """Yield (index, response) pairs for the messages as each response arrives."""
+    _check_backend(backend)
+    if backend == "batch":
+        # batch responses all arrive together
+        responses = await map_generate_text(
+            ai_configuration, messages_list, callbacks, backend, **kwargs
+        )
+        for result in enumerate(responses):
+            yield result
+        return
+    async with aclosing(
+        BaseChat(ai_configuration).generate_texts_as_completed(
+            messages_list, callbacks, **kwargs
+        )
+    ) as results:
+        async for result in results:
+            yield result
+
 def get_token_count(text: str, encoding=None, model=None) -> int:
     """Function that counts the number of tokens in a string."""
-    encoder = tiktoken.get_encoding(encoding or DEFAULT_ENCODING)
-    if model:
-        encoder = tiktoken.encoding_for_model(model)
+    encoder = get_encoder(encoding, model)
     return len(encoder.encode(json.dumps(text)))
 
 
+def get_token_counts(texts: list[str], encoding=None, model=None) -> list[int]:
+    """Function that counts the number of tokens in each of a list of strings, in parallel."""
+    encoder = get_encoder(encoding, model)
+    return [
+        len(tokens) for tokens in encoder.encode_batch([json.dumps(text) for text in texts])
+    ]
+
+
 def prepare_messages(
     system_message: str, variables: dict[str, Any], user_message=None
 ) -> list[dict[str, str]]:
@@ -88,6 +142,18 @@ def hash_text(text: str) -> str:
     return hashlib.sha256(text.encode()).hexdigest()
 
 
+def hash_texts(
+    texts: list[str], max_workers: int | None = None, chunk_size: int = HASH_CHUNK_SIZE
+) -> list[str]:
+    """Function that hashes a list of strings like hash_text, in chunks across threads."""
+    chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    if len(chunks) <= 1:
+        return [hash_text(text) for text in texts]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashed_chunks = executor.map(lambda chunk: [hash_text(text) for text in chunk], chunks)
+        return [text_hash for hashed_chunk in hashed_chunks for text_hash in hashed_chunk]
+
+
 def generate_messages(
     user_prompt, system_prompt, variables, safety_prompt=""
 ) -> list[dict[str, str]]:
@@ -1,45 +1,192 @@
 # # Copyright (c) 2024 Microsoft Corporation. All rights reserved.
 # # Licensed under the MIT license. See LICENSE file in the project.
 # #
+import logging
+from datetime import timedelta
 from typing import Any
 
 import duckdb
 import lancedb
+import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 from pandas import DataFrame
 
-from toolkit.helpers.constants import CACHE_PATH
+from toolkit.helpers.constants import (
+    CACHE_PATH,
+    VECTOR_STORE_INDEX_REFRESH_ROWS,
+    VECTOR_STORE_LOOKUP_BATCH_SIZE,
+)
+
+logger = logging.getLogger(__name__)
 
 table_missing_msg = "Table not initialized"
 
 
+def to_vector_array(vectors: np.ndarray) -> pa.FixedSizeListArray:
+    """Wrap an (n, dim) matrix as a float32 fixed-size list array."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    return pa.FixedSizeListArray.from_arrays(
+        pa.array(vectors.reshape(-1)), vectors.shape[1]
+    )
+
+
+def to_vector_matrix(vectors: pa.Array | pa.ChunkedArray) -> np.ndarray:
+    """
+    Read a vector column as an (n, dim) float32 matrix.
+
+    Single-chunk float32 fixed-size list columns are viewed without copying;
+    legacy variable-length float64 columns are converted.
+    """
+    if isinstance(vectors, pa.ChunkedArray):
+        vectors = (
+            vectors.chunk(0) if vectors.num_chunks == 1 else vectors.combine_chunks()
+        )
+    if len(vectors) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    values = vectors.flatten().to_numpy(zero_copy_only=False)
+    return np.asarray(values, dtype=np.float32).reshape(len(vectors), -1)
+
+
 class VectorStore:
     table = None
     duckdb_data = None
+    index_column = None
+    indexed = False
+    unindexed_rows = 0
 
     def __init__(
         self,
         table_name: str | None = None,
         path: str = CACHE_PATH,
         schema: pa.Schema = None,
+        index_column: str | None = None,
     ):
         self.db_connection = lancedb.connect(path)
+        self.table_name = table_name
+        self.index_column = index_column
         if table_name is not None:
-            self.table = self.db_connection.create_table(
-                table_name, schema=schema, exist_ok=True
+            if table_name in self.db_connection.table_names():
+                self.table = self.db_connection.open_table(table_name)
+            elif schema is not None:
+                self.create_table(schema)
+            # Without a schema, creation waits until the caller knows it
+            if self.table is not None and index_column is not None:
+                self.ensure_index()
+
+    def create_table(self, schema: pa.Schema) -> None:
+        self.table = self.db_connection.create_table(
+            self.table_name, schema=schema, exist_ok=True
+        )
+
+    def overwrite(self, data: pa.RecordBatchReader, schema: pa.Schema) -> None:
+        """Replace the table contents, e.g. to migrate them to a new schema."""
+        if self.table is None:
+            raise ValueError(table_missing_msg)
+        self.table = self.db_connection.create_table(
+            self.table_name, data=data, schema=schema, mode="overwrite"
+        )
+        self.table.cleanup_old_versions(timedelta(0))
+        self.duckdb_data = None
+        self.indexed = False
+        if self.index_column is not None:
+            self.ensure_index()
+
+    def ensure_index(self) -> bool:
+        """
+        Create the scalar index on the index column, or bring it up to date.
+
+        Rows appended since the index was last built are indexed incrementally.
+        Returns whether indexed lookups are available; if not, lookups fall back
+        to scanning the table with DuckDB.
+        """
+        if self.table is None:
+            raise ValueError(table_missing_msg)
+        try:
+            dataset = self.table.to_lance()
+            if dataset.count_rows() == 0:
+                return self.indexed
+            index = next(
+                (
+                    idx
+                    for idx in dataset.list_indices()
+                    if idx["fields"] == [self.index_column]
+                ),
+                None,
             )
-            self.duckdb_data = self.table.to_lance()
+            if index is None:
+                self.table.create_scalar_index(self.index_column, replace=True)
+            else:
+                fragment_ids = {f.fragment_id for f in dataset.get_fragments()}
+                if not fragment_ids.issubset(index["fragment_ids"]):
+                    dataset.optimize.optimize_indices()
+            self.indexed = True
+            self.unindexed_rows = 0
+        except Exception as e:
+            logger.warning("Could not index column %s: %s", self.index_column, e)
+            self.indexed = False
+        return self.indexed
 
     def save(self, items: list[Any]) -> None:
         if self.table is None:
             raise ValueError(table_missing_msg)
         self.table.add(items)
+        self.duckdb_data = None
+        if self.index_column is not None:
+            self.unindexed_rows += len(items)
+            refresh = self.unindexed_rows >= VECTOR_STORE_INDEX_REFRESH_ROWS
+            if not self.indexed or refresh:
+                self.ensure_index()
+
+    def search_many(self, keys: list[str], column: str | None = None) -> pa.Table:
+        """
+        Look up rows whose column value is in keys, using the scalar index when present.
+
+        Returns one row per key found (the first stored match), in the order of keys.
+        """
+        if self.table is None:
+            raise ValueError(table_missing_msg)
+        column = column or self.index_column
+        unique_keys = list(dict.fromkeys(keys))
+        dataset = self.table.to_lance()
+        matched = []
+        for i in range(0, len(unique_keys), VECTOR_STORE_LOOKUP_BATCH_SIZE):
+            batch = unique_keys[i : i + VECTOR_STORE_LOOKUP_BATCH_SIZE]
+            values = ", ".join("'" + key.replace("'", "''") + "'" for key in batch)
+            matched.append(dataset.to_table(filter=f"{column} IN ({values})"))
+        if len(matched) == 0:
+            return self.table.schema.empty_table()
+        matched = pa.concat_tables(matched)
+        positions = pc.index_in(
+            pa.array(keys, pa.string()), value_set=matched[column]
+        )
+        return matched.take(positions.drop_null())
+
+    def get_many(
+        self, hashes: list[str], vector_column: str = "vector"
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Fetch the cached vectors for a list of hashes, looked up in the index column.
+
+        Returns a boolean mask over hashes marking which were found, and the found
+        vectors, in the order of hashes, as one contiguous (n, dim) float32 array.
+        """
+        column = self.index_column or "hash"
+        rows = self.search_many(hashes, column)
+        found = pc.is_in(
+            pa.array(hashes, pa.string()), value_set=rows[column]
+        ).to_numpy(zero_copy_only=False)
+        return found, to_vector_matrix(rows[vector_column])
 
     def search_by_column(self, texts: list[str] | str, column: str) -> DataFrame:
         if self.table is None:
             raise ValueError(table_missing_msg)
         if isinstance(texts, str):
             texts = [texts]
+        if self.indexed and column == self.index_column:
+            return self.search_many(list(dict.fromkeys(texts)), column).to_pandas()
+        if self.duckdb_data is None:
+            self.update_duckdb_data()
         arrow_data = self.duckdb_data
         query = f"SELECT DISTINCT * FROM arrow_data WHERE {column} IN {tuple(texts)}"
         return duckdb.execute(query).df()
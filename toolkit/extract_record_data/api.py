@@ -28,7 +28,8 @@ class ExtractRecordData:
         input_texts: list[str],
         generation_guidance: str="",
         df_update_callback=None,
-        callback_batch=None
+        callback_batch=None,
+        backend: str="realtime"
     ):
         """
         Extracts structured data records from input texts according to the JSON schema
@@ -38,6 +39,7 @@ class ExtractRecordData:
             generation_guidance (str): Optional guidance to provide to the model
             df_update_callback (function): A callback function to update the dataframe
             callback_batch (function): A callback function to update the batch
+            backend (str): "batch" to run the requests as a batch API job, for offline use
         """
         self.json_object, self.array_dfs = await data_extractor.extract_record_data(
             ai_configuration=self.ai_configuration,
@@ -46,6 +48,7 @@ class ExtractRecordData:
             record_arrays=self.record_arrays,
             generation_guidance=generation_guidance,
             df_update_callback=df_update_callback,
-            callback_batch=callback_batch
+            callback_batch=callback_batch,
+            backend=backend
         )
     
\ No newline at end of file
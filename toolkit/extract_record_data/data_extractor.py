@@ -16,22 +16,26 @@ async def extract_record_data(
     input_texts,
     df_update_callback,
     callback_batch,
+    backend="realtime",
 ):
     generated_objects = []
     current_object_json = {}
     
-    new_objects = await _extract_data_parallel(
+    # parse each response on arrival, merging in input order as soon as earlier ones are in
+    pending_objects = {}
+    async for ix, new_object in _extract_data_as_completed(
         ai_configuration=ai_configuration,
         input_texts=input_texts,
         generation_guidance=generation_guidance,
         data_schema=data_schema,
         callbacks=[callback_batch] if callback_batch is not None else None,
-    )
-
-    for new_object in new_objects:
-        new_object_json = loads(new_object)
-        generated_objects.append(new_object_json)
-        current_object_json, conflicts = merge_json_objects(current_object_json, new_object_json)
+        backend=backend,
+    ):
+        pending_objects[ix] = loads(new_object)
+        while len(generated_objects) in pending_objects:
+            new_object_json = pending_objects.pop(len(generated_objects))
+            generated_objects.append(new_object_json)
+            current_object_json, conflicts = merge_json_objects(current_object_json, new_object_json)
     dfs = {}
     for record_array in record_arrays:
         df = extract_df(current_object_json, record_array)
@@ -41,12 +45,13 @@ async def extract_record_data(
     return current_object_json, dfs
 
 
-async def _extract_data_parallel(
+async def _extract_data_as_completed(
     ai_configuration,
     input_texts,
     generation_guidance,
     data_schema,
     callbacks: list[ProgressBatchCallback] | None = None,
+    backend: str = "realtime",
 ):
     answer_format = {
         "type": "json_schema",
@@ -64,12 +69,14 @@ async def _extract_data_parallel(
         }) for input_text in input_texts
     ]
 
-    return await utils.map_generate_text(
+    async for result in utils.map_generate_text_as_completed(
         ai_configuration,
         mapped_messages,
         response_format=answer_format,
         callbacks=callbacks,
-    )
+        backend=backend,
+    ):
+        yield result
 
 def extract_df(json_data, record_path):
     # Extracts a DataFrame from a JSON object
@@ -33,7 +33,8 @@ class GenerateMockData:
         temperature: float=0.5,
         df_update_callback=None,
         callback_batch=None,
-        parallel_batches: int=0
+        parallel_batches: int=0,
+        backend: str="realtime"
     ):
         """
         Generates structured data records according to the JSON schema
@@ -48,6 +49,7 @@ class GenerateMockData:
             df_update_callback (function): A callback function to update the dataframe
             callback_batch (function): A callback function to update the batch
             parallel_batches (int): The number of parallel batches to generate
+            backend (str): "batch" to run the requests as a batch API job, for offline use
         """
         self.json_object, self.array_dfs = await data_generator.generate_data(
             ai_configuration=self.ai_configuration,
@@ -60,7 +62,8 @@ class GenerateMockData:
             temperature=temperature,
             df_update_callback=df_update_callback,
             callback_batch=callback_batch,
-            parallel_batches=parallel_batches
+            parallel_batches=parallel_batches,
+            backend=backend
         )
 
     async def generate_text_data(
@@ -22,7 +22,8 @@ async def generate_data(
     temperature,
     df_update_callback,
     callback_batch,
-    parallel_batches=0
+    parallel_batches=0,
+    backend="realtime",
 ):
     if parallel_batches == 0:
         parallel_batches = num_records_overall // records_per_batch
@@ -62,6 +63,7 @@ async def generate_data(
             data_schema=data_schema,
             temperature=temperature,
             callbacks=[callback_batch] if callback_batch is not None else None,
+            backend=backend,
         )
 
         for new_object in new_objects:
@@ -117,6 +119,7 @@ async def generate_seeded_data(
     data_schema,
     temperature,
     callbacks: list[ProgressBatchCallback] | None = None,
+    backend: str = "realtime",
 ):
     answer_format = {
         "type": "json_schema",
@@ -146,6 +149,7 @@ async def generate_seeded_data(
         response_format=answer_format,
         temperature=temperature,
         callbacks=callbacks,
+        backend=backend,
     )
 
 def select_random_records(num_records, category_to_count):
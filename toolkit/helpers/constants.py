@@ -18,3 +18,10 @@ if not os.path.exists(CACHE_PATH):
 
 VECTOR_STORE_MAX_RETRIES = 5
 VECTOR_STORE_MAX_RETRIES_WAIT_TIME = 1
+RETRY_MAX_WAIT_TIME = 30
+VECTOR_STORE_LOOKUP_BATCH_SIZE = 600
+VECTOR_STORE_INDEX_REFRESH_ROWS = 10000
+CONCEPT_EXTRACTION_MIN_PARALLEL_CHUNKS = 200
+CONCEPT_EXTRACTION_MAX_CHUNKSIZE = 64
+CONCEPT_EXTRACTION_TASKS_PER_WORKER = 4
+STREAM_BLOCK_SIZE = 1024 * 1024
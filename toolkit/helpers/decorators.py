@@ -1,35 +1,158 @@
 # Copyright (c) 2024 Microsoft Corporation. All rights reserved.
 # Licensed under the MIT license. See LICENSE file in the project.
 #
+import asyncio
+import inspect
+import logging
 import random
+import threading
 import time
+from collections import Counter
 from collections.abc import Callable
 from functools import wraps
 from typing import Any, TypeVar
 
+import httpx
+import openai
+
 from toolkit.helpers.constants import (
+    RETRY_MAX_WAIT_TIME,
     VECTOR_STORE_MAX_RETRIES,
     VECTOR_STORE_MAX_RETRIES_WAIT_TIME,
 )
 
 T = TypeVar("T")
 
+logger = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    openai.APIConnectionError,
+    httpx.TimeoutException,
+    httpx.TransportError,
+)
+
+
+def is_retryable(error: BaseException | None) -> bool:
+    """Whether an error, or one it was raised from, is transient: a 408, 429 or 5xx, a timeout or a dropped connection."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, TRANSIENT_ERRORS):
+            return True
+        status_code = getattr(error, "status_code", None)
+        if status_code is None:
+            status_code = getattr(getattr(error, "response", None), "status_code", None)
+        if isinstance(status_code, int):
+            return status_code in (408, 429) or status_code >= 500
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class RetryMetrics:
+    """Counts of retried, timed out and failed calls per decorated function."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.retries = Counter()
+            self.timeouts = Counter()
+            self.failures = Counter()
+
+    def record(self, counter: Counter, name: str) -> None:
+        with self._lock:
+            counter[name] += 1
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {
+                "retries": dict(self.retries),
+                "timeouts": dict(self.timeouts),
+                "failures": dict(self.failures),
+            }
+
+
+retry_metrics = RetryMetrics()
+
+
+def backoff_time(attempt: int, backoff_in_seconds: float, max_backoff: float) -> float:
+    """Exponential backoff with jitter, so concurrent callers do not retry in lockstep."""
+    ceiling = min(max_backoff, backoff_in_seconds * 2**attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
 
 def retry_with_backoff(
     retries=VECTOR_STORE_MAX_RETRIES,
     backoff_in_seconds=VECTOR_STORE_MAX_RETRIES_WAIT_TIME,
+    max_backoff=RETRY_MAX_WAIT_TIME,
+    timeout: float | None = None,
+    deadline: float | None = None,
+    retry_on: Callable[[BaseException], bool] = is_retryable,
 ) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """
+    Retry transient failures of a function or coroutine function with jittered exponential backoff.
+
+    Coroutine functions wait with asyncio.sleep, so other requests keep running, and each attempt
+    can be limited to timeout seconds. No retry starts after deadline seconds from the first call.
+    """
+
     def decorator(func) -> Any:
+        name = func.__qualname__
+
+        def next_wait(error: BaseException, attempt: int, start: float) -> float | None:
+            if attempt == retries or not retry_on(error):
+                retry_metrics.record(retry_metrics.failures, name)
+                return None
+            sleep = backoff_time(attempt, backoff_in_seconds, max_backoff)
+            if deadline is not None and time.monotonic() + sleep - start > deadline:
+                retry_metrics.record(retry_metrics.failures, name)
+                return None
+            retry_metrics.record(retry_metrics.retries, name)
+            logger.warning(
+                "Retrying %s in %.1fs after attempt %s failed: %s",
+                name,
+                sleep,
+                attempt + 1,
+                error,
+            )
+            return sleep
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> T:
+                start = time.monotonic()
+                x = 0
+                while True:
+                    try:
+                        if timeout is None:
+                            return await func(*args, **kwargs)
+                        return await asyncio.wait_for(func(*args, **kwargs), timeout)
+                    except Exception as e:
+                        if isinstance(e, TimeoutError):
+                            retry_metrics.record(retry_metrics.timeouts, name)
+                        sleep = next_wait(e, x, start)
+                        if sleep is None:
+                            raise
+                        await asyncio.sleep(sleep)
+                        x += 1
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> T:
+            start = time.monotonic()
             x = 0
             while True:
                 try:
                     return func(*args, **kwargs)
-                except Exception:
-                    if x == retries:
+                except Exception as e:
+                    sleep = next_wait(e, x, start)
+                    if sleep is None:
                         raise
-                    sleep = backoff_in_seconds * 2**x + random.uniform(0, 1)
                     time.sleep(sleep)
                     x += 1
 
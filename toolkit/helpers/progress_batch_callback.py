@@ -9,9 +9,17 @@ class ProgressBatchCallback:
     def __init__(self):
         self.current_batch = 0
         self.total_batches = 0
+        self.rate = None
+        self.eta = None
 
     def on_batch_change(self, current: int, total: int, message: str = ""):
         """Handle when a new token is generated."""
         self.current_batch = current
         self.total_batches = total
         self.message = message
+
+    def on_progress(self, progress) -> None:
+        """Handle a progress report, with its rate and estimated time remaining."""
+        self.rate = progress.rate
+        self.eta = progress.eta
+        self.on_batch_change(progress.completed, progress.total)
@@ -5,7 +5,7 @@
 import os
 
 from .api import MatchEntityRecords
-from .classes import RecordsModel
+from .classes import BlockingConfig, RecordsModel
 from .prepare_model import (
     build_attribute_options,
     build_attributes_list,
@@ -20,6 +20,7 @@ def get_readme() -> str:
 
 
 __all__ = [
+    "BlockingConfig",
     "MatchEntityRecords",
     "RecordsModel",
     "build_attribute_options",
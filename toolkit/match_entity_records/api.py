@@ -4,38 +4,103 @@
 
 
 import io
+import logging
+from contextlib import aclosing
 from typing import ClassVar
 
-import numpy as np
 import polars as pl
 
 import toolkit.AI.utils as utils
-from toolkit.AI.classes import LLMCallback
-from toolkit.AI.client import OpenAIClient
+from toolkit.AI.defaults import DEFAULT_REPORT_BATCH_SIZE
 from toolkit.helpers.classes import IntelligenceWorkflow
+from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
 from toolkit.match_entity_records import prompts
-from toolkit.match_entity_records.classes import AttributeToMatch, RecordsModel
+from toolkit.match_entity_records.blocking import build_blocks
+from toolkit.match_entity_records.classes import (
+    AttributeToMatch,
+    BlockingConfig,
+    BlockingReport,
+    RecordsModel,
+)
+from toolkit.match_entity_records.config import DEFAULT_NEAREST_NEIGHBORS
 from toolkit.match_entity_records.detect import (
     build_attributes_dataframe,
-    build_matches,
+    build_blocked_near_map,
+    build_match_groups,
     build_matches_dataset,
     build_near_map,
     build_nearest_neighbors,
     build_sentence_pair_scores,
     convert_to_sentences,
 )
+from toolkit.match_entity_records.match_index import MatchIndex
 from toolkit.match_entity_records.prepare_model import (
     build_attribute_options,
     build_attributes_list,
     format_model_df,
 )
 
+logger = logging.getLogger(__name__)
+
+EVALUATION_SCHEMA = {"Group ID": pl.Int64, "Relatedness": pl.Int64, "Explanation": pl.Utf8}
+
+
+def _group_batches(data: pl.DataFrame, batch_size: int) -> list[pl.DataFrame]:
+    """Pack whole groups into batches of up to batch_size records, or one group if larger."""
+    batches = []
+    batch = []
+    batch_rows = 0
+    for group in data.partition_by("Group ID", maintain_order=True):
+        if len(batch) > 0 and batch_rows + len(group) > batch_size:
+            batches.append(pl.concat(batch))
+            batch = []
+            batch_rows = 0
+        batch.append(group)
+        batch_rows += len(group)
+    if len(batch) > 0:
+        batches.append(pl.concat(batch))
+    return batches
+
+
+def _parse_evaluations(response: str, group_ids: set[int]) -> pl.DataFrame:
+    """Parse the CSV rows of an evaluation response, ignoring fences, headers and unknown groups."""
+    lines = [
+        line
+        for line in response.splitlines()
+        if line.strip()
+        and not line.strip().startswith("```")
+        and not line.startswith("Group ID")
+    ]
+    if len(lines) == 0:
+        return pl.DataFrame(schema=EVALUATION_SCHEMA)
+    evaluations = pl.read_csv(
+        io.StringIO("\n".join(lines)),
+        has_header=False,
+        infer_schema_length=0,
+        truncate_ragged_lines=True,
+    )
+    if evaluations.width < len(EVALUATION_SCHEMA):
+        # e.g. a reply in prose rather than CSV rows
+        return pl.DataFrame(schema=EVALUATION_SCHEMA)
+    evaluations = evaluations.select(evaluations.columns[: len(EVALUATION_SCHEMA)])
+    evaluations.columns = list(EVALUATION_SCHEMA)
+    return (
+        evaluations.with_columns(
+            pl.col("Group ID").str.strip_chars().cast(pl.Int64, strict=False),
+            pl.col("Relatedness").str.strip_chars().cast(pl.Int64, strict=False),
+        )
+        .filter(pl.col("Group ID").is_in(list(group_ids)))
+        .unique(subset="Group ID", keep="first", maintain_order=True)
+    )
+
 
 class MatchEntityRecords(IntelligenceWorkflow):
     model_dfs: ClassVar[dict] = {}
     max_rows_to_process = 0
     evaluations_df = pl.DataFrame()
     matches_df = pl.DataFrame()
+    blocking_report: BlockingReport | None = None
+    match_index: MatchIndex | None = None
 
     @property
     def total_records(self) -> int:
@@ -60,84 +125,198 @@ class MatchEntityRecords(IntelligenceWorkflow):
         )
         return self.model_dfs[model.dataframe_name]
 
-    def build_model_df(self, attributes_list: list[AttributeToMatch]) -> pl.DataFrame:
-        attributes = build_attributes_list(attributes_list)
-        self.model_df = build_attributes_dataframe(self.model_dfs, attributes)
-        self.model_df = self.model_df.with_columns(
+    @staticmethod
+    def _with_unique_ids(model_df: pl.DataFrame) -> pl.DataFrame:
+        return model_df.with_columns(
             (pl.col("Entity ID").cast(pl.Utf8))
             + "::"
             + pl.col("Dataset").alias("Unique ID")
         )
 
+    def build_model_df(self, attributes_list: list[AttributeToMatch]) -> pl.DataFrame:
+        attributes = build_attributes_list(attributes_list)
+        self.model_df = self._with_unique_ids(
+            build_attributes_dataframe(self.model_dfs, attributes)
+        )
+
         self.sentences_vector_data = convert_to_sentences(self.model_df)
         return self.model_df
 
     async def embed_sentences(self) -> None:
-        sentences_data = await self.embedder.embed_store_many(
-            self.sentences_vector_data, cache_data=self.cache_embeddings
+        self.all_sentences = self.sentences_vector_data["text"].to_list()
+        self.embeddings = await self.embedder.embed_store_many(
+            self.sentences_vector_data.to_dicts(),
+            cache_data=self.cache_embeddings,
+            aligned=True,
         )
-        self.all_sentences = [x["text"] for x in self.sentences_vector_data]
-        self.embeddings = [
-            np.array(next(d["vector"] for d in sentences_data if d["text"] == f))
-            for f in self.all_sentences
-        ]
 
     def detect_record_groups(
-        self, pair_embedding_threshold: int, pair_jaccard_threshold: int
+        self,
+        pair_embedding_threshold: int,
+        pair_jaccard_threshold: int,
+        approximate_neighbors: bool = False,
+        blocking: BlockingConfig | None = None,
     ) -> pl.DataFrame:
-        distances, indices = build_nearest_neighbors(self.embeddings)
-        near_map = build_near_map(
-            distances,
-            indices,
-            self.all_sentences,
-            pair_embedding_threshold,
-        )
+        """
+        Group matching records, comparing each with its nearest embedding neighbors.
+
+        With blocking, neighbors are only searched within blocks of records sharing a cheap key,
+        and blocking_report records how many record pairs that left to compare.
+        """
+        if blocking is None:
+            self.blocking_report = None
+            distances, indices = build_nearest_neighbors(
+                self.embeddings,
+                min(DEFAULT_NEAREST_NEIGHBORS, len(self.embeddings)),
+                approximate=approximate_neighbors,
+            )
+            near_map = build_near_map(
+                distances,
+                indices,
+                self.all_sentences,
+                pair_embedding_threshold,
+            )
+        else:
+            blocks, self.blocking_report = build_blocks(
+                self.model_df, self.embeddings, blocking
+            )
+            near_map = build_blocked_near_map(
+                self.embeddings,
+                blocks,
+                DEFAULT_NEAREST_NEIGHBORS,
+                pair_embedding_threshold,
+            )
+            self.blocking_report.scored_pairs = len(
+                {
+                    (min(ix, nx), max(ix, nx))
+                    for ix, nx_list in near_map.items()
+                    for nx in nx_list
+                }
+            )
 
         pair_scores = build_sentence_pair_scores(near_map, self.model_df)
+        self.sentence_pair_scores = pair_scores
 
-        entity_to_group, matches, pair_to_match = build_matches(
+        match_groups = build_match_groups(
             pair_scores,
             self.model_df,
             pair_jaccard_threshold,
         )
 
-        matches_df = pl.DataFrame(
-            list(matches),
-            schema=["Group ID", *self.model_df.columns],
-        ).sort(by=["Group ID", "Entity name", "Dataset"], descending=False)
+        matches_df = match_groups.to_dataframe(self.model_df).sort(
+            by=["Group ID", "Entity name", "Dataset"], descending=False
+        )
 
         self.matches_df = build_matches_dataset(
-            matches_df, pair_to_match, entity_to_group
+            matches_df,
+            match_groups.pair_to_match,
+            match_groups.entity_to_group,
+            match_groups.group_to_mean_similarity,
+        )
+        return self.matches_df
+
+    def create_match_index(
+        self, path, pair_embedding_threshold: float, pair_jaccard_threshold: float
+    ) -> MatchIndex:
+        """Persist the records and groups of the last detect_record_groups run for incremental matching."""
+        self.match_index = MatchIndex.create(
+            path,
+            self.model_df,
+            self.embeddings,
+            self.sentence_pair_scores,
+            pair_embedding_threshold,
+            pair_jaccard_threshold,
+        )
+        return self.match_index
+
+    def load_match_index(self, path) -> MatchIndex:
+        self.match_index = MatchIndex.load(path)
+        return self.match_index
+
+    async def match_new_records(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        Match new records against the match index, merging them into its groups.
+
+        The records need the columns of the indexed model_df before unique ids are added, such as
+        a build_attributes_dataframe result. Only the new records are embedded and compared, and
+        matches_df becomes the groups that contain them.
+        """
+        if self.match_index is None:
+            msg = "No match index; create or load one first"
+            raise ValueError(msg)
+        new_df = self._with_unique_ids(
+            df.with_columns([pl.col(column).cast(pl.Utf8) for column in df.columns])
         )
+        sentences = convert_to_sentences(new_df)
+        embeddings = await self.embedder.embed_store_many(
+            sentences.to_dicts(), cache_data=self.cache_embeddings, aligned=True
+        )
+        match_groups = self.match_index.match_new_records(new_df, embeddings)
+        self.matches_df = self.match_index.matches_dataset(match_groups)
         return self.matches_df
 
     async def evaluate_groups(
         self,
         ai_instructions=prompts.list_prompts,
-        callbacks: list[LLMCallback] | None = None,
-    ) -> None:
-        data = self.model_df.drop(
+        callbacks: list[ProgressBatchCallback] | None = None,
+        batch_size: int = DEFAULT_REPORT_BATCH_SIZE,
+    ) -> str:
+        """
+        Evaluate the relatedness of every matched group, in concurrent batches of whole groups.
+
+        Each response is parsed into evaluations_df as it arrives, and groups already there are
+        not evaluated again, so re-running after an interruption only evaluates the rest.
+        Returns the evaluations as CSV text with a "Group ID,Relatedness,Explanation" header and
+        no trailing newline, as before batching; only the header if there are no matched groups.
+        """
+        if not self.evaluations_df.is_empty():
+            self.evaluations_df = self.evaluations_df.select(
+                [
+                    pl.col(column).cast(dtype, strict=False)
+                    for column, dtype in EVALUATION_SCHEMA.items()
+                ]
+            )
+        else:
+            self.evaluations_df = pl.DataFrame(schema=EVALUATION_SCHEMA)
+        if self.matches_df.is_empty() or "Group ID" not in self.matches_df.columns:
+            return self.evaluations_df.write_csv().strip()
+        evaluated = self.evaluations_df["Group ID"].drop_nulls().to_list()
+        data = self.matches_df.filter(~pl.col("Group ID").is_in(evaluated)).drop(
             [
                 "Entity ID",
                 "Dataset",
                 "Name similarity",
             ]
-        ).to_pandas()
-        data = data.head(500)
-
-        batch_messages = utils.generate_batch_messages(
-            ai_instructions, batch_name="data", batch_value=data
         )
-        prefix = "```\nGroup ID,Relatedness,Explanation\n"
+        batches = _group_batches(data, batch_size) if not data.is_empty() else []
+        if len(batches) == 0:
+            return self.evaluations_df.write_csv().strip()
 
-        for messages in batch_messages:
-            response = await OpenAIClient(self.ai_configuration).generate_chat_async(
-                messages, stream=True
+        messages_list = [
+            utils.generate_batch_messages(
+                ai_instructions,
+                batch_name="data",
+                batch_value=batch.to_pandas(),
+                batch_size=len(batch),
+            )[0]
+            for batch in batches
+        ]
+        async with aclosing(
+            utils.map_generate_text_as_completed(
+                self.ai_configuration, messages_list, callbacks
             )
-            prefix = prefix + response + "\n"
-        result = prefix.replace("```\n", "").strip()
-        self.evaluations_df = pl.read_csv(io.StringIO(result))
-        return result
+        ) as results:
+            async for index, response in results:
+                group_ids = set(batches[index]["Group ID"].to_list())
+                try:
+                    evaluations = _parse_evaluations(response, group_ids)
+                except pl.exceptions.PolarsError as e:
+                    logger.warning("Could not parse evaluations of batch %s: %s", index, e)
+                    continue
+                self.evaluations_df = pl.concat(
+                    [self.evaluations_df, evaluations], rechunk=False
+                )
+        return self.evaluations_df.write_csv().strip()
 
     def clear_model_dfs(self) -> None:
         self.model_dfs = {}
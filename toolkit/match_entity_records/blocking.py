@@ -0,0 +1,152 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+
+import logging
+
+import numpy as np
+import polars as pl
+
+from toolkit.match_entity_records.classes import BlockingConfig, BlockingReport
+from toolkit.match_entity_records.config import (
+    DEFAULT_LSH_BITS,
+    DEFAULT_LSH_TABLES,
+    DEFAULT_SORTED_NEIGHBORHOOD_WINDOW,
+    NAME_NGRAM_SIZE,
+    NEAREST_NEIGHBORS_BLOCK_BYTES,
+)
+from toolkit.match_entity_records.detect import build_name_index
+
+logger = logging.getLogger(__name__)
+
+
+def _split_by_key(keys: np.ndarray, rows: np.ndarray) -> list[np.ndarray]:
+    """Group rows by key, keeping rows in ascending order within each group."""
+    if len(keys) == 0:
+        return []
+    order = np.lexsort((rows, keys))
+    keys = keys[order]
+    boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    return np.split(rows[order], boundaries)
+
+
+def exact_key_blocks(merged_df: pl.DataFrame, columns: list[str]) -> list[np.ndarray]:
+    """Block records with equal upper-cased values in all the columns, leaving out null or empty keys."""
+    key = pl.concat_str(
+        [pl.col(column).cast(pl.Utf8).str.to_uppercase() for column in columns],
+        separator="\x1f",
+    )
+    keys = merged_df.select(
+        pl.when(key == "").then(None).otherwise(key).rank("dense").alias("key")
+    )["key"]
+    rows = np.flatnonzero(keys.is_not_null().to_numpy())
+    return _split_by_key(keys.drop_nulls().to_numpy(), rows)
+
+
+def name_ngram_blocks(
+    names: list[str], ngram_size: int = NAME_NGRAM_SIZE
+) -> list[np.ndarray]:
+    """Block records sharing an n-gram of their names; names shorter than ngram_size have none."""
+    name_ids, name_grams = build_name_index(names, ngram_size)
+    gram_records = name_grams[name_ids].T.tocsr()
+    gram_records.sort_indices()
+    return [
+        gram_records.indices[start:stop].astype(np.int64)
+        for start, stop in zip(gram_records.indptr[:-1], gram_records.indptr[1:])
+        if stop > start
+    ]
+
+
+def sorted_neighborhood_blocks(
+    names: list[str], window: int = DEFAULT_SORTED_NEIGHBORHOOD_WINDOW
+) -> list[np.ndarray]:
+    """Block windows of records sorted by upper-cased name, overlapping by half a window."""
+    order = pl.Series(names, dtype=pl.Utf8).str.to_uppercase().arg_sort().to_numpy()
+    step = max(1, window // 2)
+    blocks = []
+    for start in range(0, len(order), step):
+        blocks.append(np.sort(order[start : start + window]).astype(np.int64))
+        if start + window >= len(order):
+            break
+    return blocks
+
+
+def lsh_blocks(
+    embeddings: np.ndarray,
+    num_tables: int = DEFAULT_LSH_TABLES,
+    num_bits: int = DEFAULT_LSH_BITS,
+    seed: int = 0,
+) -> list[np.ndarray]:
+    """
+    Block records by random-hyperplane signatures of their embeddings, once per table.
+
+    Records with close cosine directions agree on most hyperplane signs, so share a bucket in at
+    least one table with high probability.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if len(vectors) == 0:
+        return []
+    planes = np.random.default_rng(seed).standard_normal(
+        (vectors.shape[1], num_tables * num_bits)
+    ).astype(np.float32)
+    powers = 1 << np.arange(num_bits, dtype=np.int64)
+    signatures = np.empty((len(vectors), num_tables), dtype=np.int64)
+    chunk_size = max(1, NEAREST_NEIGHBORS_BLOCK_BYTES // (4 * planes.shape[1]))
+    for start in range(0, len(vectors), chunk_size):
+        bits = (vectors[start : start + chunk_size] @ planes > 0).reshape(
+            -1, num_tables, num_bits
+        )
+        signatures[start : start + chunk_size] = bits @ powers
+    rows = np.arange(len(vectors), dtype=np.int64)
+    blocks = []
+    for table in range(num_tables):
+        blocks.extend(_split_by_key(signatures[:, table], rows))
+    return blocks
+
+
+def build_blocks(
+    merged_df: pl.DataFrame,
+    embeddings: np.ndarray | None,
+    blocking: BlockingConfig,
+) -> tuple[list[np.ndarray], BlockingReport]:
+    """
+    Build the blocks of record indices to compare from the strategies enabled in blocking.
+
+    Blocks of a single record are dropped, identical blocks found by several strategies are kept
+    once, and blocks larger than blocking.max_block_size are skipped.
+    """
+    names = merged_df["Entity name"].to_list() if len(merged_df) > 0 else []
+    candidates = []
+    if blocking.exact_columns:
+        candidates.extend(exact_key_blocks(merged_df, blocking.exact_columns))
+    if blocking.name_ngram_size:
+        candidates.extend(name_ngram_blocks(names, blocking.name_ngram_size))
+    if blocking.sorted_neighborhood_window:
+        candidates.extend(
+            sorted_neighborhood_blocks(names, blocking.sorted_neighborhood_window)
+        )
+    if blocking.lsh_tables > 0:
+        if embeddings is None:
+            msg = "LSH blocking requires the record embeddings"
+            raise ValueError(msg)
+        candidates.extend(
+            lsh_blocks(embeddings, blocking.lsh_tables, blocking.lsh_bits, blocking.seed)
+        )
+
+    blocks = []
+    seen = set()
+    skipped_blocks = 0
+    for block in candidates:
+        if len(block) < 2:
+            continue
+        if blocking.max_block_size is not None and len(block) > blocking.max_block_size:
+            skipped_blocks += 1
+            continue
+        key = block.tobytes()
+        if key not in seen:
+            seen.add(key)
+            blocks.append(block)
+
+    report = BlockingReport(len(merged_df), [len(block) for block in blocks], skipped_blocks)
+    logger.info("Blocking: %s", report)
+    return blocks, report
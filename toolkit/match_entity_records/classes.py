@@ -4,9 +4,15 @@
 
 from typing import TypedDict
 
+import numpy as np
 import polars as pl
 from pydantic import BaseModel
 
+from toolkit.match_entity_records.config import (
+    DEFAULT_LSH_BITS,
+    DEFAULT_MAX_BLOCK_SIZE,
+)
+
 
 class RecordsModel(BaseModel):
     dataframe: pl.DataFrame
@@ -21,4 +27,106 @@ class RecordsModel(BaseModel):
 
 class AttributeToMatch(TypedDict):
     label: str | None = None
-    columns: list[str]
\ No newline at end of file
+    columns: list[str]
+
+
+class MatchGroups:
+    """
+    Groups of matching entities found from scored record pairs.
+
+    rows holds the indices of matched records and row_groups their groups; group_to_mean_similarity
+    holds the mean score of the distinct entity pairs matched in each group.
+    """
+
+    def __init__(
+        self,
+        entity_to_group: dict[str, int],
+        pair_to_match: dict[tuple[str, str], float],
+        group_to_mean_similarity: dict[int, float],
+        rows: np.ndarray,
+        row_groups: np.ndarray,
+    ) -> None:
+        self.entity_to_group = entity_to_group
+        self.pair_to_match = pair_to_match
+        self.group_to_mean_similarity = group_to_mean_similarity
+        self.rows = rows
+        self.row_groups = row_groups
+
+    def to_dataframe(self, merged_df: pl.DataFrame) -> pl.DataFrame:
+        """Return the matched records with their group ids in a first "Group ID" column."""
+        matches_df = merged_df[self.rows.tolist()].insert_column(
+            0, pl.Series("Group ID", self.row_groups, dtype=pl.Int64)
+        )
+        return matches_df.unique(maintain_order=True)
+
+
+class BlockingConfig:
+    """
+    Which cheap keys group records into blocks, so that only records sharing a block are compared.
+
+    Each enabled strategy adds blocks: exact_columns puts records with equal upper-cased values of
+    those columns together, name_ngram_size those sharing an entity name n-gram,
+    sorted_neighborhood_window overlapping windows of records sorted by name, and lsh_tables those
+    with equal random-hyperplane signatures of lsh_bits bits over their embeddings. Blocks larger
+    than max_block_size are skipped.
+    """
+
+    def __init__(
+        self,
+        exact_columns: list[str] | None = None,
+        name_ngram_size: int | None = None,
+        sorted_neighborhood_window: int | None = None,
+        lsh_tables: int = 0,
+        lsh_bits: int = DEFAULT_LSH_BITS,
+        max_block_size: int | None = DEFAULT_MAX_BLOCK_SIZE,
+        seed: int = 0,
+    ) -> None:
+        self.exact_columns = exact_columns or []
+        self.name_ngram_size = name_ngram_size
+        self.sorted_neighborhood_window = sorted_neighborhood_window
+        self.lsh_tables = lsh_tables
+        self.lsh_bits = lsh_bits
+        self.max_block_size = max_block_size
+        self.seed = seed
+
+
+class BlockingReport:
+    """
+    How far blocking reduced the record pairs to compare.
+
+    candidate_pairs counts the pairs within each block, so pairs sharing several blocks count once
+    per block; scored_pairs counts the distinct pairs that were then close enough to be scored.
+    """
+
+    def __init__(
+        self,
+        num_records: int,
+        block_sizes: list[int],
+        skipped_blocks: int = 0,
+        scored_pairs: int | None = None,
+    ) -> None:
+        self.num_records = num_records
+        self.num_blocks = len(block_sizes)
+        self.skipped_blocks = skipped_blocks
+        self.largest_block = max(block_sizes, default=0)
+        self.candidate_pairs = sum(size * (size - 1) // 2 for size in block_sizes)
+        self.scored_pairs = scored_pairs
+
+    @property
+    def total_pairs(self) -> int:
+        return self.num_records * (self.num_records - 1) // 2
+
+    @property
+    def reduction_ratio(self) -> float:
+        """Share of all record pairs that blocking left out of the candidates."""
+        if self.total_pairs == 0:
+            return 0.0
+        return max(0.0, 1 - self.candidate_pairs / self.total_pairs)
+
+    def __repr__(self) -> str:
+        return (
+            f"BlockingReport(num_records={self.num_records}, num_blocks={self.num_blocks}, "
+            f"skipped_blocks={self.skipped_blocks}, largest_block={self.largest_block}, "
+            f"candidate_pairs={self.candidate_pairs}, scored_pairs={self.scored_pairs}, "
+            f"reduction_ratio={self.reduction_ratio:.4f})"
+        )
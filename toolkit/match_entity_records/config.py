@@ -8,4 +8,17 @@ cache_name = "match_entity_records"
 
 DEFAULT_COLUMNS_DONT_CONVERT = ["Entity ID", "Entity name", "Dataset"]
 DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD = 0.75
-DEFAULT_MAX_RECORD_DISTANCE = 0.05
\ No newline at end of file
+DEFAULT_MAX_RECORD_DISTANCE = 0.05
+DEFAULT_NEAREST_NEIGHBORS = 50
+NEAREST_NEIGHBORS_BLOCK_BYTES = 64 * 1024 * 1024
+# a float32 similarity and the int64 index argpartition returns for it
+NEAREST_NEIGHBORS_BYTES_PER_SIMILARITY = 12
+APPROXIMATE_NEIGHBORS_EF_CONSTRUCTION = 200
+APPROXIMATE_NEIGHBORS_M = 16
+NAME_NGRAM_SIZE = 3
+PAIR_SCORE_BLOCK_SIZE = 1000000
+DEFAULT_MAX_BLOCK_SIZE = 10000
+DEFAULT_SORTED_NEIGHBORHOOD_WINDOW = 20
+DEFAULT_LSH_TABLES = 4
+DEFAULT_LSH_BITS = 12
+MATCH_INDEX_FORMAT_VERSION = 2
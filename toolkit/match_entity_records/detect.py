@@ -2,65 +2,222 @@
 # Licensed under the MIT license. See LICENSE file in the project.
 #
 
+import importlib
+import os
 import re
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 import numpy as np
 import polars as pl
+from scipy import sparse
 from sklearn.neighbors import NearestNeighbors
 
-from toolkit.AI.classes import VectorData
-from toolkit.AI.utils import hash_text
+from toolkit.AI.utils import hash_texts
+from toolkit.match_entity_records.classes import MatchGroups
 from toolkit.match_entity_records.config import (
+    APPROXIMATE_NEIGHBORS_EF_CONSTRUCTION,
+    APPROXIMATE_NEIGHBORS_M,
     DEFAULT_COLUMNS_DONT_CONVERT,
     DEFAULT_MAX_RECORD_DISTANCE,
+    DEFAULT_NEAREST_NEIGHBORS,
     DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD,
+    NAME_NGRAM_SIZE,
+    NEAREST_NEIGHBORS_BLOCK_BYTES,
+    NEAREST_NEIGHBORS_BYTES_PER_SIMILARITY,
+    PAIR_SCORE_BLOCK_SIZE,
 )
 
 
+def _upper_text(merged_dataframe: pl.DataFrame, column: str) -> pl.Expr:
+    """Upper-case the values of a column as str() would format them, with nulls as NONE."""
+    dtype = merged_dataframe.schema[column]
+    if dtype == pl.Utf8:
+        text = pl.col(column)
+    elif dtype.is_integer() or dtype == pl.Boolean:
+        text = pl.col(column).cast(pl.Utf8)
+    else:
+        # e.g. floats and dates, which Polars formats differently from Python
+        text = pl.lit(
+            pl.Series(
+                [None if value is None else str(value) for value in merged_dataframe[column]],
+                dtype=pl.Utf8,
+            )
+        )
+    return text.fill_null("None").str.to_uppercase()
+
+
 def convert_to_sentences(
     merged_dataframe: pl.DataFrame,
     skip_columns: list[str] | None = DEFAULT_COLUMNS_DONT_CONVERT,
-) -> list[VectorData]:
-    sentences: list[VectorData] = []
+) -> pl.DataFrame:
+    """
+    Describe each record as a sentence of its upper-cased fields, returning a text and hash frame.
+
+    Sentences read "ENTITY NAME: <name>; <FIELD>: <value>; ...;", with NAN values left empty.
+    """
+    if merged_dataframe.is_empty():
+        return pl.DataFrame(schema={"text": pl.Utf8, "hash": pl.Utf8})
     skip_columns = skip_columns or []
-    cols = merged_dataframe.columns
-    for row in merged_dataframe.iter_rows(named=True):
-        sentence = 'ENTITY NAME: ' + row["Entity name"].upper() + "; "
-        for field in cols:
-            if field not in skip_columns:
-                val = str(row[field]).upper()
-                if val == "NAN":
-                    val = ""
-                sentence += field.upper() + ": " + val + "; "
-        sentence = sentence.strip()
-        text_hashed = hash_text(sentence)
-        sentences.append({"text": sentence, "hash": text_hashed})
-
-    return sentences
+    parts = [pl.lit("ENTITY NAME: "), _upper_text(merged_dataframe, "Entity name")]
+    for field in merged_dataframe.columns:
+        if field not in skip_columns:
+            value = _upper_text(merged_dataframe, field)
+            parts.append(pl.lit("; " + field.upper() + ": "))
+            parts.append(pl.when(value == "NAN").then(pl.lit("")).otherwise(value))
+    parts.append(pl.lit(";"))
+    texts = merged_dataframe.select(pl.concat_str(parts).alias("text"))["text"]
+    return pl.DataFrame(
+        {"text": texts, "hash": pl.Series(hash_texts(texts.to_list()), dtype=pl.Utf8)}
+    )
+
+
+def normalize_vectors(embeddings) -> np.ndarray:
+    """Scale vectors to unit length as float32, leaving zero vectors at zero."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _thread_workers(max_workers: int | None) -> int:
+    """The number of threads a ThreadPoolExecutor(max_workers) runs."""
+    return max_workers or min(32, (os.cpu_count() or 1) + 4)
+
+
+def similarity_block_rows(num_columns: int, num_workers: int = 1) -> int:
+    """
+    The number of rows of similarity blocks with num_columns columns, so that num_workers blocks
+    computed at once and their argpartition indices fit in NEAREST_NEIGHBORS_BLOCK_BYTES.
+    """
+    row_bytes = NEAREST_NEIGHBORS_BYTES_PER_SIMILARITY * max(num_columns, 1) * num_workers
+    return max(1, NEAREST_NEIGHBORS_BLOCK_BYTES // row_bytes)
+
+
+def _top_k_cosine_block(
+    normalized: np.ndarray, start: int, stop: int, n_neighbors: int
+) -> tuple[np.ndarray, np.ndarray]:
+    negated = normalized[start:stop] @ normalized.T
+    # negated in place rather than copied, as argpartition selects the smallest values
+    np.negative(negated, out=negated)
+    rows = np.arange(stop - start)
+    # each record is its own nearest neighbor, even among duplicates
+    negated[rows, start + rows] = -np.inf
+    if n_neighbors < negated.shape[1]:
+        top = np.argpartition(negated, n_neighbors - 1, axis=1)[:, :n_neighbors]
+    else:
+        top = np.broadcast_to(np.arange(negated.shape[1]), negated.shape)
+    top_negated = np.take_along_axis(negated, top, axis=1)
+    order = np.argsort(top_negated, axis=1, kind="stable")
+    indices = np.take_along_axis(top, order, axis=1)
+    top_similarities = -np.take_along_axis(top_negated, order, axis=1)
+    top_similarities[:, 0] = 1
+    distances = np.clip(1 - top_similarities, 0, 2)
+    return distances, indices
+
+
+def _exact_nearest_neighbors(
+    normalized: np.ndarray, n_neighbors: int, max_workers: int | None
+) -> tuple[np.ndarray, np.ndarray]:
+    num_records = len(normalized)
+    num_workers = _thread_workers(max_workers)
+    block_size = similarity_block_rows(num_records, num_workers)
+    distances = np.empty((num_records, n_neighbors), dtype=np.float32)
+    indices = np.empty((num_records, n_neighbors), dtype=np.int32)
+
+    def fill_block(start: int) -> None:
+        stop = min(start + block_size, num_records)
+        distances[start:stop], indices[start:stop] = _top_k_cosine_block(
+            normalized, start, stop, n_neighbors
+        )
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(fill_block, range(0, num_records, block_size)))
+    return distances, indices
+
+
+def _self_first(
+    distances: np.ndarray, indices: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Put each record first among its neighbors at distance 0, keeping the order of the others.
+
+    A record listed later, e.g. after its duplicates, is moved to the front; a record missing from
+    its own neighbors replaces the farthest one.
+    """
+    rows = np.arange(len(indices))
+    is_self = indices == rows[:, None]
+    dropped = np.where(is_self.any(axis=1), is_self.argmax(axis=1), indices.shape[1] - 1)
+    columns = np.arange(indices.shape[1])
+    # columns up to the dropped one shift right by one, leaving column 0 for the record itself
+    source = np.where(columns <= dropped[:, None], columns - 1, columns)
+    source[:, 0] = 0
+    indices = np.take_along_axis(indices, source, axis=1)
+    distances = np.take_along_axis(distances, source, axis=1)
+    indices[:, 0] = rows
+    distances[:, 0] = 0
+    return distances, indices
+
+
+def _approximate_nearest_neighbors(
+    normalized: np.ndarray, n_neighbors: int, max_workers: int | None
+) -> tuple[np.ndarray, np.ndarray]:
+    try:
+        hnswlib = importlib.import_module("hnswlib")
+    except ImportError as e:
+        msg = "Approximate nearest neighbors require the hnswlib package"
+        raise ImportError(msg) from e
+    num_threads = max_workers or -1
+    index = hnswlib.Index(space="cosine", dim=normalized.shape[1])
+    index.init_index(
+        max_elements=len(normalized),
+        ef_construction=APPROXIMATE_NEIGHBORS_EF_CONSTRUCTION,
+        M=APPROXIMATE_NEIGHBORS_M,
+    )
+    index.add_items(normalized, np.arange(len(normalized)), num_threads=num_threads)
+    index.set_ef(max(2 * n_neighbors, APPROXIMATE_NEIGHBORS_EF_CONSTRUCTION // 4))
+    indices, distances = index.knn_query(
+        normalized, k=n_neighbors, num_threads=num_threads
+    )
+    # each record is its own nearest neighbor, even among duplicates, as with exact neighbors
+    return _self_first(distances.astype(np.float32), indices.astype(np.int32))
 
 
 def build_nearest_neighbors(
     embeddings: np.array,
-    n_neighbors: int = 50,
+    n_neighbors: int = DEFAULT_NEAREST_NEIGHBORS,
     leaf_size: int = 20,
     metric: str = "cosine",
+    max_workers: int | None = None,
+    approximate: bool = False,
 ) -> tuple[np.array, np.array]:
+    """
+    Find the n_neighbors nearest embeddings to each embedding, itself first.
+
+    Cosine neighbors are found exactly from blocks of normalized float32 similarities computed
+    across threads, sized so that the blocks in flight stay within NEAREST_NEIGHBORS_BLOCK_BYTES,
+    or approximately with an HNSW index from the optional hnswlib package. Other metrics use
+    scikit-learn.
+    """
     if len(embeddings) < n_neighbors:
         msg = f"Number of neighbors ({n_neighbors}) is greater than number of embeddings ({len(embeddings)})"
         raise ValueError(msg)
 
-    nbrs = NearestNeighbors(
-        n_neighbors=n_neighbors,
-        n_jobs=1,
-        algorithm="auto",
-        leaf_size=leaf_size,
-        metric=metric,
-    ).fit(embeddings)
+    if metric != "cosine":
+        nbrs = NearestNeighbors(
+            n_neighbors=n_neighbors,
+            n_jobs=max_workers or -1,
+            algorithm="auto",
+            leaf_size=leaf_size,
+            metric=metric,
+        ).fit(embeddings)
+        return nbrs.kneighbors(embeddings)
 
-    distances, indices = nbrs.kneighbors(embeddings)
-    return distances, indices
+    normalized = normalize_vectors(embeddings)
+    if approximate:
+        return _approximate_nearest_neighbors(normalized, n_neighbors, max_workers)
+    return _exact_nearest_neighbors(normalized, n_neighbors, max_workers)
 
 
 def build_near_map(
@@ -84,87 +241,305 @@ def build_near_map(
     return near_map
 
 
+def build_blocked_near_map(
+    embeddings: np.ndarray,
+    blocks: list[np.ndarray],
+    n_neighbors: int = DEFAULT_NEAREST_NEIGHBORS,
+    max_record_distance: float = DEFAULT_MAX_RECORD_DISTANCE,
+    max_workers: int | None = None,
+) -> defaultdict[Any, list]:
+    """
+    Map each record to the records within max_record_distance among its nearest neighbors in
+    each block it belongs to, like build_near_map but comparing records only within blocks.
+    """
+    normalized = normalize_vectors(embeddings)
+    num_workers = _thread_workers(max_workers)
+
+    def block_pairs(members: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        block = normalized[members]
+        k = min(n_neighbors, len(members))
+        chunk_size = similarity_block_rows(len(members), num_workers)
+        ix_parts = []
+        nx_parts = []
+        for start in range(0, len(members), chunk_size):
+            stop = min(start + chunk_size, len(members))
+            distances, indices = _top_k_cosine_block(block, start, stop, k)
+            rows, columns = np.nonzero(distances[:, 1:] <= max_record_distance)
+            ix_parts.append(members[start + rows])
+            nx_parts.append(members[indices[rows, columns + 1]])
+        return np.concatenate(ix_parts), np.concatenate(nx_parts)
+
+    near_map = defaultdict(list)
+    if len(blocks) == 0:
+        return near_map
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(block_pairs, blocks))
+    pairs = np.unique(
+        np.column_stack(
+            [
+                np.concatenate([ix for ix, _ in results]),
+                np.concatenate([nx for _, nx in results]),
+            ]
+        ).astype(np.int64),
+        axis=0,
+    )
+    for ix, nx in pairs.tolist():
+        near_map[ix].append(nx)
+    return near_map
+
+
+def build_name_index(
+    names: list[str], ngram_size: int = NAME_NGRAM_SIZE
+) -> tuple[np.ndarray, sparse.csr_matrix]:
+    """
+    Index the distinct upper-cased names of records and their n-grams.
+
+    Returns the name id of each record, and a binary (name, n-gram) matrix of the n-grams of each
+    distinct name after removing punctuation.
+    """
+    name_to_id = {}
+    name_ids = np.array(
+        [name_to_id.setdefault(name.upper(), len(name_to_id)) for name in names],
+        dtype=np.int64,
+    )
+    gram_to_id = {}
+    indptr = [0]
+    indices = []
+    for name in name_to_id:
+        cleaned = re.sub(r"[^\w\s]", "", name)
+        grams = {cleaned[i : i + ngram_size] for i in range(len(cleaned) - ngram_size + 1)}
+        indices.extend(gram_to_id.setdefault(gram, len(gram_to_id)) for gram in grams)
+        indptr.append(len(indices))
+    name_grams = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), indices, indptr),
+        shape=(len(name_to_id), len(gram_to_id)),
+    )
+    return name_ids, name_grams
+
+
+def score_name_pairs(
+    name_ids: np.ndarray,
+    name_grams: sparse.csr_matrix,
+    ix: np.ndarray,
+    nx: np.ndarray,
+    block_size: int = PAIR_SCORE_BLOCK_SIZE,
+) -> np.ndarray:
+    """Score record pairs 1 for equal names, else by the Jaccard similarity of their name n-grams."""
+    ix_names = name_ids[ix]
+    nx_names = name_ids[nx]
+    scores = np.ones(len(ix), dtype=np.float64)
+    different = ix_names != nx_names
+    if not different.any():
+        return scores
+    # each distinct pair of names is scored once
+    num_names = name_grams.shape[0]
+    keys = np.minimum(ix_names[different], nx_names[different]) * num_names + np.maximum(
+        ix_names[different], nx_names[different]
+    )
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    first_names = unique_keys // num_names
+    second_names = unique_keys % num_names
+    intersections = np.empty(len(unique_keys), dtype=np.float64)
+    for start in range(0, len(unique_keys), block_size):
+        stop = start + block_size
+        intersections[start:stop] = np.asarray(
+            name_grams[first_names[start:stop]]
+            .multiply(name_grams[second_names[start:stop]])
+            .sum(axis=1)
+        ).ravel()
+    gram_counts = np.diff(name_grams.indptr)
+    unions = gram_counts[first_names] + gram_counts[second_names] - intersections
+    jaccard = np.divide(
+        intersections, unions, out=np.zeros_like(intersections), where=unions > 0
+    )
+    scores[different] = jaccard[inverse]
+    return scores
+
+
 def build_sentence_pair_scores(
     near_map: defaultdict[Any, list], merged_df: pl.DataFrame
 ) -> list:
-    sentence_pair_scores = []
-    for ix, nx_list in near_map.items():
-        ixrec = merged_df.row(ix, named=True)
-        for nx in nx_list:
-            nxrec = merged_df.row(nx, named=True)
-            ixn = ixrec["Entity name"].upper()
-            nxn = nxrec["Entity name"].upper()
-            if ixn == nxn:
-                score = 1
-            else:
-                ixn_c = re.sub(r"[^\w\s]", "", ixn)
-                nxn_c = re.sub(r"[^\w\s]", "", nxn)
-                N = 3
-                igrams = {ixn_c[i : i + N] for i in range(len(ixn_c) - N + 1)}
-                ngrams = {nxn_c[i : i + N] for i in range(len(nxn_c) - N + 1)}
-                inter = len(igrams.intersection(ngrams))
-                union = len(igrams.union(ngrams))
-                score = inter / union if union > 0 else 0
-
-            sentence_pair_scores.append(
-                (
-                    ix,
-                    nx,
-                    score,
-                )
+    if len(near_map) == 0:
+        return []
+    ix = np.repeat(
+        np.fromiter(near_map.keys(), dtype=np.int64, count=len(near_map)),
+        [len(nx_list) for nx_list in near_map.values()],
+    )
+    nx = np.fromiter(
+        (nx for nx_list in near_map.values() for nx in nx_list),
+        dtype=np.int64,
+        count=len(ix),
+    )
+    name_ids, name_grams = build_name_index(merged_df["Entity name"].to_list())
+    scores = score_name_pairs(name_ids, name_grams, ix, nx)
+    return list(zip(ix.tolist(), nx.tolist(), scores.tolist()))
+
+
+class EntityGroups:
+    """
+    Disjoint sets of entities, merged with union by rank and path compression.
+
+    Each set carries a group label and the sum and count of its pair scores, so group means need
+    no further pass. Labels are numbered as groups are created; when two groups merge, the merged
+    group keeps the label of the second entity's group.
+    """
+
+    def __init__(self, num_entities: int) -> None:
+        self.parent = list(range(num_entities))
+        self.rank = [0] * num_entities
+        self.label = [-1] * num_entities
+        self.score_sum = [0.0] * num_entities
+        self.score_count = [0] * num_entities
+        self.num_groups = 0
+
+    def add_entities(self, count: int) -> None:
+        """Add count entities, each in no group."""
+        self.parent.extend(range(len(self.parent), len(self.parent) + count))
+        self.rank.extend([0] * count)
+        self.label.extend([-1] * count)
+        self.score_sum.extend([0.0] * count)
+        self.score_count.extend([0] * count)
+
+    def find(self, entity: int) -> int:
+        parent = self.parent
+        while parent[entity] != entity:
+            parent[entity] = parent[parent[entity]]
+            entity = parent[entity]
+        return entity
+
+    def group_of(self, entity: int) -> int:
+        """The group label of an entity, or -1 if it is in no group."""
+        return self.label[self.find(entity)]
+
+    def union(self, first: int, second: int) -> int:
+        first_root = self.find(first)
+        second_root = self.find(second)
+        label = self.label[second_root]
+        if label == -1:
+            label = self.label[first_root]
+        if label == -1:
+            label = self.num_groups
+            self.num_groups += 1
+        if first_root != second_root:
+            if self.rank[first_root] > self.rank[second_root]:
+                first_root, second_root = second_root, first_root
+            self.parent[first_root] = second_root
+            if self.rank[first_root] == self.rank[second_root]:
+                self.rank[second_root] += 1
+            self.score_sum[second_root] += self.score_sum[first_root]
+            self.score_count[second_root] += self.score_count[first_root]
+        self.label[second_root] = label
+        return second_root
+
+    def add_score(self, entity: int, score: float, previous: float | None = None) -> None:
+        """Count a pair score in the entity's group, replacing the pair's previous score if any."""
+        root = self.find(entity)
+        if previous is None:
+            self.score_sum[root] += score
+            self.score_count[root] += 1
+        else:
+            self.score_sum[root] += score - previous
+
+    def group_mean_scores(self) -> dict[int, float]:
+        return {
+            self.label[root]: self.score_sum[root] / self.score_count[root]
+            for root in range(len(self.parent))
+            if self.parent[root] == root and self.score_count[root] > 0
+        }
+
+
+def merge_scored_pairs(
+    groups: EntityGroups,
+    row_entities: np.ndarray,
+    entity_names: list[str],
+    sentence_pair_scores,
+    pair_to_match: dict,
+    sentence_pair_jaccard_threshold: float = DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD,
+) -> np.ndarray:
+    """
+    Merge the entities of record pairs scoring above the threshold into groups, highest scores
+    first, recording each entity pair's score in pair_to_match. Returns the merged record pairs
+    with their scores, in merge order.
+    """
+    pairs = np.asarray(sentence_pair_scores, dtype=np.float64).reshape(-1, 3)
+    pairs = pairs[np.argsort(-pairs[:, 2], kind="stable")]
+    pairs = pairs[pairs[:, 2] >= sentence_pair_jaccard_threshold]
+    ix_entities = row_entities[pairs[:, 0].astype(np.int64)].tolist()
+    nx_entities = row_entities[pairs[:, 1].astype(np.int64)].tolist()
+    for ix_entity, nx_entity, score in zip(ix_entities, nx_entities, pairs[:, 2].tolist()):
+        groups.union(ix_entity, nx_entity)
+        pair = tuple(sorted([entity_names[ix_entity], entity_names[nx_entity]]))
+        groups.add_score(ix_entity, score, pair_to_match.get(pair))
+        pair_to_match[pair] = score
+    return pairs
+
+
+def build_entity_ids(merged_df: pl.DataFrame, entity_ids: dict[str, int]) -> np.ndarray:
+    """Number the name::dataset entities of records, adding new entities to entity_ids."""
+    return np.array(
+        [
+            entity_ids.setdefault(f"{name}::{dataset}", len(entity_ids))
+            for name, dataset in zip(
+                merged_df["Entity name"].to_list(), merged_df["Dataset"].to_list()
             )
-    return sentence_pair_scores
+        ],
+        dtype=np.int64,
+    )
 
 
-def build_matches(
+def build_match_groups(
     sentence_pair_scores,
     merged_df: pl.DataFrame,
     sentence_pair_jaccard_threshold: float = DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD,
-) -> tuple[dict, set, dict]:
-    entity_to_group = {}
-    group_id = 0
-    matches = set()
+) -> MatchGroups:
+    """Group the entities of record pairs scoring above the threshold, highest scores first."""
+    entity_ids = {}
+    row_entities = build_entity_ids(merged_df, entity_ids)
+    entity_names = list(entity_ids)
+    groups = EntityGroups(len(entity_names))
     pair_to_match = {}
-
-    for ix, nx, score in sorted(
+    pairs = merge_scored_pairs(
+        groups,
+        row_entities,
+        entity_names,
         sentence_pair_scores,
-        key=lambda x: x[2],
-        reverse=True,
-    ):
-        if score < sentence_pair_jaccard_threshold:
-            continue
-
-        ixrec = merged_df.row(ix, named=True)
-        nxrec = merged_df.row(nx, named=True)
-        ixn = ixrec["Entity name"]
-        nxn = nxrec["Entity name"]
-        ixp = ixrec["Dataset"]
-        nxp = nxrec["Dataset"]
-
-        ix_id = f"{ixn}::{ixp}"
-        nx_id = f"{nxn}::{nxp}"
-
-        if ix_id in entity_to_group and nx_id in entity_to_group:
-            ig = entity_to_group[ix_id]
-            ng = entity_to_group[nx_id]
-            if ig != ng:
-                for k, v in list(entity_to_group.items()):
-                    if v == ig:
-                        entity_to_group[k] = ng
-        elif ix_id in entity_to_group:
-            entity_to_group[nx_id] = entity_to_group[ix_id]
-        elif nx_id in entity_to_group:
-            entity_to_group[ix_id] = entity_to_group[nx_id]
-        else:
-            entity_to_group[ix_id] = group_id
-            entity_to_group[nx_id] = group_id
-            group_id += 1
+        pair_to_match,
+        sentence_pair_jaccard_threshold,
+    )[:, :2].astype(np.int64)
+    if len(pairs) == 0:
+        empty = np.array([], dtype=np.int64)
+        return MatchGroups({}, {}, {}, empty, empty)
+
+    grouped_entities = dict.fromkeys(row_entities[pairs.ravel()].tolist())
+    entity_to_group = {
+        entity_names[entity]: groups.group_of(entity) for entity in grouped_entities
+    }
+    rows = np.unique(pairs)
+    row_groups = np.array(
+        [groups.group_of(entity) for entity in row_entities[rows].tolist()],
+        dtype=np.int64,
+    )
+    return MatchGroups(
+        entity_to_group, pair_to_match, groups.group_mean_scores(), rows, row_groups
+    )
 
-        matches.add((entity_to_group[ix_id], *list(merged_df.row(ix))))
-        matches.add((entity_to_group[nx_id], *list(merged_df.row(nx))))
 
-        pair_to_match[tuple(sorted([ix_id, nx_id]))] = score
-    return entity_to_group, matches, pair_to_match
+def build_matches(
+    sentence_pair_scores,
+    merged_df: pl.DataFrame,
+    sentence_pair_jaccard_threshold: float = DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD,
+) -> tuple[dict, set, dict]:
+    match_groups = build_match_groups(
+        sentence_pair_scores, merged_df, sentence_pair_jaccard_threshold
+    )
+    matches = {
+        (group, *values)
+        for group, values in zip(
+            match_groups.row_groups.tolist(),
+            merged_df[match_groups.rows.tolist()].iter_rows(),
+        )
+    }
+    return match_groups.entity_to_group, matches, match_groups.pair_to_match
 
 
 def _calculate_mean_score(pair_to_match: dict, entity_to_group: dict) -> dict:
@@ -187,7 +562,10 @@ def _calculate_mean_score(pair_to_match: dict, entity_to_group: dict) -> dict:
 
 
 def build_matches_dataset(
-    matches_df: pl.DataFrame, pair_to_match: dict, entity_to_group: dict
+    matches_df: pl.DataFrame,
+    pair_to_match: dict,
+    entity_to_group: dict,
+    group_to_mean_similarity: dict | None = None,
 ) -> pl.DataFrame:
     if matches_df.is_empty():
         return matches_df
@@ -226,8 +604,9 @@ def build_matches_dataset(
         .alias("Entity ID")
     ).filter(pl.col("Group size") > 1)
 
-    # iterate over groups, calculating mean score
-    group_to_mean_similarity = _calculate_mean_score(pair_to_match, entity_to_group)
+    # mean score of each group, unless already known from grouping
+    if group_to_mean_similarity is None:
+        group_to_mean_similarity = _calculate_mean_score(pair_to_match, entity_to_group)
 
     if matches_df.is_empty():
         return matches_df
@@ -0,0 +1,382 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+
+import json
+import os
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from toolkit.match_entity_records.classes import MatchGroups
+from toolkit.match_entity_records.config import (
+    DEFAULT_MAX_RECORD_DISTANCE,
+    DEFAULT_NEAREST_NEIGHBORS,
+    DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD,
+    MATCH_INDEX_FORMAT_VERSION,
+)
+from toolkit.match_entity_records.detect import (
+    EntityGroups,
+    build_entity_ids,
+    build_matches_dataset,
+    build_name_index,
+    merge_scored_pairs,
+    normalize_vectors,
+    score_name_pairs,
+    similarity_block_rows,
+)
+
+MANIFEST_FILE = "index.json"
+
+
+def _part_path(path, name: str, part: int, extension: str) -> str:
+    return os.path.join(path, f"{name}-{part:05d}.{extension}")
+
+
+def _top_k_similar(
+    queries: np.ndarray, vectors: np.ndarray, n_neighbors: int, offset: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """The n_neighbors most cosine-similar vectors to each query, with indices offset by offset."""
+    negated = queries @ vectors.T
+    # negated in place rather than copied, as argpartition selects the smallest values
+    np.negative(negated, out=negated)
+    if n_neighbors < negated.shape[1]:
+        top = np.argpartition(negated, n_neighbors - 1, axis=1)[:, :n_neighbors]
+    else:
+        top = np.broadcast_to(np.arange(negated.shape[1]), negated.shape)
+    return -np.take_along_axis(negated, top, axis=1), top + offset
+
+
+class MatchIndex:
+    """
+    Matched records persisted to a directory, so that new records can be matched incrementally.
+
+    Each batch of records is saved as a new part: the records, their normalized embeddings, the
+    entities they introduce, their entity numbers and a log of the entity unions their pairs made,
+    with the pair scores. Saving a batch writes only its own part files and the manifest, and
+    loading replays the union logs to rebuild the entity groups, reading no records. New records
+    are compared only with the index, by their nearest embedding neighbors and name n-grams, and
+    merged into the existing groups.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_record_distance: float = DEFAULT_MAX_RECORD_DISTANCE,
+        sentence_pair_jaccard_threshold: float = DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD,
+        n_neighbors: int = DEFAULT_NEAREST_NEIGHBORS,
+    ) -> None:
+        self.path = path
+        self.max_record_distance = max_record_distance
+        self.sentence_pair_jaccard_threshold = sentence_pair_jaccard_threshold
+        self.n_neighbors = n_neighbors
+        self.columns: list[str] = []
+        self.part_sizes: list[int] = []
+        self.vector_parts: list[np.ndarray] = []
+        self.entity_ids: dict[str, int] = {}
+        self.entity_names: list[str] = []
+        self.entity_record_names: list[str] = []
+        self.row_entities = np.array([], dtype=np.int64)
+        self.groups = EntityGroups(0)
+        self.pair_to_match: dict[tuple[str, str], float] = {}
+
+    @property
+    def num_records(self) -> int:
+        return len(self.row_entities)
+
+    @property
+    def num_parts(self) -> int:
+        return len(self.part_sizes)
+
+    @classmethod
+    def create(
+        cls,
+        path,
+        merged_df: pl.DataFrame,
+        embeddings: np.ndarray,
+        sentence_pair_scores,
+        max_record_distance: float = DEFAULT_MAX_RECORD_DISTANCE,
+        sentence_pair_jaccard_threshold: float = DEFAULT_SENTENCE_PAIR_JACCARD_THRESHOLD,
+        n_neighbors: int = DEFAULT_NEAREST_NEIGHBORS,
+    ) -> "MatchIndex":
+        """Create and save an index of matched records from the pair scores of a full matching run."""
+        index = cls(path, max_record_distance, sentence_pair_jaccard_threshold, n_neighbors)
+        os.makedirs(path, exist_ok=True)
+        index.columns = merged_df.columns
+        index._merge_part(merged_df, normalize_vectors(embeddings), sentence_pair_scores)
+        return index
+
+    @classmethod
+    def load(cls, path) -> "MatchIndex":
+        """Load an index saved part by part, memory-mapping its vectors and replaying its unions."""
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            msg = f"No saved match index found at {path}"
+            raise Exception(msg)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["version"] != MATCH_INDEX_FORMAT_VERSION:
+            msg = f"Unsupported match index format version {manifest['version']}"
+            raise Exception(msg)
+
+        index = cls(
+            path,
+            manifest["max_record_distance"],
+            manifest["sentence_pair_jaccard_threshold"],
+            manifest["n_neighbors"],
+        )
+        index.columns = manifest["columns"]
+        row_entities = []
+        for part in range(manifest["num_parts"]):
+            entities = pq.read_table(_part_path(path, "entities", part, "parquet")).to_pydict()
+            index._add_entities(entities["entity"], entities["name"])
+            row_entities.append(np.load(_part_path(path, "row_entities", part, "npy")))
+            vectors = np.load(_part_path(path, "vectors", part, "npy"), mmap_mode="r")
+            index.vector_parts.append(vectors)
+            index.part_sizes.append(len(vectors))
+            unions = pq.read_table(_part_path(path, "unions", part, "parquet")).to_pydict()
+            index._replay_unions(unions["first"], unions["second"], unions["score"])
+        if row_entities:
+            index.row_entities = np.concatenate(row_entities)
+        return index
+
+    def _add_entities(self, entities: list[str], names: list[str]) -> None:
+        for entity, name in zip(entities, names):
+            self.entity_ids[entity] = len(self.entity_names)
+            self.entity_names.append(entity)
+            self.entity_record_names.append(name)
+        self.groups.add_entities(len(entities))
+
+    def _replay_unions(self, first: list[int], second: list[int], scores: list[float]) -> None:
+        # The logged unions are already filtered and in merge order, so merging them as pairs of
+        # entity-numbered records repeats the original merges exactly.
+        merge_scored_pairs(
+            self.groups,
+            np.arange(len(self.entity_names), dtype=np.int64),
+            self.entity_names,
+            list(zip(first, second, scores)),
+            self.pair_to_match,
+            self.sentence_pair_jaccard_threshold,
+        )
+
+    def _add_records(self, merged_df: pl.DataFrame, normalized: np.ndarray) -> np.ndarray:
+        """Add records and their normalized vectors as a new part in memory, returning their entities."""
+        num_entities = len(self.entity_names)
+        row_entities = build_entity_ids(merged_df, self.entity_ids)
+        new_entities = []
+        new_names = []
+        for name, dataset, entity in zip(
+            merged_df["Entity name"].to_list(),
+            merged_df["Dataset"].to_list(),
+            row_entities.tolist(),
+        ):
+            if entity == num_entities + len(new_entities):
+                new_entities.append(f"{name}::{dataset}")
+                new_names.append(name)
+        self._add_entities(new_entities, new_names)
+        self.row_entities = np.concatenate([self.row_entities, row_entities])
+        self.vector_parts.append(normalized)
+        self.part_sizes.append(len(merged_df))
+        return row_entities
+
+    def _save_part(
+        self,
+        merged_df: pl.DataFrame,
+        row_entities: np.ndarray,
+        num_entities: int,
+        pairs: np.ndarray,
+    ) -> None:
+        """
+        Save the last part: its records and vectors, the entities from num_entities on, which it
+        introduced, and the unions its merged record pairs made. The manifest is written last.
+        """
+        part = self.num_parts - 1
+        merged_df.write_parquet(_part_path(self.path, "records", part, "parquet"))
+        np.save(_part_path(self.path, "vectors", part, "npy"), self.vector_parts[-1])
+        np.save(_part_path(self.path, "row_entities", part, "npy"), row_entities)
+        pq.write_table(
+            pa.table(
+                {
+                    "entity": self.entity_names[num_entities:],
+                    "name": self.entity_record_names[num_entities:],
+                },
+                schema=pa.schema([("entity", pa.string()), ("name", pa.string())]),
+            ),
+            _part_path(self.path, "entities", part, "parquet"),
+        )
+        pq.write_table(
+            pa.table(
+                {
+                    "first": self.row_entities[pairs[:, 0].astype(np.int64)],
+                    "second": self.row_entities[pairs[:, 1].astype(np.int64)],
+                    "score": pairs[:, 2],
+                },
+                schema=pa.schema(
+                    [("first", pa.int64()), ("second", pa.int64()), ("score", pa.float64())]
+                ),
+            ),
+            _part_path(self.path, "unions", part, "parquet"),
+        )
+        self._write_manifest()
+
+    def _merge_part(
+        self, merged_df: pl.DataFrame, normalized: np.ndarray, sentence_pair_scores=None
+    ) -> np.ndarray:
+        """
+        Add records as a new part, merge their scored pairs into the groups and save the part.
+
+        Without sentence_pair_scores, the pairs are found among the nearest neighbors of the new
+        records. Returns the entities of the records.
+        """
+        if set(merged_df.columns) != set(self.columns):
+            msg = f"New records have columns {merged_df.columns}, expected {self.columns}"
+            raise ValueError(msg)
+        merged_df = merged_df.select(self.columns)
+        offset = self.num_records
+        num_entities = len(self.entity_names)
+        row_entities = self._add_records(merged_df, normalized)
+        if sentence_pair_scores is None:
+            ix, nx = self._near_pairs(normalized, offset)
+            sentence_pair_scores = self._score_pairs(ix, nx)
+        pairs = merge_scored_pairs(
+            self.groups,
+            self.row_entities,
+            self.entity_names,
+            sentence_pair_scores,
+            self.pair_to_match,
+            self.sentence_pair_jaccard_threshold,
+        )
+        self._save_part(merged_df, row_entities, num_entities, pairs)
+        return row_entities
+
+    def _write_manifest(self) -> None:
+        manifest = {
+            "version": MATCH_INDEX_FORMAT_VERSION,
+            "num_parts": self.num_parts,
+            "num_records": self.num_records,
+            "columns": self.columns,
+            "max_record_distance": self.max_record_distance,
+            "sentence_pair_jaccard_threshold": self.sentence_pair_jaccard_threshold,
+            "n_neighbors": self.n_neighbors,
+        }
+        with open(os.path.join(self.path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def _read_rows(self, rows: np.ndarray) -> pl.DataFrame:
+        """Read the records at ascending rows, loading only the parts that hold them."""
+        frames = []
+        stop = 0
+        for part, size in enumerate(self.part_sizes):
+            start, stop = stop, stop + size
+            local = rows[(rows >= start) & (rows < stop)] - start
+            if len(local) > 0:
+                records = pl.read_parquet(_part_path(self.path, "records", part, "parquet"))
+                frames.append(records[local.tolist()])
+        if len(frames) == 0:
+            return pl.DataFrame(schema={column: pl.Utf8 for column in self.columns})
+        return pl.concat(frames)
+
+    def _near_pairs(self, normalized: np.ndarray, offset: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the indexed records within max_record_distance among the nearest neighbors of the
+        records from offset on, whose normalized vectors are given.
+        """
+        n_neighbors = self.n_neighbors - 1  # the full run counts each record as its own neighbor
+        # queries are compared with one part at a time, then with the nearest of all parts
+        nearest_width = sum(min(n_neighbors + 1, size) for size in self.part_sizes)
+        chunk_size = similarity_block_rows(max([nearest_width, *self.part_sizes]))
+        ix_parts = []
+        nx_parts = []
+        for start in range(0, len(normalized), chunk_size):
+            queries = normalized[start : start + chunk_size]
+            similarities = []
+            indices = []
+            part_offset = 0
+            for vectors in self.vector_parts:
+                part_similarities, part_indices = _top_k_similar(
+                    queries, vectors, n_neighbors + 1, part_offset
+                )
+                similarities.append(part_similarities)
+                indices.append(part_indices)
+                part_offset += len(vectors)
+            similarities = np.concatenate(similarities, axis=1)
+            indices = np.concatenate(indices, axis=1)
+            query_rows = offset + start + np.arange(len(queries))
+            similarities[indices == query_rows[:, None]] = -np.inf
+            k = min(n_neighbors, similarities.shape[1])
+            top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+            distances = 1 - np.take_along_axis(similarities, top, axis=1)
+            rows, columns = np.nonzero(distances <= self.max_record_distance)
+            ix_parts.append(query_rows[rows])
+            nx_parts.append(np.take_along_axis(indices, top, axis=1)[rows, columns])
+        if len(ix_parts) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(ix_parts), np.concatenate(nx_parts)
+
+    def _score_pairs(self, ix: np.ndarray, nx: np.ndarray) -> list:
+        rows, local = np.unique(np.concatenate([ix, nx]), return_inverse=True)
+        names = [self.entity_record_names[entity] for entity in self.row_entities[rows].tolist()]
+        name_ids, name_grams = build_name_index(names)
+        scores = score_name_pairs(name_ids, name_grams, local[: len(ix)], local[len(ix) :])
+        return list(zip(ix.tolist(), nx.tolist(), scores.tolist()))
+
+    def _entity_roots(self) -> np.ndarray:
+        roots = np.array(self.groups.parent, dtype=np.int64)
+        while True:
+            parents = roots[roots]
+            if np.array_equal(parents, roots):
+                return roots
+            roots = parents
+
+    def match_new_records(self, merged_df: pl.DataFrame, embeddings: np.ndarray) -> MatchGroups:
+        """
+        Add new records to the index, merge them into the existing groups and save the index.
+
+        Returns the groups of the new records, with all their indexed records.
+        """
+        new_entities = self._merge_part(merged_df, normalize_vectors(embeddings))
+
+        roots = self._entity_roots()
+        labels = np.array(self.groups.label, dtype=np.int64)[roots]
+        affected_roots = np.unique(roots[new_entities][labels[new_entities] != -1])
+        in_affected = np.isin(roots, affected_roots)
+        rows = np.flatnonzero(in_affected[self.row_entities])
+        entity_to_group = {
+            self.entity_names[entity]: int(labels[entity]) for entity in np.flatnonzero(in_affected)
+        }
+        pair_to_match = {
+            pair: score
+            for pair, score in self.pair_to_match.items()
+            if pair[0] in entity_to_group
+        }
+        group_to_mean_similarity = {
+            self.groups.label[root]: self.groups.score_sum[root] / self.groups.score_count[root]
+            for root in affected_roots.tolist()
+            if self.groups.score_count[root] > 0
+        }
+        return MatchGroups(
+            entity_to_group,
+            pair_to_match,
+            group_to_mean_similarity,
+            rows,
+            labels[self.row_entities[rows]],
+        )
+
+    def matches_dataset(self, match_groups: MatchGroups) -> pl.DataFrame:
+        """Build the matches dataset of groups returned by match_new_records."""
+        records = self._read_rows(match_groups.rows)
+        matches_df = (
+            records.insert_column(
+                0, pl.Series("Group ID", match_groups.row_groups, dtype=pl.Int64)
+            )
+            .unique(maintain_order=True)
+            .sort(by=["Group ID", "Entity name", "Dataset"], descending=False)
+        )
+        return build_matches_dataset(
+            matches_df,
+            match_groups.pair_to_match,
+            match_groups.entity_to_group,
+            match_groups.group_to_mean_similarity,
+        )
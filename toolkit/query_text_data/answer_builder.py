@@ -74,16 +74,15 @@ async def answer_query(
         batched_extraction_messages = [utils.prepare_messages(prompts.claim_extraction_prompt, {'chunks': texts, 'query': expanded_query}) 
                             for texts in clustered_texts]
 
-        extracted_claims = await utils.map_generate_text(
+        indexed_claims = {}
+        async for cx, claim in utils.map_generate_text_as_completed(
             ai_configuration, batched_extraction_messages, response_format=answer_schema.claim_extraction_format
-        )
-        json_extracted_claims = []
-        for claim in extracted_claims:
+        ):
             try:
-                json_claim = loads(claim)
-                json_extracted_claims.append(json_claim)
+                indexed_claims[cx] = loads(claim)
             except Exception as e:
                 print(f'Error loading claim as JSON: {claim}')
+        json_extracted_claims = [indexed_claims[cx] for cx in sorted(indexed_claims)]
         tasks = []
         claim_context_to_claim_supporting_sources = defaultdict(lambda: defaultdict(set))
         claim_context_to_claim_contradicting_sources = defaultdict(lambda: defaultdict(set))
@@ -7,6 +7,7 @@ import toolkit.query_text_data.relevance_assessor as relevance_assessor
 import toolkit.query_text_data.query_rewriter as query_rewriter
 import toolkit.query_text_data.graph_builder as graph_builder
 import toolkit.query_text_data.answer_builder as answer_builder
+import toolkit.query_text_data.index_store as index_store
 import toolkit.query_text_data.prompts as prompts
 from toolkit.query_text_data.classes import ProcessedChunks, ChunkSearchConfig, AnswerConfig, AnswerObject
 from toolkit.AI.base_embedder import BaseEmbedder
@@ -15,6 +16,7 @@ from toolkit.AI.client import OpenAIClient
 import toolkit.AI.utils as utils
 import networkx as nx
 import pandas as pd
+from collections import defaultdict
 from enum import Enum
 
 class QueryTextDataStage(Enum):
@@ -63,6 +65,8 @@ class QueryTextData:
         self.label_to_chunks = None
         self.processed_chunks = None
         self.cid_to_vector = None
+        self.chunk_matrix = None
+        self.chunks_since_communities = 0
         self.query = None
         self.expanded_query = None
         self.chunk_search_config = None
@@ -129,7 +133,8 @@ class QueryTextData:
             max_cluster_size: int=25,
             min_edge_weight: int=2,
             min_node_degree: int=1,
-            callbacks=[]
+            callbacks=[],
+            max_workers: int | None=None
         ) -> ProcessedChunks:
         """
         Process text chunks by extracting noun-phrase coooccurrences into a concept graph.
@@ -139,6 +144,7 @@ class QueryTextData:
             min_edge_weight (int): The minimum edge weight
             min_node_degree (int): The minimum node degree
             callbacks (list): The list of callbacks
+            max_workers (int | None): The number of processes used to extract noun phrases (serial if None)
 
         Returns:
             ProcessedChunks: The processed chunks
@@ -148,11 +154,98 @@ class QueryTextData:
             max_cluster_size,
             min_edge_weight,
             min_node_degree,
-            callbacks=callbacks
+            callbacks=callbacks,
+            max_workers=max_workers
         )
+        self.chunks_since_communities = 0
         self.stage = QueryTextDataStage.CHUNKS_PROCESSED
         return self.processed_chunks
 
+    async def add_documents(
+            self,
+            input_file_bytes: bytes,
+            analysis_window_size: input_processor.PeriodOption=input_processor.PeriodOption.NONE,
+            max_cluster_size: int=25,
+            min_edge_weight: int=2,
+            min_node_degree: int=1,
+            community_drift_threshold: float=0.1,
+            callbacks: list=[],
+            embedding_callbacks: list=[],
+            max_workers: int | None=None
+        ) -> list[int]:
+        """
+        Add documents to already processed text chunks without reprocessing the existing chunks.
+
+        The files are streamed: concepts are extracted from their chunks while later chunks are still
+        being read. New chunks get new chunk IDs and are embedded if the existing chunks were. Concept communities
+        are only detected again once the share of chunks added since they were last detected exceeds
+        community_drift_threshold; until then, new chunks are indexed against the existing communities.
+
+        Args:
+            input_file_bytes (bytes): The input file bytes
+            analysis_window_size (input_processor.PeriodOption): The analysis window size
+            max_cluster_size (int): The maximum cluster size
+            min_edge_weight (int): The minimum edge weight
+            min_node_degree (int): The minimum node degree
+            community_drift_threshold (float): The share of new chunks above which communities are detected again
+            callbacks (list): The list of callbacks, told as each file starts being read
+            embedding_callbacks (list): The list of callbacks used while embedding the new chunks
+            max_workers (int | None): The number of processes used to extract noun phrases (serial if None)
+
+        Returns:
+            list[int]: The new chunk IDs
+        """
+        if self.processed_chunks is None:
+            msg = "Text chunks must be processed before adding documents"
+            raise Exception(msg)
+        if self.label_to_chunks is None:
+            self.label_to_chunks = {}
+        existing_labels = input_processor.find_file_labels(self.label_to_chunks, input_file_bytes.keys())
+        if len(existing_labels) > 0:
+            msg = f"Documents already added: {', '.join(existing_labels)}"
+            raise Exception(msg)
+        label_to_chunks = defaultdict(list)
+
+        def record_chunks():
+            for label, chunk in input_processor.stream_file_chunks(input_file_bytes, analysis_window_size, callbacks):
+                label_to_chunks[label].append(chunk)
+                yield label, chunk
+
+        # chunks are numbered and their concepts extracted while the files are still being read
+        new_cids = input_processor.add_chunks(
+            self.processed_chunks,
+            record_chunks(),
+            max_workers=max_workers
+        )
+        self.label_to_chunks.update(label_to_chunks)
+
+        self.chunks_since_communities += len(new_cids)
+        drift = self.chunks_since_communities / max(len(self.processed_chunks.cid_to_text), 1)
+        if drift > community_drift_threshold:
+            input_processor.update_communities(
+                self.processed_chunks,
+                max_cluster_size,
+                min_edge_weight,
+                min_node_degree
+            )
+            self.chunks_since_communities = 0
+        else:
+            input_processor.update_community_index(self.processed_chunks)
+
+        if self.cid_to_vector is not None:
+            cid_to_vector = await helper_functions.embed_texts(
+                {cid: self.processed_chunks.cid_to_text[cid] for cid in new_cids},
+                self.text_embedder,
+                cache_data=self.embedding_cache,
+                callbacks=embedding_callbacks
+            )
+            self.cid_to_vector.update(cid_to_vector)
+            self.chunk_matrix = helper_functions.extend_chunk_matrix(self.chunk_matrix, cid_to_vector)
+            self.prepare_for_new_query()
+        else:
+            self.stage = QueryTextDataStage.CHUNKS_PROCESSED
+        return new_cids
+
     async def embed_text_chunks(
             self,
             callbacks: list=[]
@@ -172,9 +265,61 @@ class QueryTextData:
             cache_data=self.embedding_cache,
             callbacks=callbacks
         )
+        self.chunk_matrix = helper_functions.build_chunk_matrix(self.cid_to_vector)
         self.stage = QueryTextDataStage.CHUNKS_EMBEDDED
         return self.cid_to_vector
     
+    def save_index(
+            self,
+            path: str
+        ) -> None:
+        """
+        Save the processed chunks and, if embedded, their vectors to a directory.
+
+        Args:
+            path (str): The directory to write to
+        """
+        if self.processed_chunks is None:
+            msg = "Text chunks must be processed before saving the index"
+            raise Exception(msg)
+        index_store.save_index(
+            path,
+            self.processed_chunks,
+            label_to_chunks=self.label_to_chunks,
+            cid_to_vector=self.cid_to_vector,
+            chunk_matrix=self.chunk_matrix,
+            chunks_since_communities=self.chunks_since_communities
+        )
+
+    def load_index(
+            self,
+            path: str
+        ) -> ProcessedChunks:
+        """
+        Load an index saved with save_index, replacing the current workflow state.
+
+        Vectors are memory-mapped, so queries can start without re-embedding the chunks.
+
+        Args:
+            path (str): The directory to read from
+
+        Returns:
+            ProcessedChunks: The processed chunks
+        """
+        self.reset_workflow()
+        (
+            self.processed_chunks,
+            self.label_to_chunks,
+            self.cid_to_vector,
+            self.chunk_matrix,
+            self.chunks_since_communities
+        ) = index_store.load_index(path)
+        if self.cid_to_vector is not None:
+            self.stage = QueryTextDataStage.CHUNKS_EMBEDDED
+        else:
+            self.stage = QueryTextDataStage.CHUNKS_PROCESSED
+        return self.processed_chunks
+
     async def anchor_query_to_concepts(
         self,
         query: str,
@@ -223,8 +368,8 @@ class QueryTextData:
             embedding_cache=self.embedding_cache,
             chunk_search_config=self.chunk_search_config,
             chunk_progress_callback=chunk_progress_callback,
-            chunk_callback=chunk_callback
-
+            chunk_callback=chunk_callback,
+            chunk_matrix=self.chunk_matrix
         )
         self.stage = QueryTextDataStage.CHUNKS_MINED
         return self.relevant_cids, self.search_summary
@@ -3,6 +3,35 @@
 
 import networkx as nx
 import graspologic as gc
+import scipy.sparse as sp
+
+class CommunityIndex:
+    def __init__(
+        self,
+        max_level: int,
+        community_to_parent: dict[str, str],
+        level_to_community_labels: dict[int, list[str]],
+        level_to_cid_communities: dict[int, sp.csr_matrix],
+    ):
+        """
+        Represents the query-independent mapping between text chunks and concept communities at each level.
+
+        Args:
+            max_level (int): The deepest community level
+            community_to_parent (dict[str, str]): A dictionary of community label to parent community label
+            level_to_community_labels (dict[int, list[str]]): A dictionary of level to the labels of the communities containing chunks at that level
+            level_to_cid_communities (dict[int, sp.csr_matrix]): A dictionary of level to a chunk-by-community CSR matrix, whose columns follow level_to_community_labels
+        """
+        self.max_level = max_level
+        self.community_to_parent = community_to_parent
+        self.level_to_community_labels = level_to_community_labels
+        self.level_to_cid_communities = level_to_cid_communities
+        self.level_to_community_cids = {
+            level: matrix.T.tocsr() for level, matrix in level_to_cid_communities.items()
+        }
+
+    def __repr__(self):
+        return f"CommunityIndex(max_level={self.max_level})"
 
 class ProcessedChunks:
     def __init__(
@@ -18,7 +47,8 @@ class ProcessedChunks:
         next_cid: dict[int, int],
         period_to_cids: dict[str, list[int]],
         node_period_counts: dict[str, dict[str, int]],
-        edge_period_counts: dict[tuple[str, str], dict[str, int]]
+        edge_period_counts: dict[tuple[str, str], dict[str, int]],
+        community_index: CommunityIndex | None = None
     ):
         """
         Represents the results of processing text chunks into concepts and communities.
@@ -36,6 +66,7 @@ class ProcessedChunks:
             period_to_cids (dict[str, list[int]]): A dictionary of period to chunk IDs
             node_period_counts (dict[str, dict[str, int]]): A dictionary of period to node to count
             edge_period_counts (dict[tuple[str, str], dict[str, int]]): A dictionary of period to edge to count
+            community_index (CommunityIndex | None): The chunk to community index used to rank communities for each query
         """
         self.cid_to_text = cid_to_text
         self.text_to_cid = text_to_cid
@@ -49,6 +80,7 @@ class ProcessedChunks:
         self.period_to_cids = period_to_cids
         self.node_period_counts = node_period_counts
         self.edge_period_counts = edge_period_counts
+        self.community_index = community_index
 
     def __repr__(self):
         return f"ProcessedChunks(num_chunks={len(self.cid_to_text.keys())})"
@@ -2,15 +2,25 @@
 # Licensed under the MIT license. See LICENSE file in the project.
 
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
 import nltk
 import numpy as np
 import networkx as nx
+import scipy.sparse as sp
 from graspologic import partition
 from nltk.data import find
 from textblob import TextBlob
 
+from toolkit.helpers.constants import (
+    CONCEPT_EXTRACTION_MAX_CHUNKSIZE,
+    CONCEPT_EXTRACTION_MIN_PARALLEL_CHUNKS,
+    CONCEPT_EXTRACTION_TASKS_PER_WORKER,
+)
+from toolkit.query_text_data.classes import CommunityIndex
+
 
 def download_if_not_exists(resource_name) -> None:
     try:
@@ -24,14 +34,63 @@ download_if_not_exists("punkt")
 download_if_not_exists("punkt_tab")
 
 
-def update_concept_graph_edges(node_to_period_counts, edge_to_period_counts, periods, chunk, cid, concept_to_cids, cid_to_concepts):
+def extract_concepts(chunk) -> list[str]:
     nps = sorted(set(TextBlob(chunk).noun_phrases))
     filtered_nps = []
     for np in nps:
         parts = np.split()
         if all([re.match(r"[a-zA-Z0-9\-]+", part) for part in parts]):
             filtered_nps.append(np)
-    filtered_nps = sorted(filtered_nps)
+    return sorted(filtered_nps)
+
+
+def _extract_concepts_batch(extractor, chunks) -> list[list[str]]:
+    return [extractor(chunk) for chunk in chunks]
+
+
+def extract_concepts_many(
+    chunks,
+    max_workers=None,
+    min_parallel_chunks=CONCEPT_EXTRACTION_MIN_PARALLEL_CHUNKS,
+    extractor=None,
+):
+    """
+    Yield the concepts of each chunk, in chunk order.
+
+    Chunks are processed serially unless max_workers is set above 1, which opts in to a pool of
+    that many processes; fewer than min_parallel_chunks chunks are still processed serially.
+    Results are the same either way. chunks may also be an iterator, such as a stream of chunks
+    still being read, whose chunks are processed as they arrive: the pool is given at most
+    CONCEPT_EXTRACTION_TASKS_PER_WORKER tasks per process ahead of the results yielded.
+    """
+    if extractor is None:
+        extractor = extract_concepts
+    num_chunks = len(chunks) if hasattr(chunks, "__len__") else None
+    too_few = num_chunks is not None and num_chunks < max(min_parallel_chunks, 2)
+    if max_workers is None or max_workers <= 1 or too_few:
+        for chunk in chunks:
+            yield extractor(chunk)
+        return
+    # a stream's chunks are sent one by one, so none wait for a batch to fill
+    chunksize = 1
+    if num_chunks is not None:
+        chunksize = max(1, min(CONCEPT_EXTRACTION_MAX_CHUNKSIZE, num_chunks // (max_workers * 4)))
+    chunks = iter(chunks)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(pending) < max_workers * CONCEPT_EXTRACTION_TASKS_PER_WORKER:
+                batch = list(islice(chunks, chunksize))
+                if len(batch) == 0:
+                    break
+                pending.append(executor.submit(_extract_concepts_batch, extractor, batch))
+            if len(pending) == 0:
+                return
+            yield from pending.popleft().result()
+
+
+def update_concept_graph_edges(node_to_period_counts, edge_to_period_counts, periods, chunk, cid, concept_to_cids, cid_to_concepts, concepts=None):
+    filtered_nps = concepts if concepts is not None else extract_concepts(chunk)
     for np in filtered_nps:
         concept_to_cids[np].append(cid)
     cid_to_concepts[cid] = filtered_nps
@@ -133,3 +192,44 @@ def detect_concept_communities(G, max_cluster_size):
                     child_rank = sorted(children, key=lambda x: len(level_to_community_to_concepts[level][x]), reverse=True).index(community)
                     community_to_label[community] = f"{parent_label}.{child_rank+1}"
     return hierarchical_communities, community_to_label
+
+
+def build_community_index(hierarchical_communities, community_to_label, cid_to_concepts, num_cids):
+    concept_to_level_to_community = defaultdict(dict)
+    community_to_parent = {}
+    for hc in hierarchical_communities:
+        concept_to_level_to_community[hc.node][hc.level] = community_to_label[hc.cluster]
+        if hc.parent_cluster is not None:
+            community_to_parent[community_to_label[hc.cluster]] = community_to_label[hc.parent_cluster]
+    max_level = max([hc.level for hc in hierarchical_communities], default=-1)
+    level_to_community_labels = {}
+    level_to_cid_communities = {}
+    for level in range(0, max_level+1):
+        community_to_column = {}
+        rows = []
+        columns = []
+        for cid, concepts in cid_to_concepts.items():
+            for concept in concepts:
+                level_to_community = concept_to_level_to_community.get(concept)
+                if level_to_community is None:
+                    continue
+                # use the community from the previous level if the concept stops there
+                community = level_to_community.get(level, level_to_community.get(level - 1))
+                if community is None:
+                    continue
+                rows.append(cid)
+                columns.append(community_to_column.setdefault(community, len(community_to_column)))
+        matrix = sp.csr_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, columns)),
+            shape=(num_cids, len(community_to_column))
+        )
+        matrix.sum_duplicates()
+        matrix.sort_indices()
+        level_to_community_labels[level] = list(community_to_column.keys())
+        level_to_cid_communities[level] = matrix
+    return CommunityIndex(
+        max_level=max_level,
+        community_to_parent=community_to_parent,
+        level_to_community_labels=level_to_community_labels,
+        level_to_cid_communities=level_to_cid_communities,
+    )
@@ -2,6 +2,9 @@
 # Licensed under the MIT license. See LICENSE file in the project.
 
 import json
+from collections import defaultdict
+
+import numpy as np
 
 from toolkit.AI.base_embedder import BaseEmbedder
 from toolkit.AI.classes import VectorData
@@ -70,23 +73,126 @@ def test_history_elements(test_history, previous_cid, next_cid, adjacent_search_
     return relevant_list, seen_list, adjacent_list
 
 
+def build_chunk_matrix(cid_to_vector) -> tuple[np.ndarray, np.ndarray]:
+    """Stack chunk vectors in cid order as unit-length float32 rows."""
+    cids = np.array(sorted(cid_to_vector.keys()), dtype=np.int64)
+    matrix = np.array([cid_to_vector[cid] for cid in cids], dtype=np.float32)
+    if len(cids) == 0:
+        return cids, matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return cids, matrix / norms
+
+
+def extend_chunk_matrix(chunk_matrix, cid_to_vector) -> tuple[np.ndarray, np.ndarray]:
+    """Add the vectors of new cids to a chunk matrix built by build_chunk_matrix."""
+    cids, matrix = build_chunk_matrix(cid_to_vector)
+    if chunk_matrix is None or len(chunk_matrix[0]) == 0:
+        return cids, matrix
+    if len(cids) == 0:
+        return chunk_matrix
+    cids = np.concatenate([chunk_matrix[0], cids])
+    matrix = np.concatenate([chunk_matrix[1], matrix])
+    order = np.argsort(cids, kind="stable")
+    return cids[order], matrix[order]
+
+def rank_chunks(query_vector, cids, matrix, top_k=None) -> np.ndarray:
+    """
+    Order cids by descending cosine similarity to the query vector.
+
+    The matrix rows must be unit-length (see build_chunk_matrix). Ties keep cid
+    order. With top_k, only the best top_k cids are selected and sorted.
+    """
+    query = np.asarray(query_vector, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm > 0:
+        query = query / norm
+    distances = 1 - matrix @ query
+    if top_k is not None and top_k < len(cids):
+        top = np.argpartition(distances, top_k - 1)[:top_k]
+        top = np.sort(top)
+        return cids[top[np.argsort(distances[top], kind="stable")]]
+    return cids[np.argsort(distances, kind="stable")]
+
+
+def build_rank_array(ranked_cids, num_cids) -> np.ndarray:
+    """Map each cid to its position in ranked_cids; unranked cids come last."""
+    cid_to_rank = np.full(num_cids, len(ranked_cids), dtype=np.int64)
+    cid_to_rank[ranked_cids] = np.arange(len(ranked_cids))
+    return cid_to_rank
+
+
+
+def rank_communities(community_index, level, cid_to_rank, ranking_chunks) -> list[str]:
+    """
+    Order the communities of a level by the mean rank of their best-ranked chunks.
+
+    Only the top ranking_chunks chunks of each community count (all if 0). Ties
+    keep the order of the community index.
+    """
+    community_cids = community_index.level_to_community_cids[level]
+    labels = community_index.level_to_community_labels[level]
+    mean_ranks = np.empty(len(labels))
+    for column in range(len(labels)):
+        cids = community_cids.indices[community_cids.indptr[column]:community_cids.indptr[column + 1]]
+        ranks = cid_to_rank[cids]
+        if len(ranks) > ranking_chunks > 0:
+            ranks = np.partition(ranks, ranking_chunks - 1)[:ranking_chunks]
+        mean_ranks[column] = np.mean(ranks)
+    return [labels[column] for column in np.argsort(mean_ranks, kind="stable")]
+
+
+def assign_cids_to_communities(
+    community_index, level, ranked_cids, community_sequence
+) -> dict[str, list[int]]:
+    """
+    Assign each ranked cid to its earliest community in community_sequence.
+
+    Each community's cids keep the order of ranked_cids.
+    """
+    cid_communities = community_index.level_to_cid_communities[level]
+    labels = community_index.level_to_community_labels[level]
+    label_to_column = {label: column for column, label in enumerate(labels)}
+    column_position = np.empty(len(labels), dtype=np.int64)
+    column_position[[label_to_column[c] for c in community_sequence]] = np.arange(len(community_sequence))
+
+    best_position = np.full(cid_communities.shape[0], -1, dtype=np.int64)
+    rows = np.flatnonzero(np.diff(cid_communities.indptr))
+    if len(rows) > 0:
+        best_position[rows] = np.minimum.reduceat(
+            column_position[cid_communities.indices], cid_communities.indptr[rows]
+        )
+    ranked_cids = np.asarray(ranked_cids, dtype=np.int64)
+    positions = best_position[ranked_cids]
+    ranked_cids = ranked_cids[positions >= 0]
+    positions = positions[positions >= 0]
+    order = np.argsort(positions, kind="stable")
+    grouped_positions, starts = np.unique(positions[order], return_index=True)
+    groups = np.split(ranked_cids[order], starts[1:])
+    return {
+        community_sequence[position]: group.tolist()
+        for position, group in zip(grouped_positions, groups)
+    }
+
 async def embed_texts(
     cid_to_text, text_embedder: BaseEmbedder, cache_data=True, callbacks=[]
 ) -> dict:
     cid_to_vector = {}
+    hash_to_cids = defaultdict(list)
     data: list[VectorData] = []
 
     for cid, text in cid_to_text.items():
+        text_hash = hash_text(text)
+        hash_to_cids[text_hash].append(cid)
         data.append(
-            {"hash": hash_text(text), "text": text, "additional_details": {"cid": cid}}
+            {"hash": text_hash, "text": text, "additional_details": {"cid": cid}}
         )
 
     embedded_data = await text_embedder.embed_store_many(data, callbacks, cache_data)
+    # Cached rows keep the details they were stored with, so map back by hash
     for item in embedded_data:
-        details = json.loads(item["additional_details"])
-        if len(details.keys()) == 0:
-            continue
-        cid_to_vector[details["cid"]] = item["vector"]
+        for cid in hash_to_cids[item["hash"]]:
+            cid_to_vector[cid] = item["vector"]
     return cid_to_vector
 
 async def embed_queries(
@@ -0,0 +1,412 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+
+import json
+import os
+from collections import defaultdict
+from collections.abc import Iterator, MutableMapping
+
+import networkx as nx
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from graspologic.partition import HierarchicalCluster, HierarchicalClusters
+
+import toolkit.query_text_data.graph_builder as graph_builder
+import toolkit.query_text_data.helper_functions as helper_functions
+from toolkit.query_text_data.classes import ProcessedChunks
+
+INDEX_FORMAT_VERSION = 1
+MANIFEST_FILE = "index.json"
+
+
+class MappedVectors(MutableMapping):
+    """
+    Chunk ID to vector mapping over a memory-mapped matrix of saved vectors.
+
+    Rows are looked up by chunk ID on access rather than materialized on load. Vectors added after
+    loading are kept in memory alongside the mapped rows.
+    """
+
+    def __init__(self, cids: np.ndarray, vectors: np.ndarray) -> None:
+        """
+        Args:
+            cids (np.ndarray): The sorted chunk IDs of the mapped rows
+            vectors (np.ndarray): The mapped vectors, one row per chunk ID
+        """
+        self.cids = cids
+        self.vectors = vectors
+        self.added = {}
+        self.removed = set()
+
+    def _row(self, cid) -> int | None:
+        if not isinstance(cid, (int, np.integer)) or cid in self.removed:
+            return None
+        row = int(np.searchsorted(self.cids, cid))
+        if row < len(self.cids) and self.cids[row] == cid:
+            return row
+        return None
+
+    def __getitem__(self, cid) -> np.ndarray:
+        if cid in self.added:
+            return self.added[cid]
+        row = self._row(cid)
+        if row is None:
+            raise KeyError(cid)
+        return self.vectors[row]
+
+    def __setitem__(self, cid, vector) -> None:
+        self.added[cid] = vector
+
+    def __delitem__(self, cid) -> None:
+        if cid in self.added:
+            del self.added[cid]
+        elif self._row(cid) is not None:
+            self.removed.add(cid)
+        else:
+            raise KeyError(cid)
+
+    def __iter__(self) -> Iterator[int]:
+        for cid in self.cids.tolist():
+            if cid not in self.removed and cid not in self.added:
+                yield cid
+        yield from self.added
+
+    def __len__(self) -> int:
+        shadowed = sum(1 for cid in self.added if self._row(cid) is not None)
+        return len(self.cids) - len(self.removed) + len(self.added) - shadowed
+
+
+def _write(path, name, columns: dict, schema: pa.Schema) -> None:
+    pq.write_table(pa.table(columns, schema=schema), os.path.join(path, f"{name}.parquet"))
+
+
+def _read(path, name) -> dict[str, list]:
+    return pq.read_table(os.path.join(path, f"{name}.parquet"), memory_map=True).to_pydict()
+
+
+def _save_chunks(path, processed_chunks: ProcessedChunks, label_to_chunks) -> None:
+    cid_to_label = {}
+    if label_to_chunks is not None:
+        cid = 0
+        for label, chunks in label_to_chunks.items():
+            for _ in chunks:
+                cid_to_label[cid] = label
+                cid += 1
+    cids = sorted(processed_chunks.cid_to_text.keys())
+    _write(
+        path,
+        "chunks",
+        {
+            "cid": cids,
+            "label": [cid_to_label.get(cid) for cid in cids],
+            "text": [processed_chunks.cid_to_text[cid] for cid in cids],
+            "previous_cid": [processed_chunks.previous_cid.get(cid) for cid in cids],
+            "next_cid": [processed_chunks.next_cid.get(cid) for cid in cids],
+            "concepts": [processed_chunks.cid_to_concepts.get(cid) for cid in cids],
+        },
+        pa.schema([
+            ("cid", pa.int64()),
+            ("label", pa.string()),
+            ("text", pa.string()),
+            ("previous_cid", pa.int64()),
+            ("next_cid", pa.int64()),
+            ("concepts", pa.list_(pa.string())),
+        ]),
+    )
+    key_to_cids_schema = pa.schema([("key", pa.string()), ("cids", pa.list_(pa.int64()))])
+    for name, key_to_cids in [
+        ("concept_cids", processed_chunks.concept_to_cids),
+        ("period_cids", processed_chunks.period_to_cids),
+    ]:
+        _write(
+            path,
+            name,
+            {"key": list(key_to_cids.keys()), "cids": list(key_to_cids.values())},
+            key_to_cids_schema,
+        )
+
+
+def _save_counts(path, processed_chunks: ProcessedChunks) -> None:
+    nodes, node_periods, node_counts = [], [], []
+    for node, period_counts in processed_chunks.node_period_counts.items():
+        for period, count in period_counts.items():
+            nodes.append(node)
+            node_periods.append(period)
+            node_counts.append(count)
+    _write(
+        path,
+        "node_counts",
+        {"node": nodes, "period": node_periods, "count": node_counts},
+        pa.schema([("node", pa.string()), ("period", pa.string()), ("count", pa.int64())]),
+    )
+    sources, targets, edge_periods, edge_counts = [], [], [], []
+    for (source, target), period_counts in processed_chunks.edge_period_counts.items():
+        for period, count in period_counts.items():
+            sources.append(source)
+            targets.append(target)
+            edge_periods.append(period)
+            edge_counts.append(count)
+    _write(
+        path,
+        "edge_counts",
+        {"source": sources, "target": targets, "period": edge_periods, "count": edge_counts},
+        pa.schema([
+            ("source", pa.string()),
+            ("target", pa.string()),
+            ("period", pa.string()),
+            ("count", pa.int64()),
+        ]),
+    )
+
+
+def _save_graphs(path, period_concept_graphs) -> None:
+    node_rows = defaultdict(list)
+    edge_rows = defaultdict(list)
+    for period, G in period_concept_graphs.items():
+        for node, data in G.nodes(data=True):
+            node_rows["period"].append(period)
+            node_rows["node"].append(node)
+            node_rows["count"].append(data.get("count"))
+            node_rows["community"].append(data.get("community"))
+        for source, target, data in G.edges(data=True):
+            edge_rows["period"].append(period)
+            edge_rows["source"].append(source)
+            edge_rows["target"].append(target)
+            edge_rows["weight"].append(data.get("weight"))
+    _write(
+        path,
+        "graph_nodes",
+        {key: node_rows[key] for key in ["period", "node", "count", "community"]},
+        pa.schema([
+            ("period", pa.string()),
+            ("node", pa.string()),
+            ("count", pa.int64()),
+            ("community", pa.int64()),
+        ]),
+    )
+    _write(
+        path,
+        "graph_edges",
+        {key: edge_rows[key] for key in ["period", "source", "target", "weight"]},
+        pa.schema([
+            ("period", pa.string()),
+            ("source", pa.string()),
+            ("target", pa.string()),
+            ("weight", pa.int64()),
+        ]),
+    )
+
+
+def _save_communities(path, hierarchical_communities, community_to_label) -> None:
+    hierarchical_communities = hierarchical_communities or []
+    _write(
+        path,
+        "communities",
+        {
+            "node": [hc.node for hc in hierarchical_communities],
+            "cluster": [hc.cluster for hc in hierarchical_communities],
+            "parent_cluster": [hc.parent_cluster for hc in hierarchical_communities],
+            "level": [hc.level for hc in hierarchical_communities],
+            "is_final_cluster": [hc.is_final_cluster for hc in hierarchical_communities],
+        },
+        pa.schema([
+            ("node", pa.string()),
+            ("cluster", pa.int64()),
+            ("parent_cluster", pa.int64()),
+            ("level", pa.int64()),
+            ("is_final_cluster", pa.bool_()),
+        ]),
+    )
+    _write(
+        path,
+        "community_labels",
+        {"cluster": list(community_to_label.keys()), "label": list(community_to_label.values())},
+        pa.schema([("cluster", pa.int64()), ("label", pa.string())]),
+    )
+
+
+def save_index(
+    path,
+    processed_chunks: ProcessedChunks,
+    label_to_chunks=None,
+    cid_to_vector=None,
+    chunk_matrix=None,
+    chunks_since_communities: int = 0,
+) -> None:
+    """
+    Save processed chunks, their concept graphs and communities, and optionally their vectors, to a directory.
+
+    Tables are written as Parquet files and vectors as NumPy arrays, so that load_index can memory-map them.
+
+    Args:
+        path (str): The directory to write to
+        processed_chunks (ProcessedChunks): The processed chunks
+        label_to_chunks (dict[str, list[str]] | None): The label to chunks mapping the chunks were processed from
+        cid_to_vector (dict[int, list[float]] | None): The chunk ID to vector mapping
+        chunk_matrix (tuple[np.ndarray, np.ndarray] | None): The sorted chunk IDs and unit-length vectors, as built by build_chunk_matrix
+        chunks_since_communities (int): The number of chunks added since communities were last detected
+    """
+    os.makedirs(path, exist_ok=True)
+    _save_chunks(path, processed_chunks, label_to_chunks)
+    _save_counts(path, processed_chunks)
+    _save_graphs(path, processed_chunks.period_concept_graphs)
+    _save_communities(path, processed_chunks.hierarchical_communities, processed_chunks.community_to_label)
+    has_vectors = cid_to_vector is not None
+    if has_vectors:
+        cids = np.array(sorted(cid_to_vector.keys()), dtype=np.int64)
+        vectors = np.array([cid_to_vector[cid] for cid in cids], dtype=np.float32)
+        if chunk_matrix is None:
+            chunk_matrix = helper_functions.build_chunk_matrix(cid_to_vector)
+        np.save(os.path.join(path, "vector_cids.npy"), cids)
+        np.save(os.path.join(path, "vectors.npy"), vectors)
+        np.save(os.path.join(path, "unit_vector_cids.npy"), chunk_matrix[0])
+        np.save(os.path.join(path, "unit_vectors.npy"), chunk_matrix[1])
+    manifest = {
+        "version": INDEX_FORMAT_VERSION,
+        "num_chunks": len(processed_chunks.cid_to_text),
+        "has_labels": label_to_chunks is not None,
+        "has_communities": isinstance(processed_chunks.hierarchical_communities, list),
+        "has_vectors": has_vectors,
+        "chunks_since_communities": chunks_since_communities,
+    }
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _load_graphs(path) -> dict[str, nx.Graph]:
+    period_concept_graphs = defaultdict(nx.Graph)
+    period_concept_graphs["ALL"] = nx.Graph()
+    nodes = _read(path, "graph_nodes")
+    for period, node, count, community in zip(nodes["period"], nodes["node"], nodes["count"], nodes["community"]):
+        attributes = {}
+        if count is not None:
+            attributes["count"] = count
+        if community is not None:
+            attributes["community"] = community
+        period_concept_graphs[period].add_node(node, **attributes)
+    edges = _read(path, "graph_edges")
+    for period, source, target, weight in zip(edges["period"], edges["source"], edges["target"], edges["weight"]):
+        if weight is None:
+            period_concept_graphs[period].add_edge(source, target)
+        else:
+            period_concept_graphs[period].add_edge(source, target, weight=weight)
+    return period_concept_graphs
+
+
+def load_index(
+    path,
+) -> tuple[
+    ProcessedChunks,
+    dict[str, list[str]] | None,
+    MappedVectors | None,
+    tuple[np.ndarray, np.ndarray] | None,
+    int,
+]:
+    """
+    Load an index saved by save_index.
+
+    Vectors are memory-mapped rather than read into memory, and looked up by chunk ID on access.
+
+    Args:
+        path (str): The directory to read from
+
+    Returns:
+        tuple: The processed chunks, the label to chunks mapping, the chunk ID to vector mapping and the chunk matrix (each None if not saved), and the number of chunks added since communities were last detected
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        msg = f"No saved index found at {path}"
+        raise Exception(msg)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest["version"] != INDEX_FORMAT_VERSION:
+        msg = f"Unsupported index format version {manifest['version']}"
+        raise Exception(msg)
+
+    chunks = _read(path, "chunks")
+    cid_to_text = dict(zip(chunks["cid"], chunks["text"]))
+    text_to_cid = {text: cid for cid, text in cid_to_text.items()}
+    previous_cid = {cid: p for cid, p in zip(chunks["cid"], chunks["previous_cid"]) if p is not None}
+    next_cid = {cid: n for cid, n in zip(chunks["cid"], chunks["next_cid"]) if n is not None}
+    cid_to_concepts = defaultdict(list)
+    for cid, concepts in zip(chunks["cid"], chunks["concepts"]):
+        if concepts is not None:
+            cid_to_concepts[cid] = concepts
+    label_to_chunks = None
+    if manifest["has_labels"]:
+        label_to_chunks = defaultdict(list)
+        for label, text in zip(chunks["label"], chunks["text"]):
+            label_to_chunks[label].append(text)
+
+    concept_to_cids = defaultdict(list)
+    concept_cids = _read(path, "concept_cids")
+    concept_to_cids.update(zip(concept_cids["key"], concept_cids["cids"]))
+    period_to_cids = defaultdict(list)
+    period_cids = _read(path, "period_cids")
+    period_to_cids.update(zip(period_cids["key"], period_cids["cids"]))
+
+    node_period_counts = defaultdict(lambda: defaultdict(int))
+    node_counts = _read(path, "node_counts")
+    for node, period, count in zip(node_counts["node"], node_counts["period"], node_counts["count"]):
+        node_period_counts[node][period] = count
+    edge_period_counts = defaultdict(lambda: defaultdict(int))
+    edge_counts = _read(path, "edge_counts")
+    for source, target, period, count in zip(
+        edge_counts["source"], edge_counts["target"], edge_counts["period"], edge_counts["count"]
+    ):
+        edge_period_counts[(source, target)][period] = count
+
+    hierarchical_communities = {}
+    community_index = None
+    labels = _read(path, "community_labels")
+    community_to_label = dict(zip(labels["cluster"], labels["label"]))
+    if manifest["has_communities"]:
+        communities = _read(path, "communities")
+        hierarchical_communities = HierarchicalClusters(
+            HierarchicalCluster(*row)
+            for row in zip(
+                communities["node"],
+                communities["cluster"],
+                communities["parent_cluster"],
+                communities["level"],
+                communities["is_final_cluster"],
+            )
+        )
+        community_index = graph_builder.build_community_index(
+            hierarchical_communities, community_to_label, cid_to_concepts, len(cid_to_text)
+        )
+
+    processed_chunks = ProcessedChunks(
+        cid_to_text=cid_to_text,
+        text_to_cid=text_to_cid,
+        period_concept_graphs=_load_graphs(path),
+        hierarchical_communities=hierarchical_communities,
+        community_to_label=community_to_label,
+        concept_to_cids=concept_to_cids,
+        cid_to_concepts=cid_to_concepts,
+        previous_cid=previous_cid,
+        next_cid=next_cid,
+        period_to_cids=period_to_cids,
+        node_period_counts=node_period_counts,
+        edge_period_counts=edge_period_counts,
+        community_index=community_index,
+    )
+
+    cid_to_vector = None
+    chunk_matrix = None
+    if manifest["has_vectors"]:
+        cids = np.load(os.path.join(path, "vector_cids.npy"))
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        cid_to_vector = MappedVectors(cids, vectors)
+        chunk_matrix = (
+            np.load(os.path.join(path, "unit_vector_cids.npy")),
+            np.load(os.path.join(path, "unit_vectors.npy"), mmap_mode="r"),
+        )
+    return (
+        processed_chunks,
+        label_to_chunks,
+        cid_to_vector,
+        chunk_matrix,
+        manifest.get("chunks_since_communities", 0),
+    )
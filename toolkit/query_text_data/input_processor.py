@@ -1,8 +1,12 @@
 # Copyright (c) 2024 Microsoft Corporation. All rights reserved.
 # Licensed under the MIT license. See LICENSE file in the project.
 
+import codecs
 import io
+import os
+import re
 from collections import defaultdict
+from contextlib import nullcontext
 from datetime import datetime
 from enum import Enum
 from json import dumps, loads
@@ -12,14 +16,15 @@ import pandas as pd
 import pdfplumber
 
 import toolkit.query_text_data.graph_builder as graph_builder
-from toolkit.AI.text_splitter import TextSplitter
+from toolkit.AI.text_splitter import get_text_splitter
+from toolkit.helpers.constants import STREAM_BLOCK_SIZE
 from toolkit.query_text_data.classes import ProcessedChunks
 
 PeriodOption = Enum("Period", "NONE DAY WEEK MONTH QUARTER YEAR")
 
 def concert_titled_texts_to_chunks(titled_texts):
     text_to_chunks = defaultdict(list)
-    splitter = TextSplitter()
+    splitter = get_text_splitter()
     for title, text in enumerate(titled_texts.items()):
         text_chunks = splitter.split(text)
         for index, text in enumerate(text_chunks):
@@ -30,7 +35,7 @@ def concert_titled_texts_to_chunks(titled_texts):
 
 def convert_df_to_chunks(df, label):
     label = label.replace('(', '').replace(')', '').replace(' ', '_')
-    splitter = TextSplitter()
+    splitter = get_text_splitter()
     text_to_chunks = defaultdict(list)
     for ix, row in df.iterrows():
         cols = df.columns.values
@@ -44,38 +49,86 @@ def convert_df_to_chunks(df, label):
 
 def convert_file_bytes_to_chunks(input_file_bytes, analysis_window_size: PeriodOption=PeriodOption.NONE, callbacks=[]):
     text_to_chunks = defaultdict(list)
-    splitter = TextSplitter()
-    for fx, file_name in enumerate(input_file_bytes.keys()):
-        old_file_name = file_name
-        file_name = file_name.replace('(', '').replace(')', '').replace(' ', '_')
+    for label, chunk in stream_file_chunks(input_file_bytes, analysis_window_size, callbacks):
+        text_to_chunks[label].append(chunk)
+    return text_to_chunks
+
+def stream_file_chunks(input_files, analysis_window_size: PeriodOption=PeriodOption.NONE, callbacks=[]):
+    """
+    Yield (label, chunk) pairs for each input file as soon as each chunk is produced.
+
+    Files may be given as bytes, paths or binary file objects. PDF pages and blocks of text files
+    are read one at a time, so memory use does not grow with file size.
+    """
+    splitter = get_text_splitter()
+    for fx, old_file_name in enumerate(input_files.keys()):
+        file_name = file_label(old_file_name)
         for cb in callbacks:
-            cb.on_batch_change(fx + 1, len(input_file_bytes.keys()))
-        bytes = input_file_bytes[old_file_name]
+            cb.on_batch_change(fx + 1, len(input_files.keys()))
+        source = input_files[old_file_name]
 
         if file_name.endswith(".csv"):
-            df = pd.read_csv(io.BytesIO(bytes))
-            text_to_chunks = convert_df_to_chunks(df, file_name)
+            with open_binary(source) as f:
+                df = pd.read_csv(f)
+            for label, chunks in convert_df_to_chunks(df, file_name).items():
+                for chunk in chunks:
+                    yield label, chunk
+        elif file_name.endswith(".json"):
+            with open_binary(source) as f:
+                text_json = loads(f.read().decode("utf-8"))
+            for chunk in process_json_text(text_json, analysis_window_size):
+                yield file_name, chunk
         else:
             if file_name.endswith(".pdf"):
-                page_texts = []
-                pdf_reader = pdfplumber.open(io.BytesIO(bytes))
-                for px in range(len(pdf_reader.pages)):
-                    page_text = pdf_reader.pages[px].extract_text()
-                    page_texts.append(page_text)
-                doc_text = " ".join(page_texts)
-            elif file_name.endswith(".json"):
-                text_chunks = process_json_text(loads(bytes.decode("utf-8")), analysis_window_size)
+                texts = iter_pdf_page_texts(source)
+                separator = " "
             else:
-                doc_text = bytes.decode("utf-8")
+                texts = iter_text_blocks(source)
+                separator = ""
+            for index, text in enumerate(splitter.split_stream(texts, separator)):
+                chunk = {"title": file_name, "text_chunk": text, "chunk_id": index + 1}
+                yield file_name, dumps(chunk, indent=2, ensure_ascii=False)
 
-            if not file_name.endswith(".json"):
-                text_chunks = splitter.split(doc_text)
-                for index, text in enumerate(text_chunks):
-                    chunk = {"title": file_name, "text_chunk": text, "chunk_id": index + 1}
-                    text_chunks[index] = dumps(chunk, indent=2, ensure_ascii=False)
+def file_label(file_name):
+    return file_name.replace('(', '').replace(')', '').replace(' ', '_')
 
-            text_to_chunks[file_name] = text_chunks
-    return text_to_chunks
+def find_file_labels(labels, file_names):
+    """
+    Return the labels among labels that stream_file_chunks would give chunks of the named files.
+    """
+    found = []
+    for file_name in map(file_label, file_names):
+        if file_name.endswith(".csv"):
+            pattern = re.compile(re.escape(file_name) + r"_\d+")
+            found.extend(label for label in labels if pattern.fullmatch(label))
+        elif file_name in labels:
+            found.append(file_name)
+    return found
+
+def open_binary(source):
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "rb")
+    return nullcontext(source)
+
+def iter_pdf_page_texts(source):
+    with open_binary(source) as f, pdfplumber.open(f) as pdf_reader:
+        for page in pdf_reader.pages:
+            yield page.extract_text() or ""
+            # release the parsed page objects before moving on
+            page.close()
+
+def iter_text_blocks(source, block_size=STREAM_BLOCK_SIZE):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open_binary(source) as f:
+        while block := f.read(block_size):
+            text = decoder.decode(block)
+            if text:
+                yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
 
 def process_json_text(text_json, period: PeriodOption):
     def convert_to_year_quarter(datetm):
@@ -84,7 +137,7 @@ def process_json_text(text_json, period: PeriodOption):
         return f"{datetm.year}-Q{quarter}"
 
     chunks = []
-    splitter = TextSplitter()
+    splitter = get_text_splitter()
     text_chunks = splitter.split(text_json["text"])
     for cx, chunk in enumerate(text_chunks):
         chunk_json = {"title": text_json["title"]}
@@ -123,40 +176,75 @@ def process_chunks(
     max_cluster_size,
     min_edge_weight,
     min_node_degree,
-    callbacks=[]
+    callbacks=[],
+    max_workers=None
 ):
-    period_concept_graphs = defaultdict(nx.Graph)
-    period_concept_graphs["ALL"] = nx.Graph()
-    node_period_counts = defaultdict(lambda: defaultdict(int))
-    edge_period_counts = defaultdict(lambda: defaultdict(int))
-    previous_chunk = {}
-    next_chunk = {}
-    concept_to_cids = defaultdict(list)
-    cid_to_concepts = defaultdict(list)
-    period_to_cids = defaultdict(list)
-    file_cids = []
-    cid_to_text = {}
-    text_to_cid = {}
-    chunk_id = 0
-    file_to_cids = defaultdict(list)
-    for file, chunks in file_to_chunks.items():
-        for chunk in chunks:
-            cid_to_text[chunk_id] = chunk
-            text_to_cid[chunk] = chunk_id
-            file_to_cids[file].append(chunk_id)
-            chunk_id += 1
-    for file, cids in file_to_cids.items():
-        for cx, cid in enumerate(cids):
-            file_cids.append((file, cid))
-            if cx > 0:
-                previous_chunk[cid] = cid-1
-            if cx < len(chunks) - 1:
-                next_chunk[cid] = cid+1
-    for cx, (file, cid) in enumerate(file_cids):
-        for cb in callbacks:
-            cb.on_batch_change(cx + 1, len(file_cids))
+    processed_chunks = ProcessedChunks(
+        cid_to_text={},
+        text_to_cid={},
+        period_concept_graphs=defaultdict(nx.Graph),
+        hierarchical_communities={},
+        community_to_label={},
+        concept_to_cids=defaultdict(list),
+        cid_to_concepts=defaultdict(list),
+        previous_cid={},
+        next_cid={},
+        period_to_cids=defaultdict(list),
+        node_period_counts=defaultdict(lambda: defaultdict(int)),
+        edge_period_counts=defaultdict(lambda: defaultdict(int)),
+    )
+    add_chunks(processed_chunks, file_to_chunks, callbacks=callbacks, max_workers=max_workers)
+    update_communities(processed_chunks, max_cluster_size, min_edge_weight, min_node_degree)
+    return processed_chunks
+
+def add_chunks(
+    processed_chunks,
+    file_to_chunks,
+    callbacks=[],
+    max_workers=None
+):
+    """
+    Append chunks to processed chunks with new chunk IDs, updating concept counts in place.
+
+    file_to_chunks is either a mapping of file labels to chunks or an iterable of (label, chunk)
+    pairs, such as stream_file_chunks, whose chunks are numbered and have their concepts extracted
+    as they arrive; the chunks of each label must be consecutive. Progress is only reported to
+    callbacks for a mapping, whose number of chunks is known.
+
+    Concept graphs and communities are left unchanged; see update_communities and update_community_index.
+    Returns the new chunk IDs.
+    """
+    total = None
+    if hasattr(file_to_chunks, "items"):
+        total = sum(len(chunks) for chunks in file_to_chunks.values())
+        file_to_chunks = (
+            (file, chunk) for file, chunks in file_to_chunks.items() for chunk in chunks
+        )
+    first_cid = max(processed_chunks.cid_to_text.keys(), default=-1) + 1
+    new_cids = []
+
+    def number_chunks():
+        previous_file = None
+        for file, chunk in file_to_chunks:
+            cid = first_cid + len(new_cids)
+            processed_chunks.cid_to_text[cid] = chunk
+            processed_chunks.text_to_cid[chunk] = cid
+            if len(new_cids) > 0 and file == previous_file:
+                processed_chunks.previous_cid[cid] = cid - 1
+                processed_chunks.next_cid[cid - 1] = cid
+            new_cids.append(cid)
+            previous_file = file
+            yield chunk
+
+    # noun phrase extraction dominates processing time, so callers may spread it across processes
+    cid_concepts = graph_builder.extract_concepts_many(number_chunks(), max_workers=max_workers)
+    for cx, concepts in enumerate(cid_concepts):
+        if total is not None:
+            for cb in callbacks:
+                cb.on_batch_change(cx + 1, total)
+        cid = new_cids[cx]
         period = None
-        chunk = cid_to_text[cid]
+        chunk = processed_chunks.cid_to_text[cid]
         try:
             chunk_json = loads(chunk)
             if 'period' in chunk_json:
@@ -165,18 +253,37 @@ def process_chunks(
             print(e)
             pass
         periods = ['ALL']
-        period_to_cids["ALL"].append(cid)
+        processed_chunks.period_to_cids["ALL"].append(cid)
         if period is not None:
             periods.append(period)
-            period_to_cids[period].append(cid)
+            processed_chunks.period_to_cids[period].append(cid)
         graph_builder.update_concept_graph_edges(
-            node_period_counts, edge_period_counts, periods, chunk, cid, concept_to_cids, cid_to_concepts
+            processed_chunks.node_period_counts,
+            processed_chunks.edge_period_counts,
+            periods,
+            chunk,
+            cid,
+            processed_chunks.concept_to_cids,
+            processed_chunks.cid_to_concepts,
+            concepts
         )
-        
-    for node, period_counts in node_period_counts.items():
+    return new_cids
+
+def update_communities(
+    processed_chunks,
+    max_cluster_size,
+    min_edge_weight,
+    min_node_degree
+):
+    """
+    Rebuild the concept graphs from the concept counts and detect their communities again.
+    """
+    period_concept_graphs = defaultdict(nx.Graph)
+    period_concept_graphs["ALL"] = nx.Graph()
+    for node, period_counts in processed_chunks.node_period_counts.items():
         for period, count in period_counts.items():
             period_concept_graphs[period].add_node(node, count=count)
-    for edge, period_counts in edge_period_counts.items():
+    for edge, period_counts in processed_chunks.edge_period_counts.items():
         for period, count in period_counts.items():
             period_concept_graphs[period].add_edge(edge[0], edge[1], weight=count)
 
@@ -192,17 +299,22 @@ def process_chunks(
             min_edge_weight=min_edge_weight,
             min_node_degree=min_node_degree,
         )
-    return ProcessedChunks(
-        cid_to_text=cid_to_text,
-        text_to_cid=text_to_cid,
-        period_concept_graphs=period_concept_graphs,
-        hierarchical_communities=hierarchical_communities,
-        community_to_label=community_to_label,
-        concept_to_cids=concept_to_cids,
-        cid_to_concepts=cid_to_concepts,
-        previous_cid=previous_chunk,
-        next_cid=next_chunk,
-        period_to_cids=period_to_cids,
-        node_period_counts=node_period_counts,
-        edge_period_counts=edge_period_counts,
-    )
+    processed_chunks.period_concept_graphs = period_concept_graphs
+    processed_chunks.hierarchical_communities = hierarchical_communities
+    processed_chunks.community_to_label = community_to_label
+    update_community_index(processed_chunks)
+
+def update_community_index(processed_chunks):
+    """
+    Rebuild the chunk to community index for the current chunks, keeping the existing communities.
+
+    Chunks only mentioning concepts outside the communities are not indexed.
+    """
+    processed_chunks.community_index = None
+    if len(processed_chunks.period_concept_graphs['ALL'].nodes()) > 0:
+        processed_chunks.community_index = graph_builder.build_community_index(
+            processed_chunks.hierarchical_communities or [],
+            processed_chunks.community_to_label,
+            processed_chunks.cid_to_concepts,
+            max(processed_chunks.cid_to_text.keys(), default=-1) + 1
+        )
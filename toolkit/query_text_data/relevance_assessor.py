@@ -3,13 +3,12 @@
 
 import asyncio
 from json import loads
-from collections import defaultdict
 import numpy as np
-import scipy.spatial.distance
-import tiktoken
 import toolkit.AI.utils as utils
+import toolkit.query_text_data.graph_builder as graph_builder
 import toolkit.query_text_data.helper_functions as helper_functions
 import toolkit.query_text_data.prompts as prompts
+from toolkit.AI.tokenizers import get_encoder
 
 
 async def assess_relevance(
@@ -36,17 +35,24 @@ async def assess_relevance(
         cid_batch = batched_cids[mx]
         if len(test_history) + len(mapped_messages) + num_adjacent > relevance_test_budget:
             mapped_messages = mapped_messages[:relevance_test_budget - len(test_history)]
-        mapped_responses = await utils.map_generate_text(
+        history_start = len(test_history)
+        num_relevant = 0
+        # report each assessment as it arrives, then restore batch order for reproducibility
+        async for rx, response in utils.map_generate_text_as_completed(
             ai_configuration, mapped_messages, logit_bias=logit_bias, max_tokens=1
-        )
-        num_relevant = process_relevance_responses(
-            search_label,
-            cid_batch,
-            cid_to_text,
-            mapped_responses,
-            test_history,
-            progress_callback,
-            chunk_callback
+        ):
+            num_relevant += process_relevance_responses(
+                search_label,
+                [cid_batch[rx]],
+                cid_to_text,
+                [response],
+                test_history,
+                progress_callback,
+                chunk_callback
+            )
+        cid_to_position = {cid: position for position, cid in enumerate(cid_batch)}
+        test_history[history_start:] = sorted(
+            test_history[history_start:], key=lambda x: cid_to_position[x[1]]
         )
         is_relevant = num_relevant > 0
         if not is_relevant: # No relevant chunks found in this batch; terminate early
@@ -85,13 +91,15 @@ async def detect_relevant_chunks(
     chunk_search_config,
     chunk_progress_callback=None,
     chunk_callback=None,
+    chunk_matrix=None,
 ):
     test_history = []
-    all_units = sorted([(cid, vector) for cid, vector in (cid_to_vector.items())], key=lambda x: x[0])
-
+    if chunk_matrix is None:
+        chunk_matrix = helper_functions.build_chunk_matrix(cid_to_vector)
+    matrix_cids, normalized_vectors = chunk_matrix
 
-    yes_id = tiktoken.get_encoding('o200k_base').encode('Yes')[0]
-    no_id = tiktoken.get_encoding('o200k_base').encode('No')[0]
+    yes_id = get_encoder('o200k_base').encode('Yes')[0]
+    no_id = get_encoder('o200k_base').encode('No')[0]
     select_logit_bias = 5
     logit_bias = {yes_id: select_logit_bias, no_id: select_logit_bias}
 
@@ -109,75 +117,41 @@ async def detect_relevant_chunks(
         processed_chunks.next_cid,
         chunk_search_config.adjacent_test_steps
     )
-    cosine_distances = sorted(
-        [
-            (cid, scipy.spatial.distance.cosine(aq_embedding, vector))
-            for (cid, vector) in all_units if cid not in seen
-        ],
-        key=lambda x: x[1],
-        reverse=False,
+    ranked_cids = helper_functions.rank_chunks(
+        aq_embedding, matrix_cids, normalized_vectors
+    )
+    ranked_cids = ranked_cids[~np.isin(ranked_cids, seen)]
+    semantic_search_cids = ranked_cids.tolist()
+    cid_to_rank = helper_functions.build_rank_array(
+        ranked_cids, max(processed_chunks.cid_to_text.keys()) + 1
     )
-    semantic_search_cids = [x[0] for x in cosine_distances]
     print(f'Top semantic search cids: {semantic_search_cids[:100]}')
+    community_index = processed_chunks.community_index
+    if community_index is None:
+        community_index = graph_builder.build_community_index(
+            processed_chunks.hierarchical_communities,
+            processed_chunks.community_to_label,
+            processed_chunks.cid_to_concepts,
+            len(cid_to_rank)
+        )
+    community_to_parent = community_index.community_to_parent
     level_to_community_sequence = {}
-    max_level = max([hc.level for hc in processed_chunks.hierarchical_communities])
-    concept_to_level_to_community = defaultdict(dict)
-    level_to_community_to_candidate_cids = defaultdict(lambda: defaultdict(set))
-    level_to_community_to_cids = defaultdict(lambda: defaultdict(list))
-    level_to_cid_to_communities = defaultdict(lambda: defaultdict(set))
-    community_to_parent = {}
-    for hc in processed_chunks.hierarchical_communities:
-        concept_to_level_to_community[hc.node][hc.level] = processed_chunks.community_to_label[hc.cluster]
-        if hc.parent_cluster is not None:
-            community_to_parent[processed_chunks.community_to_label[hc.cluster]] = processed_chunks.community_to_label[hc.parent_cluster]
-    cid_to_level_to_communities = defaultdict(lambda: defaultdict(set))
-    for level in range(0, max_level+1):
-        for cid, concepts in processed_chunks.cid_to_concepts.items():
-            for concept in concepts:
-                if concept in concept_to_level_to_community.keys():
-                    if level in concept_to_level_to_community[concept].keys():
-                        community = concept_to_level_to_community[concept][level]
-                        cid_to_level_to_communities[cid][level].add(community)
-                        level_to_cid_to_communities[level][cid].add(community)
-                        level_to_community_to_candidate_cids[level][community].add(cid)
-                    else:
-                        # use the community from the previous level
-                        if level - 1 in concept_to_level_to_community[concept].keys():
-                            community = concept_to_level_to_community[concept][level - 1]
-                            cid_to_level_to_communities[cid][level].add(community)
-                            level_to_cid_to_communities[level][cid].add(community)
-                            level_to_community_to_candidate_cids[level][community].add(cid)
-
-        community_sequence = []
-        community_mean_rank = []
-        
-        for community, cids in level_to_community_to_candidate_cids[level].items():
-            mean_rank = np.mean(sorted([semantic_search_cids.index(c) for c in cids])[:chunk_search_config.community_ranking_chunks])
-            community_mean_rank.append((community, mean_rank))
-        community_sequence = [x[0] for x in sorted(community_mean_rank, key=lambda x: x[1])]
+    level_to_community_to_cids = {}
+    ranking_chunks = chunk_search_config.community_ranking_chunks
+    for level in range(0, community_index.max_level+1):
+        community_sequence = helper_functions.rank_communities(
+            community_index, level, cid_to_rank, ranking_chunks
+        )
         print(f'Level {level} community sequence: {community_sequence}')
         level_to_community_sequence[level] = community_sequence
-
-        for cid in semantic_search_cids:
-            chunk_communities = cid_to_level_to_communities[cid][level]
-            if len(chunk_communities) > 0:
-                assigned_community = sorted(chunk_communities, key=lambda x: community_sequence.index(x))[0]
-                if cid not in level_to_community_to_cids[level][assigned_community]:
-                    level_to_community_to_cids[level][assigned_community].append(cid)
-
-    for level, community_to_cids in level_to_community_to_cids.items():
-        for community, cids in community_to_cids.items():
-            cids.sort(key=lambda x: semantic_search_cids.index(x))
+        level_to_community_to_cids[level] = helper_functions.assign_cids_to_communities(
+            community_index, level, ranked_cids, community_sequence
+        )
 
     # Set level -1 as everything in the dataset
     level_to_community_sequence[-1] = ['1']
-    level_to_community_to_cids[-1]['1'] = semantic_search_cids
-    for concept, level_to_community in concept_to_level_to_community.items():
-        level_to_community[-1] = '1'
+    level_to_community_to_cids[-1] = {'1': semantic_search_cids}
 
-    for cid, level_to_community in cid_to_level_to_communities.items():
-        level_to_community[-1] = '1'
-    
     successive_irrelevant = 0
     eliminated_communities = set()
     current_level = -1
@@ -206,7 +180,7 @@ async def detect_relevant_chunks(
                 processed_chunks.next_cid,
                 chunk_search_config.adjacent_test_steps
             )
-            unseen_cids = [c for c in community_to_cids[community] if c not in seen][:chunk_search_config.community_relevance_tests]
+            unseen_cids = [c for c in community_to_cids.get(community, []) if c not in seen][:chunk_search_config.community_relevance_tests]
             if len(unseen_cids) > 0:
                 print(f'Assessing relevance for community {community} with chunks {unseen_cids}')
                 is_relevant = await assess_relevance(
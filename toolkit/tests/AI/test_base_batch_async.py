@@ -0,0 +1,75 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+
+from toolkit.AI.base_batch_async import BaseBatchAsync, ProgressTracker
+from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RecordingCallback(ProgressBatchCallback):
+    def __init__(self) -> None:
+        super().__init__()
+        self.changes = []
+
+    def on_batch_change(self, current: int, total: int, message: str = ""):
+        self.changes.append((current, total))
+
+
+class TestProgressTracker:
+    def test_rate_and_eta(self) -> None:
+        clock = Clock()
+        progress = ProgressTracker(10, clock=clock)
+        assert progress.rate is None
+        assert progress.eta is None
+        clock.now = 2
+        progress.advance(4)
+        assert progress.rate == 2
+        assert progress.eta == 3
+
+    async def test_reports_changes_until_done(self) -> None:
+        batch = BaseBatchAsync()
+        batch.start_progress(3)
+        callback = RecordingCallback()
+
+        async def work(delay):
+            await asyncio.sleep(delay)
+            batch.progress_callback()
+
+        tasks = [asyncio.create_task(work(delay)) for delay in (0, 0.2, 0.4)]
+        await batch.track_progress(tasks, [callback])
+        assert callback.changes[-1] == (3, 3)
+        assert [current for current, _ in callback.changes] == sorted(
+            current for current, _ in callback.changes
+        )
+        assert callback.rate is not None
+        assert callback.eta == 0
+
+    async def test_failed_tasks_end_tracking(self) -> None:
+        batch = BaseBatchAsync()
+        batch.start_progress(2)
+
+        async def fail():
+            raise ValueError
+
+        tasks = [asyncio.create_task(fail()) for _ in range(2)]
+        await asyncio.wait_for(batch.track_progress(tasks, [RecordingCallback()]), 1)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def test_counters_per_instance(self) -> None:
+        first = BaseBatchAsync()
+        second = BaseBatchAsync()
+        first.start_progress(5)
+        first.progress_callback(2)
+        assert first.completed_tasks == 2
+        assert second.completed_tasks == 0
+        first.start_progress(5)
+        assert first.completed_tasks == 0
@@ -0,0 +1,65 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+from contextlib import aclosing
+from types import SimpleNamespace
+
+import pytest
+
+from toolkit.AI.base_chat import BaseChat
+from toolkit.AI.openai_configuration import OpenAIConfiguration
+
+
+@pytest.fixture()
+def chat() -> BaseChat:
+    configuration = OpenAIConfiguration({"api_key": "key", "api_type": "OpenAI"})
+    result = BaseChat(configuration)
+    result.cancelled = []
+
+    async def create(messages, **kwargs):
+        delay = messages[0]["content"]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            result.cancelled.append(delay)
+            raise
+        message = SimpleNamespace(content=f"after {delay}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    result._async_client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    return result
+
+
+def _messages(*delays) -> list:
+    return [[{"role": "user", "content": delay}] for delay in delays]
+
+
+class TestGenerateTextsAsCompleted:
+    async def test_yields_in_completion_order(self, chat) -> None:
+        results = [
+            result
+            async for result in chat.generate_texts_as_completed(
+                _messages(0.03, 0.01, 0.02)
+            )
+        ]
+        assert results == [(1, "after 0.01"), (2, "after 0.02"), (0, "after 0.03")]
+
+    async def test_closing_cancels_outstanding(self, chat) -> None:
+        async with aclosing(
+            chat.generate_texts_as_completed(_messages(5, 0.01, 5))
+        ) as results:
+            async for index, _ in results:
+                break
+        assert index == 1
+        assert sorted(chat.cancelled) == [5, 5]
+
+    async def test_gather_matches(self, chat) -> None:
+        messages = _messages(0.02, 0.01)
+        gathered = await chat.generate_texts_async(messages)
+        streamed = dict(
+            [result async for result in chat.generate_texts_as_completed(messages)]
+        )
+        assert gathered == [streamed[0], streamed[1]]
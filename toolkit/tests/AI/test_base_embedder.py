@@ -0,0 +1,162 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import toolkit.helpers.decorators as decorators
+from toolkit.AI.base_embedder import BaseEmbedder, migrate_embedding_cache, schema
+from toolkit.AI.vector_store import VectorStore
+from toolkit.helpers.constants import VECTOR_STORE_MAX_RETRIES
+
+
+class FakeEmbedder(BaseEmbedder):
+    def __init__(self, db_path, fail_over=None, error=ValueError, **kwargs):
+        super().__init__("test_embeddings", str(db_path), **kwargs)
+        self.fail_over = fail_over
+        self.error = error
+        self.requests = []
+
+    def _generate_embedding(self, text: str) -> list[float]:
+        return [float(len(text)), 1.0]
+
+    async def _generate_embedding_async(self, text: str) -> list[float]:
+        return self._generate_embedding(text)
+
+    async def _generate_embeddings_async(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(list(texts))
+        if self.fail_over is not None and len(texts) > self.fail_over:
+            msg = "Request too large"
+            raise self.error(msg)
+        return [self._generate_embedding(text) for text in texts]
+
+
+def _items(count):
+    return [
+        {"hash": "", "text": "x" * (i + 1), "additional_details": {"id": i}}
+        for i in range(count)
+    ]
+
+
+class TestPackBatches:
+    def test_max_texts(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path, max_batch_texts=3)
+        batches = embedder.pack_batches(_items(7))
+        assert [len(batch) for batch in batches] == [3, 3, 1]
+
+    def test_max_tokens(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path, max_batch_tokens=1)
+        batches = embedder.pack_batches(_items(3))
+        assert [len(batch) for batch in batches] == [1, 1, 1]
+
+    def test_items_prepared(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path)
+        batch = embedder.pack_batches(_items(1))[0]
+        assert batch[0]["hash"] != ""
+        assert batch[0]["additional_details"] == '{"id": 0}'
+
+
+class TestEmbedBatchAsync:
+    async def test_single_request(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path)
+        batch = embedder.pack_batches(_items(4))[0]
+        result = await embedder.embed_batch_async(batch)
+        assert len(embedder.requests) == 1
+        assert [item["vector"] for item in result] == [
+            [1.0, 1.0],
+            [2.0, 1.0],
+            [3.0, 1.0],
+            [4.0, 1.0],
+        ]
+
+    async def test_split_on_failure(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path, fail_over=2)
+        batch = embedder.pack_batches(_items(8))[0]
+        result = await embedder.embed_batch_async(batch)
+        assert [item["text"] for item in result] == [item["text"] for item in batch]
+        assert all(item["vector"][0] == len(item["text"]) for item in result)
+
+    async def test_transient_failure_not_split(self, tmp_path, monkeypatch) -> None:
+        monkeypatch.setattr(decorators, "backoff_time", lambda *args: 0)
+        embedder = FakeEmbedder(tmp_path, fail_over=0, error=TimeoutError)
+        batch = embedder.pack_batches(_items(8))[0]
+        with pytest.raises(Exception, match="Problem in embedding generation"):
+            await embedder.embed_batch_async(batch)
+        assert len(embedder.requests) == VECTOR_STORE_MAX_RETRIES + 1
+        assert all(len(texts) == 8 for texts in embedder.requests)
+
+    async def test_single_failure_raises(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path, fail_over=0)
+        batch = embedder.pack_batches(_items(2))[0]
+        with pytest.raises(Exception, match="Problem in embedding generation"):
+            await embedder.embed_batch_async(batch)
+
+
+class TestEmbedStoreMany:
+    async def test_batched_matches_hashes(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path, max_batch_texts=2)
+        result = await embedder.embed_store_many(_items(5), cache_data=False)
+        assert len(embedder.requests) == 3
+        assert {item["text"]: item["vector"][0] for item in result} == {
+            "x" * (i + 1): float(i + 1) for i in range(5)
+        }
+
+    async def test_cached_texts_not_requested(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path)
+        await embedder.embed_store_many(_items(3))
+        embedder.requests = []
+        result = await embedder.embed_store_many(_items(4))
+        assert embedder.requests == [["xxxx"]]
+        assert len(result) == 4
+
+    async def test_aligned_matrix_in_input_order(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path, max_batch_texts=2)
+        await embedder.embed_store_many(_items(3)[1:])
+        items = list(reversed(_items(4))) + _items(1)
+        result = await embedder.embed_store_many(items, aligned=True)
+        assert result.dtype == np.float32
+        assert result[:, 0].tolist() == [4.0, 3.0, 2.0, 1.0, 1.0]
+        assert sum(embedder.requests[1:], []) == ["xxxx", "x", "x"]
+
+    async def test_aligned_empty(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path)
+        result = await embedder.embed_store_many([], aligned=True)
+        assert result.shape == (0, 0)
+
+
+class TestCacheFormat:
+    async def test_new_cache_fixed_size_float32(self, tmp_path) -> None:
+        embedder = FakeEmbedder(tmp_path)
+        await embedder.embed_store_many(_items(2))
+        vector_type = embedder.vector_store.table.schema.field("vector").type
+        assert vector_type == pa.list_(pa.float32(), 2)
+
+    async def test_legacy_cache_still_read(self, tmp_path) -> None:
+        legacy = VectorStore("test_embeddings", str(tmp_path), schema)
+        legacy.save([
+            {"hash": "", "text": "x", "vector": [9.0, 9.0], "additional_details": "{}"}
+        ])
+        embedder = FakeEmbedder(tmp_path)
+        result = await embedder.embed_store_many(_items(2))
+        assert len(embedder.requests) == 1
+        assert len(result) == 2
+        vector_type = embedder.vector_store.table.schema.field("vector").type
+        assert vector_type == pa.list_(pa.float64())
+
+    def test_migrate(self, tmp_path) -> None:
+        legacy = VectorStore("test_embeddings", str(tmp_path), schema)
+        legacy.save([
+            {"hash": "a", "text": "a", "vector": [1.0, 2.0], "additional_details": "{}"},
+            {"hash": "b", "text": "b", "vector": [3.0, 4.0], "additional_details": "{}"},
+            {"hash": "c", "text": "c", "vector": [5.0], "additional_details": "{}"},
+        ])
+        migrated = migrate_embedding_cache("test_embeddings", str(tmp_path))
+        assert migrated == 2
+
+        store = VectorStore("test_embeddings", str(tmp_path), index_column="hash")
+        assert store.table.schema.field("vector").type == pa.list_(pa.float32(), 2)
+        found, vectors = store.get_many(["b", "a", "c"])
+        assert found.tolist() == [True, True, False]
+        assert vectors.tolist() == [[3.0, 4.0], [1.0, 2.0]]
+        assert migrate_embedding_cache("test_embeddings", str(tmp_path)) == 0
@@ -0,0 +1,162 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import AsyncOpenAI
+
+from toolkit.AI import utils
+from toolkit.AI.batch_chat import BatchChat
+from toolkit.AI.client_registry import client_registry
+from toolkit.AI.openai_configuration import OpenAIConfiguration
+from toolkit.AI.rate_scheduler import scheduler_registry
+from toolkit.helpers.progress_batch_callback import ProgressBatchCallback
+
+
+def _completion(content: str) -> dict:
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+
+
+class BatchServer(ThreadingHTTPServer):
+    """Local stand-in for the files, batches and chat completions endpoints."""
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), BatchHandler)
+        self.files = {}
+        self.batches = {}
+        self.polls = 0
+        self.failing_ids = set()
+        self.realtime_requests = 0
+
+
+class BatchHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, body) -> None:
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", "text/plain" if isinstance(body, str) else "application/json"
+        )
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        if self.path == "/v1/files":
+            file_id = f"file-{len(server.files)}"
+            server.files[file_id] = "\n".join(
+                line for line in body.splitlines() if line.startswith('{"custom_id"')
+            )
+            self._send({"id": file_id, "object": "file", "bytes": len(body),
+                        "created_at": 0, "filename": "batch.jsonl", "purpose": "batch"})
+        elif self.path == "/v1/batches":
+            batch_id = f"batch-{len(server.batches)}"
+            server.batches[batch_id] = json.loads(body)["input_file_id"]
+            self._send({"id": batch_id, "status": "validating"})
+        elif self.path == "/v1/chat/completions":
+            server.realtime_requests += 1
+            content = json.loads(body)["messages"][-1]["content"]
+            self._send(_completion(f"realtime {content}"))
+
+    def do_GET(self) -> None:
+        server = self.server
+        if self.path.startswith("/v1/batches/"):
+            batch_id = self.path.removeprefix("/v1/batches/")
+            server.polls += 1
+            requests = server.files[server.batches[batch_id]].splitlines()
+            if server.polls == 1:
+                self._send({"id": batch_id, "status": "in_progress",
+                            "request_counts": {"total": len(requests), "completed": 1, "failed": 0}})
+                return
+            output = []
+            for line in requests:
+                request = json.loads(line)
+                if request["custom_id"] in server.failing_ids:
+                    response = {"status_code": 500, "body": {"error": "server error"}}
+                else:
+                    content = request["body"]["messages"][-1]["content"]
+                    response = {"status_code": 200, "body": _completion(f"batch {content}")}
+                output.append(json.dumps({"custom_id": request["custom_id"], "response": response}))
+            output_id = f"file-output-{batch_id}"
+            server.files[output_id] = "\n".join(reversed(output))
+            self._send({"id": batch_id, "status": "completed", "output_file_id": output_id,
+                        "request_counts": {"total": len(requests), "completed": len(requests), "failed": 0}})
+        elif self.path.endswith("/content"):
+            self._send(server.files[self.path.split("/")[3]])
+
+
+@pytest.fixture()
+def server():
+    result = BatchServer()
+    thread = threading.Thread(target=result.serve_forever, daemon=True)
+    thread.start()
+    yield result
+    result.shutdown()
+    result.server_close()
+
+
+@pytest.fixture()
+def chat(server, monkeypatch) -> BatchChat:
+    scheduler_registry.clear()
+    async_client = AsyncOpenAI(
+        api_key="key", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1"
+    )
+    monkeypatch.setattr(
+        client_registry, "get_async_client", lambda configuration: async_client
+    )
+    configuration = OpenAIConfiguration({"api_key": "key", "api_type": "OpenAI"})
+    return BatchChat(configuration, poll_interval=0)
+
+
+def _messages(*contents) -> list:
+    return [[{"role": "user", "content": content}] for content in contents]
+
+
+def test_build_batch_file(chat) -> None:
+    lines = chat.build_batch_file(_messages("a", "b"), offset=3, max_tokens=1).splitlines()
+    requests = [json.loads(line) for line in lines]
+    assert [request["custom_id"] for request in requests] == ["request-3", "request-4"]
+    assert requests[0]["url"] == "/v1/chat/completions"
+    assert requests[0]["body"]["max_tokens"] == 1
+    assert requests[1]["body"]["messages"] == [{"role": "user", "content": "b"}]
+
+
+async def test_results_in_request_order(chat, server) -> None:
+    callback = ProgressBatchCallback()
+    responses = await chat.generate_texts_async(_messages("a", "b", "c"), [callback])
+    assert responses == ["batch a", "batch b", "batch c"]
+    assert callback.current_batch == 3
+    assert server.polls == 2
+    assert server.realtime_requests == 0
+
+
+async def test_failed_requests_rerun_in_real_time(chat, server) -> None:
+    server.failing_ids.add("request-1")
+    responses = await chat.generate_texts_async(_messages("a", "b"))
+    assert responses == ["batch a", "realtime b"]
+    assert server.realtime_requests == 1
+
+
+async def test_split_into_batches(chat, server) -> None:
+    chat.max_requests = 2
+    responses = await chat.generate_texts_async(_messages("a", "b", "c"))
+    assert responses == ["batch a", "batch b", "batch c"]
+    assert len(server.batches) == 2
+
+
+async def test_batch_backend_opt_in(chat, server) -> None:
+    messages = _messages("a")
+    server.polls = 1  # complete on the first poll, skipping the default poll interval
+    assert await utils.map_generate_text(chat.configuration, messages) == ["realtime a"]
+    assert await utils.map_generate_text(
+        chat.configuration, messages, backend="batch"
+    ) == ["batch a"]
+    with pytest.raises(ValueError, match="Unknown chat backend"):
+        await utils.map_generate_text(chat.configuration, messages, backend="other")
@@ -0,0 +1,90 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+
+import pytest
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+import toolkit.AI.client_registry as client_registry_module
+from toolkit.AI.client import OpenAIClient
+from toolkit.AI.client_registry import ClientRegistry
+from toolkit.AI.openai_configuration import OpenAIConfiguration
+
+
+def _configuration(**config) -> OpenAIConfiguration:
+    return OpenAIConfiguration({"api_key": "key", "api_type": "OpenAI", **config})
+
+
+@pytest.fixture()
+def registry() -> ClientRegistry:
+    return ClientRegistry(max_connections=4, max_keepalive_connections=2)
+
+
+class TestClientRegistry:
+    def test_shared_per_configuration(self, registry) -> None:
+        client = registry.get_client(_configuration())
+        assert registry.get_client(_configuration()) is client
+        assert registry.get_client(_configuration(api_key="other")) is not client
+
+    def test_pool_limits(self, registry) -> None:
+        assert registry.limits.max_connections == 4
+        assert registry.limits.max_keepalive_connections == 2
+
+    def test_configure_drops_clients(self, registry) -> None:
+        client = registry.get_client(_configuration())
+        registry.configure(max_connections=8)
+        assert registry.limits.max_connections == 8
+        assert registry.get_client(_configuration()) is not client
+
+    def test_async_client_per_loop(self, registry) -> None:
+        async def get_clients():
+            return (
+                registry.get_async_client(_configuration()),
+                registry.get_async_client(_configuration()),
+            )
+
+        first, second = asyncio.run(get_clients())
+        assert first is second
+        other, _ = asyncio.run(get_clients())
+        assert other is not first
+
+    def test_azure_key_clients(self, registry) -> None:
+        configuration = _configuration(
+            api_type="Azure OpenAI",
+            api_base="https://example.openai.azure.com",
+            az_auth_type="Azure Key",
+        )
+        assert isinstance(registry.get_client(configuration), AzureOpenAI)
+
+        async def get_async_client():
+            return registry.get_async_client(configuration)
+
+        assert isinstance(asyncio.run(get_async_client()), AsyncAzureOpenAI)
+
+    def test_shared_token_provider(self, registry, monkeypatch) -> None:
+        credentials = []
+        monkeypatch.setattr(
+            client_registry_module,
+            "DefaultAzureCredential",
+            lambda: credentials.append(1),
+        )
+        monkeypatch.setattr(
+            client_registry_module,
+            "get_bearer_token_provider",
+            lambda credential, scope: lambda: "token",
+        )
+        for endpoint in ["https://a.openai.azure.com", "https://b.openai.azure.com"]:
+            registry.get_client(
+                _configuration(
+                    api_type="Azure OpenAI",
+                    api_base=endpoint,
+                    az_auth_type="Managed Identity",
+                )
+            )
+        assert len(credentials) == 1
+
+
+def test_openai_clients_share_connections() -> None:
+    configuration = _configuration(api_key="shared")
+    assert OpenAIClient(configuration)._client is OpenAIClient(configuration)._client
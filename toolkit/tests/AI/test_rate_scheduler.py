@@ -0,0 +1,191 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from toolkit.AI.base_chat import BaseChat
+from toolkit.AI.openai_configuration import OpenAIConfiguration
+from toolkit.AI.defaults import DEFAULT_RATE_LIMIT_RETRIES
+from toolkit.AI.rate_scheduler import (
+    RateLimitScheduler,
+    get_retry_after,
+    scheduler_registry,
+)
+from toolkit.helpers import decorators
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _rate_limit_error(headers: dict) -> openai.RateLimitError:
+    response = httpx.Response(
+        429, headers=headers, request=httpx.Request("POST", "https://example.com")
+    )
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class TestGetRetryAfter:
+    def test_milliseconds(self) -> None:
+        assert get_retry_after(_rate_limit_error({"retry-after-ms": "1500"})) == 1.5
+
+    def test_seconds(self) -> None:
+        assert get_retry_after(_rate_limit_error({"retry-after": "3"})) == 3
+
+    def test_missing(self) -> None:
+        assert get_retry_after(_rate_limit_error({})) is None
+        assert get_retry_after(ValueError()) is None
+
+
+class TestRateLimitScheduler:
+    @pytest.fixture()
+    def clock(self) -> Clock:
+        return Clock()
+
+    async def test_requests_per_minute(self, clock) -> None:
+        scheduler = RateLimitScheduler(requests_per_minute=2, clock=clock)
+        for _ in range(2):
+            scheduler.release(await scheduler.acquire())
+        assert scheduler._wait_time(0) == 60
+        clock.now += 60
+        assert scheduler._wait_time(0) == 0
+
+    async def test_tokens_corrected_by_usage(self, clock) -> None:
+        scheduler = RateLimitScheduler(tokens_per_minute=100, clock=clock)
+        record = await scheduler.acquire(80)
+        assert scheduler._wait_time(30) > 0
+        scheduler.release(record, used_tokens=20)
+        assert scheduler._wait_time(30) == 0
+
+    async def test_concurrency_limit(self, clock) -> None:
+        scheduler = RateLimitScheduler(max_concurrency=1, clock=clock)
+        record = await scheduler.acquire()
+        assert scheduler._wait_time(0) == float("inf")
+        scheduler.release(record)
+        assert scheduler._wait_time(0) == 0
+
+    async def test_throttle_pauses_and_decreases_once_per_burst(self, clock) -> None:
+        scheduler = RateLimitScheduler(max_concurrency=8, clock=clock)
+        records = [await scheduler.acquire() for _ in range(3)]
+        clock.now += 1
+        for record in records:
+            scheduler.throttle(record, retry_after=2)
+        assert scheduler.concurrency_limit == 4
+        assert scheduler._wait_time(0) == 2
+        clock.now += 2
+        scheduler.release(await scheduler.acquire())
+        assert scheduler.concurrency == 4.25
+
+    async def test_release_wakes_waiter(self, clock) -> None:
+        scheduler = RateLimitScheduler(max_concurrency=1, clock=clock)
+        record = await scheduler.acquire()
+        waiting = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        scheduler.release(record)
+        scheduler.release(await asyncio.wait_for(waiting, timeout=1))
+        assert scheduler.in_flight == 0
+        assert not scheduler._waiters
+
+
+class TestSchedulerRegistry:
+    @pytest.fixture(autouse=True)
+    def clear(self):
+        scheduler_registry.clear()
+        yield
+        scheduler_registry.clear()
+
+    def test_shared_per_deployment(self) -> None:
+        configuration = {"api_key": "key", "api_type": "OpenAI", "model": "gpt-4o"}
+        first = BaseChat(OpenAIConfiguration(configuration), concurrent_coroutines=4)
+        second = BaseChat(OpenAIConfiguration(configuration), concurrent_coroutines=4)
+        other = BaseChat(
+            OpenAIConfiguration({**configuration, "model": "gpt-4o-mini"}),
+            concurrent_coroutines=4,
+        )
+        assert first.scheduler is second.scheduler
+        assert first.scheduler is not other.scheduler
+
+    def test_latest_limits_apply(self) -> None:
+        configuration = OpenAIConfiguration({"api_key": "key", "api_type": "OpenAI"})
+        scheduler = scheduler_registry.get_scheduler(
+            configuration, requests_per_minute=100, max_concurrency=8
+        )
+        assert scheduler_registry.get_scheduler(
+            configuration, requests_per_minute=50, max_concurrency=2
+        ) is scheduler
+        assert scheduler.requests_per_minute == 50
+        assert scheduler.concurrency_limit == 2
+
+
+class TestBaseChatScheduling:
+    @pytest.fixture()
+    def chat(self) -> BaseChat:
+        scheduler_registry.clear()
+        configuration = OpenAIConfiguration(
+            {"api_key": "key", "api_type": "OpenAI", "tokens_per_minute": 10000}
+        )
+        result = BaseChat(configuration, concurrent_coroutines=4)
+        result.responses = [_rate_limit_error({"retry-after-ms": "10"})]
+
+        async def create(**kwargs):
+            if result.responses:
+                raise result.responses.pop()
+            message = SimpleNamespace(content="done")
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=message)],
+                usage=SimpleNamespace(total_tokens=7),
+            )
+
+        result._async_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+        return result
+
+    async def test_retries_after_throttling(self, chat) -> None:
+        messages = [{"role": "user", "content": "hi"}]
+        assert await chat.generate_text_async(messages, None) == "done"
+        assert chat.scheduler.throttled_requests == 1
+        assert chat.scheduler.concurrency_limit == 2
+        assert chat.scheduler._window_tokens == 7 + chat.estimate_tokens(messages, {})
+
+    async def test_one_retry_layer(self, chat, monkeypatch) -> None:
+        monkeypatch.setattr(decorators, "backoff_time", lambda *args: 0)
+        chat.scheduler.backoff = 0
+        chat.scheduler.tokens_per_minute = None
+        chat.responses = [
+            _rate_limit_error({"retry-after-ms": "0"})
+            for _ in range(DEFAULT_RATE_LIMIT_RETRIES + 5)
+        ]
+        with pytest.raises(Exception, match="Problem in OpenAI response"):
+            await chat.generate_text_async([{"role": "user", "content": "hi"}], None)
+        assert chat.scheduler.throttled_requests == DEFAULT_RATE_LIMIT_RETRIES + 1
+        assert chat.scheduler.in_flight == 0
+
+    async def test_cancel_frees_slot(self, chat) -> None:
+        chat.responses = []
+        started = asyncio.Event()
+
+        async def create(**kwargs):
+            started.set()
+            await asyncio.sleep(10)
+
+        chat._async_client.chat.completions.create = create
+        task = asyncio.create_task(
+            chat.generate_text_async([{"role": "user", "content": "hi"}], None)
+        )
+        await started.wait()
+        assert chat.scheduler.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert chat.scheduler.in_flight == 0
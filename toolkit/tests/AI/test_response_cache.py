@@ -0,0 +1,97 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+from types import SimpleNamespace
+
+import pytest
+
+import toolkit.AI.client as client_module
+from toolkit.AI.client import OpenAIClient
+from toolkit.AI.openai_configuration import OpenAIConfiguration
+from toolkit.AI.response_cache import ResponseCache, request_key
+
+
+@pytest.fixture()
+def cache(tmp_path) -> ResponseCache:
+    return ResponseCache(str(tmp_path / "responses.sqlite"), max_bytes=10)
+
+
+class TestRequestKey:
+    def test_argument_order(self) -> None:
+        assert request_key(model="m", messages=[{"role": "user"}]) == request_key(
+            messages=[{"role": "user"}], model="m"
+        )
+
+    def test_differs(self) -> None:
+        assert request_key(model="m", temperature=0) != request_key(
+            model="m", temperature=1
+        )
+
+
+class TestResponseCache:
+    def test_get_set(self, cache) -> None:
+        assert cache.get("a") is None
+        cache.set("a", "yes")
+        assert cache.get("a") == "yes"
+
+    def test_persistent(self, cache) -> None:
+        cache.set("a", "yes")
+        reopened = ResponseCache(cache.path, max_bytes=10)
+        assert reopened.get("a") == "yes"
+
+    def test_evicts_least_recently_used(self, cache) -> None:
+        cache.set("a", "1234")
+        cache.set("b", "1234")
+        cache.get("a")
+        cache.set("c", "1234")
+        assert cache.get("b") is None
+        assert cache.get("a") == "1234"
+        assert cache.get("c") == "1234"
+
+    def test_too_large(self, cache) -> None:
+        cache.set("a", "x" * 11)
+        assert len(cache) == 0
+
+
+class TestOpenAIClientCache:
+    @pytest.fixture()
+    def client(self, cache, monkeypatch) -> OpenAIClient:
+        monkeypatch.setattr(client_module, "get_response_cache", lambda: cache)
+        configuration = OpenAIConfiguration(
+            {"api_key": "key", "api_type": "OpenAI", "response_cache": True}
+        )
+        result = OpenAIClient(configuration)
+        result.requests = []
+
+        async def create(**kwargs):
+            result.requests.append(kwargs)
+            message = SimpleNamespace(content=f"response {len(result.requests)}")
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+        result._async_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+        return result
+
+    async def test_deterministic_cached(self, client) -> None:
+        messages = [{"role": "user", "content": "hi"}]
+        first = await client.generate_chat_async(messages, temperature=0)
+        second = await client.generate_chat_async(messages, temperature=0)
+        assert first == second == "response 1"
+        assert len(client.requests) == 1
+
+    async def test_other_requests_not_shared(self, client) -> None:
+        messages = [{"role": "user", "content": "hi"}]
+        await client.generate_chat_async(messages, temperature=0)
+        await client.generate_chat_async(messages, temperature=0, max_tokens=1)
+        assert len(client.requests) == 2
+
+    async def test_sampled_not_cached(self, client) -> None:
+        messages = [{"role": "user", "content": "hi"}]
+        await client.generate_chat_async(messages, temperature=0.5)
+        await client.generate_chat_async(messages, temperature=0.5)
+        assert len(client.requests) == 2
+
+    def test_opt_in(self) -> None:
+        configuration = OpenAIConfiguration({"api_key": "key", "api_type": "OpenAI"})
+        assert OpenAIClient(configuration).response_cache is None
@@ -2,6 +2,7 @@
 # Licensed under the MIT license. See LICENSE file in the project.
 #
 import pytest
+import semchunk
 
 from toolkit.AI.text_splitter import TextSplitter
 
@@ -46,3 +47,66 @@ def test_text_splitter_empty_input(text_splitter):
     text = ""
     chunks = text_splitter.split(text)
     assert chunks == []
+
+
+class WordSplitter(TextSplitter):
+    def __init__(self, chunk_size: int = 3):
+        self.chunk_size = chunk_size
+
+    def split(self, text: str):
+        words = text.split()
+        return [
+            " ".join(words[i : i + self.chunk_size])
+            for i in range(0, len(words), self.chunk_size)
+        ]
+
+
+class WordCountSplitter(TextSplitter):
+    """The semantic splitter, counting words instead of model tokens."""
+
+    def __init__(self, chunk_size: int = 12):
+        self.chunk_size = chunk_size
+        self._chunk = semchunk.chunkerify(lambda text: len(text.split()), chunk_size)
+
+
+class TestSplitStream:
+    def test_matches_split_of_joined_text(self) -> None:
+        splitter = WordSplitter()
+        texts = ["one two thr", "ee four five six se", "ven ", "eight nine ten"]
+        expected = splitter.split("".join(texts))
+        assert list(splitter.split_stream(texts)) == expected
+
+    def test_separator(self) -> None:
+        splitter = WordSplitter()
+        pages = ["one two", "three four five", "", "six"]
+        expected = splitter.split(" ".join(pages))
+        assert list(splitter.split_stream(pages, " ")) == expected
+
+    def test_lazy(self) -> None:
+        def texts():
+            yield "one two three four five six seven"
+            raise AssertionError("read too far")
+
+        stream = WordSplitter().split_stream(texts())
+        assert next(stream) == "one two three"
+
+    def test_empty(self) -> None:
+        assert list(WordSplitter().split_stream(["", "  "])) == []
+
+    def test_single_text_matches_split(self, text_example) -> None:
+        splitter = WordCountSplitter()
+        assert list(splitter.split_stream([text_example])) == splitter.split(text_example)
+
+    def test_blocks_keep_the_text_of_split(self, text_example) -> None:
+        splitter = WordCountSplitter()
+        expected = splitter.split(text_example)
+        for block_size in [50, 200, 1000]:
+            blocks = [
+                text_example[start : start + block_size]
+                for start in range(0, len(text_example), block_size)
+            ]
+            chunks = list(splitter.split_stream(blocks))
+            assert " ".join(chunks).split() == " ".join(expected).split()
+            assert all(len(chunk.split()) <= splitter.chunk_size for chunk in chunks)
+            # only chunks near block boundaries may be cut differently
+            assert len(set(chunks) & set(expected)) >= len(expected) // 2
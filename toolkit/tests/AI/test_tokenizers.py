@@ -0,0 +1,38 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import pytest
+
+import toolkit.AI.tokenizers as tokenizers
+from toolkit.AI.defaults import DEFAULT_ENCODING
+
+
+@pytest.fixture()
+def loads(monkeypatch):
+    calls = []
+
+    def get_encoding(name):
+        calls.append(("encoding", name))
+        return object()
+
+    def encoding_for_model(name):
+        calls.append(("model", name))
+        return object()
+
+    monkeypatch.setattr(tokenizers.tiktoken, "get_encoding", get_encoding)
+    monkeypatch.setattr(tokenizers.tiktoken, "encoding_for_model", encoding_for_model)
+    tokenizers.get_encoder.cache_clear()
+    yield calls
+    tokenizers.get_encoder.cache_clear()
+
+
+def test_encoder_memoized(loads):
+    first = tokenizers.get_encoder()
+    assert tokenizers.get_encoder() is first
+    assert loads == [("encoding", DEFAULT_ENCODING)]
+
+
+def test_model_encoder(loads):
+    model_encoder = tokenizers.get_encoder(None, "gpt-4o")
+    assert tokenizers.get_encoder(None, "gpt-4o") is model_encoder
+    assert loads == [("model", "gpt-4o")]
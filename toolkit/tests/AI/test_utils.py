@@ -3,7 +3,9 @@ import pytest
 
 from toolkit.AI.utils import (
     get_token_count,
+    get_token_counts,
     hash_text,
+    hash_texts,
     prepare_messages,
     prepare_validation,
     try_parse_json_object,
@@ -32,6 +34,12 @@ def test_get_token_count_with_encoding():
     assert result == expected
 
 
+def test_get_token_counts():
+    texts = ["example text", "", "example text"]
+    result = get_token_counts(texts)
+    assert result == [get_token_count(text) for text in texts]
+
+
 def test_hash_text():
     text = "example test \n\n example test two"
     hash_returned = hash_text(text)
@@ -41,6 +49,11 @@ def test_hash_text():
     )
 
 
+def test_hash_texts():
+    texts = [f"text\n{i}" for i in range(25)]
+    assert hash_texts(texts, chunk_size=4) == [hash_text(text) for text in texts]
+
+
 def test_try_parse_json_object_ok():
     obj_test = '{"key": "value"}'
     result = try_parse_json_object(obj_test)
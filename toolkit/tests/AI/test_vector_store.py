@@ -0,0 +1,88 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from toolkit.AI.base_embedder import schema
+from toolkit.AI.vector_store import VectorStore, to_vector_array, to_vector_matrix
+
+
+def _rows(start, end):
+    return [
+        {
+            "hash": f"h{i}",
+            "text": f"text {i}",
+            "vector": [float(i), float(i) + 0.5],
+            "additional_details": "{}",
+        }
+        for i in range(start, end)
+    ]
+
+
+@pytest.fixture()
+def store(tmp_path):
+    store = VectorStore("embeddings", str(tmp_path), schema, index_column="hash")
+    store.save(_rows(0, 20))
+    return store
+
+
+def test_index_created_on_first_save(store) -> None:
+    assert store.indexed
+
+
+def test_index_persists(store, tmp_path) -> None:
+    reopened = VectorStore("embeddings", str(tmp_path), schema, index_column="hash")
+    assert reopened.indexed
+
+
+def test_get_many_order(store) -> None:
+    found, vectors = store.get_many(["h3", "missing", "h1"])
+    assert found.tolist() == [True, False, True]
+    assert vectors.shape == (2, 2)
+    assert vectors.dtype == np.float32
+    assert vectors.flags["C_CONTIGUOUS"]
+    np.testing.assert_array_equal(vectors[:, 0], [3.0, 1.0])
+
+
+def test_get_many_unindexed_rows(store) -> None:
+    store.save(_rows(20, 25))
+    found, vectors = store.get_many(["h22"])
+    assert found.tolist() == [True]
+    np.testing.assert_array_equal(vectors, [[22.0, 22.5]])
+
+
+def test_get_many_none_found(store) -> None:
+    found, vectors = store.get_many(["missing"])
+    assert found.tolist() == [False]
+    assert len(vectors) == 0
+
+
+def test_get_many_other_index_column(tmp_path) -> None:
+    store = VectorStore("embeddings", str(tmp_path), schema, index_column="text")
+    store.save(_rows(0, 5))
+    found, vectors = store.get_many(["text 4", "h1", "text 2"])
+    assert found.tolist() == [True, False, True]
+    np.testing.assert_array_equal(vectors[:, 0], [4.0, 2.0])
+
+
+def test_search_by_column_duckdb_fallback(store) -> None:
+    indexed = store.search_by_column(["h2", "h4", "h2"], "hash")
+    store.indexed = False
+    scanned = store.search_by_column(["h2", "h4", "h2"], "hash")
+    assert sorted(indexed["hash"]) == sorted(scanned["hash"]) == ["h2", "h4"]
+
+
+def test_table_created_lazily_without_schema(tmp_path) -> None:
+    store = VectorStore("embeddings", str(tmp_path), index_column="hash")
+    assert store.table is None
+
+
+def test_vector_matrix_zero_copy() -> None:
+    matrix = np.arange(6, dtype=np.float32).reshape(3, 2)
+    array = to_vector_array(matrix)
+    assert array.type == pa.list_(pa.float32(), 2)
+    result = to_vector_matrix(pa.chunked_array([array]))
+    np.testing.assert_array_equal(result, matrix)
+    assert np.shares_memory(result, array.flatten().to_numpy())
@@ -0,0 +1,131 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import toolkit.helpers.decorators as decorators
+from toolkit.helpers.decorators import is_retryable, retry_with_backoff, retry_metrics
+
+
+def _status_error(status_code: int) -> openai.APIStatusError:
+    response = httpx.Response(
+        status_code, request=httpx.Request("POST", "https://example.com")
+    )
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch) -> None:
+    monkeypatch.setattr(decorators, "backoff_time", lambda *args: 0)
+    retry_metrics.reset()
+
+
+class TestIsRetryable:
+    @pytest.mark.parametrize("status_code", [408, 429, 500, 503])
+    def test_transient_status(self, status_code) -> None:
+        assert is_retryable(_status_error(status_code))
+
+    def test_client_error(self) -> None:
+        assert not is_retryable(_status_error(400))
+        assert not is_retryable(ValueError("bad input"))
+
+    def test_timeout(self) -> None:
+        assert is_retryable(asyncio.TimeoutError())
+
+    def test_wrapped(self) -> None:
+        try:
+            try:
+                raise _status_error(429)
+            except Exception as e:
+                msg = f"Problem in OpenAI response. {e}"
+                raise Exception(msg) from e
+        except Exception as e:
+            assert is_retryable(e)
+
+
+class TestRetryWithBackoff:
+    async def test_retries_awaited_failures(self) -> None:
+        calls = []
+
+        @retry_with_backoff(retries=3)
+        async def request():
+            calls.append(1)
+            if len(calls) < 3:
+                raise _status_error(503)
+            return "ok"
+
+        assert await request() == "ok"
+        assert len(calls) == 3
+        assert retry_metrics.snapshot()["retries"] == {request.__qualname__: 2}
+
+    async def test_does_not_retry_client_errors(self) -> None:
+        calls = []
+
+        @retry_with_backoff(retries=3)
+        async def request():
+            calls.append(1)
+            raise _status_error(400)
+
+        with pytest.raises(openai.APIStatusError):
+            await request()
+        assert len(calls) == 1
+        assert retry_metrics.snapshot()["failures"] == {request.__qualname__: 1}
+
+    async def test_timeout_per_attempt(self) -> None:
+        calls = []
+
+        @retry_with_backoff(retries=1, timeout=0.01)
+        async def request():
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+            return "ok"
+
+        assert await request() == "ok"
+        assert retry_metrics.snapshot()["timeouts"] == {request.__qualname__: 1}
+
+    async def test_does_not_block_other_requests(self, monkeypatch) -> None:
+        monkeypatch.setattr(decorators, "backoff_time", lambda *args: 0.05)
+        order = []
+
+        @retry_with_backoff(retries=1)
+        async def slow():
+            if "slow" not in order:
+                order.append("slow")
+                raise _status_error(429)
+            order.append("slow retried")
+
+        async def fast():
+            await asyncio.sleep(0.01)
+            order.append("fast")
+
+        await asyncio.gather(slow(), fast())
+        assert order == ["slow", "fast", "slow retried"]
+
+    async def test_deadline(self, monkeypatch) -> None:
+        monkeypatch.setattr(decorators, "backoff_time", lambda *args: 10)
+
+        @retry_with_backoff(retries=3, deadline=1)
+        async def request():
+            raise _status_error(500)
+
+        with pytest.raises(openai.APIStatusError):
+            await request()
+        assert retry_metrics.snapshot()["retries"] == {}
+
+    def test_sync(self) -> None:
+        calls = []
+
+        @retry_with_backoff(retries=2)
+        def request():
+            calls.append(1)
+            if len(calls) < 2:
+                raise TimeoutError
+            return "ok"
+
+        assert request() == "ok"
+        assert len(calls) == 2
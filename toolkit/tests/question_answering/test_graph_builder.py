@@ -0,0 +1,79 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+from collections import defaultdict
+
+import toolkit.query_text_data.graph_builder as graph_builder
+from toolkit.helpers.constants import CONCEPT_EXTRACTION_TASKS_PER_WORKER
+from toolkit.query_text_data.graph_builder import (
+    extract_concepts_many,
+    update_concept_graph_edges,
+)
+
+
+def word_concepts(chunk) -> list[str]:
+    return sorted(set(chunk.split()))
+
+
+class TestExtractConceptsMany:
+    def test_parallel_matches_serial(self) -> None:
+        chunks = [f"w{i % 7} w{i % 5} w{i % 3}" for i in range(50)]
+        serial = list(extract_concepts_many(chunks, max_workers=1, extractor=word_concepts))
+        parallel = list(
+            extract_concepts_many(
+                chunks, max_workers=2, min_parallel_chunks=0, extractor=word_concepts
+            )
+        )
+        assert parallel == serial
+        assert serial == [word_concepts(chunk) for chunk in chunks]
+
+    def test_empty(self) -> None:
+        assert list(extract_concepts_many([], max_workers=2, min_parallel_chunks=0)) == []
+
+    def test_parallel_reads_stream_as_needed(self) -> None:
+        read = []
+
+        def chunks():
+            for i in range(40):
+                read.append(i)
+                yield f"w{i}"
+
+        results = extract_concepts_many(
+            chunks(), max_workers=2, min_parallel_chunks=0, extractor=str.upper
+        )
+        assert next(results) == "W0"
+        assert len(read) <= 2 * CONCEPT_EXTRACTION_TASKS_PER_WORKER + 1
+        assert list(results) == [f"W{i}" for i in range(1, 40)]
+
+    def test_serial_by_default(self, monkeypatch) -> None:
+        def no_pool(*args, **kwargs):
+            raise AssertionError("started a process pool")
+
+        monkeypatch.setattr(graph_builder, "ProcessPoolExecutor", no_pool)
+        chunks = [f"w{i % 7} w{i % 5}" for i in range(500)]
+        concepts = list(
+            extract_concepts_many(chunks, min_parallel_chunks=0, extractor=word_concepts)
+        )
+        assert concepts == [word_concepts(chunk) for chunk in chunks]
+
+
+class TestUpdateConceptGraphEdges:
+    def test_given_concepts(self) -> None:
+        node_counts = defaultdict(lambda: defaultdict(int))
+        edge_counts = defaultdict(lambda: defaultdict(int))
+        concept_to_cids = defaultdict(list)
+        cid_to_concepts = defaultdict(list)
+        update_concept_graph_edges(
+            node_counts,
+            edge_counts,
+            ["ALL", "2024"],
+            "unused chunk",
+            3,
+            concept_to_cids,
+            cid_to_concepts,
+            ["a", "b", "c"],
+        )
+        assert cid_to_concepts[3] == ["a", "b", "c"]
+        assert concept_to_cids == {"a": [3], "b": [3], "c": [3]}
+        assert node_counts["b"] == {"ALL": 1, "2024": 1}
+        assert set(edge_counts.keys()) == {("a", "b"), ("a", "c"), ("b", "c")}
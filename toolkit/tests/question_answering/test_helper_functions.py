@@ -0,0 +1,138 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+from collections import namedtuple
+
+import numpy as np
+import pytest
+import scipy.spatial.distance
+
+from toolkit.query_text_data.graph_builder import build_community_index
+from toolkit.query_text_data.helper_functions import (
+    assign_cids_to_communities,
+    build_chunk_matrix,
+    build_rank_array,
+    rank_chunks,
+    rank_communities,
+)
+
+HierarchicalCluster = namedtuple(
+    "HierarchicalCluster", ["node", "cluster", "parent_cluster", "level"]
+)
+
+
+@pytest.fixture()
+def cid_to_vector() -> dict[int, list[float]]:
+    rng = np.random.default_rng(7)
+    return {cid: rng.random(8).tolist() for cid in [3, 0, 2, 1, 4, 5]}
+
+
+class TestBuildChunkMatrix:
+    def test_cid_order(self, cid_to_vector) -> None:
+        cids, matrix = build_chunk_matrix(cid_to_vector)
+        assert cids.tolist() == [0, 1, 2, 3, 4, 5]
+        assert matrix.dtype == np.float32
+
+    def test_unit_rows(self, cid_to_vector) -> None:
+        _, matrix = build_chunk_matrix(cid_to_vector)
+        np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1, rtol=1e-6)
+
+    def test_zero_vector(self) -> None:
+        _, matrix = build_chunk_matrix({0: [0.0, 0.0], 1: [3.0, 4.0]})
+        np.testing.assert_allclose(matrix, [[0, 0], [0.6, 0.8]])
+
+    def test_empty(self) -> None:
+        cids, matrix = build_chunk_matrix({})
+        assert len(cids) == 0
+        assert len(matrix) == 0
+
+
+class TestRankChunks:
+    def test_matches_cosine_sort(self, cid_to_vector) -> None:
+        query = np.random.default_rng(1).random(8)
+        expected = [
+            cid
+            for cid, _ in sorted(
+                sorted(cid_to_vector.items()),
+                key=lambda x: scipy.spatial.distance.cosine(query, x[1]),
+            )
+        ]
+        cids, matrix = build_chunk_matrix(cid_to_vector)
+        assert rank_chunks(query, cids, matrix).tolist() == expected
+
+    def test_top_k(self, cid_to_vector) -> None:
+        query = np.random.default_rng(1).random(8)
+        cids, matrix = build_chunk_matrix(cid_to_vector)
+        ranked = rank_chunks(query, cids, matrix)
+        assert rank_chunks(query, cids, matrix, top_k=3).tolist() == ranked[:3].tolist()
+
+    def test_ties_keep_cid_order(self) -> None:
+        cids, matrix = build_chunk_matrix({2: [1.0, 0.0], 0: [2.0, 0.0], 1: [0.0, 1.0]})
+        assert rank_chunks([1.0, 0.0], cids, matrix).tolist() == [0, 2, 1]
+
+
+class TestBuildRankArray:
+    def test_ranks(self) -> None:
+        result = build_rank_array(np.array([2, 0, 1]), 4)
+        assert result.tolist() == [1, 2, 0, 3]
+
+
+@pytest.fixture()
+def community_index():
+    hierarchical_communities = [
+        HierarchicalCluster("a", 0, None, 0),
+        HierarchicalCluster("a", 2, 0, 1),
+        HierarchicalCluster("b", 0, None, 0),
+        HierarchicalCluster("b", 3, 0, 1),
+        HierarchicalCluster("c", 1, None, 0),
+    ]
+    community_to_label = {0: "1", 1: "2", 2: "1.1", 3: "1.2"}
+    cid_to_concepts = {0: ["a"], 1: ["b", "c"], 2: ["c"], 4: ["a", "b"]}
+    return build_community_index(
+        hierarchical_communities, community_to_label, cid_to_concepts, 5
+    )
+
+
+class TestBuildCommunityIndex:
+    def test_levels(self, community_index) -> None:
+        assert community_index.max_level == 1
+        assert community_index.community_to_parent == {"1.1": "1", "1.2": "1"}
+        assert community_index.level_to_community_labels[0] == ["1", "2"]
+
+    def test_cid_communities(self, community_index) -> None:
+        matrix = community_index.level_to_cid_communities[1]
+        labels = community_index.level_to_community_labels[1]
+        assert [
+            sorted(labels[c] for c in matrix.indices[matrix.indptr[cid]:matrix.indptr[cid + 1]])
+            for cid in range(5)
+        ] == [["1.1"], ["1.2", "2"], ["2"], [], ["1.1", "1.2"]]
+
+    def test_empty(self) -> None:
+        index = build_community_index([], {}, {}, 3)
+        assert index.max_level == -1
+
+
+class TestRankCommunities:
+    def test_mean_rank(self, community_index) -> None:
+        cid_to_rank = build_rank_array(np.array([2, 1, 0, 4]), 5)
+        assert rank_communities(community_index, 0, cid_to_rank, 0) == ["2", "1"]
+
+    def test_ranking_chunks(self, community_index) -> None:
+        cid_to_rank = build_rank_array(np.array([0, 2, 1, 4]), 5)
+        assert rank_communities(community_index, 0, cid_to_rank, 1) == ["1", "2"]
+        assert rank_communities(community_index, 0, cid_to_rank, 0) == ["2", "1"]
+
+
+class TestAssignCidsToCommunities:
+    def test_earliest_community(self, community_index) -> None:
+        ranked_cids = np.array([4, 1, 2, 0, 3])
+        result = assign_cids_to_communities(
+            community_index, 1, ranked_cids, ["1.2", "2", "1.1"]
+        )
+        assert result == {"1.2": [4, 1], "2": [2], "1.1": [0]}
+
+    def test_no_cids(self, community_index) -> None:
+        result = assign_cids_to_communities(
+            community_index, 0, np.array([], dtype=np.int64), ["1", "2"]
+        )
+        assert result == {}
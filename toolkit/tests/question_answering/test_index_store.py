@@ -0,0 +1,163 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+from collections import defaultdict
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from toolkit.query_text_data.api import QueryTextData, QueryTextDataStage
+from toolkit.query_text_data.graph_builder import (
+    build_community_index,
+    prepare_concept_graphs,
+)
+from toolkit.query_text_data.helper_functions import build_chunk_matrix, extend_chunk_matrix
+from toolkit.query_text_data.index_store import MappedVectors
+from toolkit.query_text_data.classes import ProcessedChunks
+
+
+@pytest.fixture()
+def qtd() -> QueryTextData:
+    label_to_chunks = {"a.txt": ["alpha beta", "beta gamma"], "b.txt": ["gamma delta"]}
+    cid_to_text = {0: "alpha beta", 1: "beta gamma", 2: "gamma delta"}
+    cid_to_concepts = defaultdict(
+        list, {0: ["alpha", "beta"], 1: ["beta", "gamma"], 2: ["delta", "gamma"]}
+    )
+    concept_to_cids = defaultdict(list)
+    node_period_counts = defaultdict(lambda: defaultdict(int))
+    edge_period_counts = defaultdict(lambda: defaultdict(int))
+    for cid, concepts in cid_to_concepts.items():
+        for concept in concepts:
+            concept_to_cids[concept].append(cid)
+            node_period_counts[concept]["ALL"] += 1
+        edge_period_counts[tuple(concepts)]["ALL"] += 2
+    period_concept_graphs = defaultdict(nx.Graph)
+    for node, period_counts in node_period_counts.items():
+        period_concept_graphs["ALL"].add_node(node, count=period_counts["ALL"])
+    for edge, period_counts in edge_period_counts.items():
+        period_concept_graphs["ALL"].add_edge(*edge, weight=period_counts["ALL"])
+    hierarchical_communities, community_to_label = prepare_concept_graphs(
+        period_concept_graphs, max_cluster_size=2, min_edge_weight=1, min_node_degree=1
+    )
+    result = QueryTextData()
+    result.label_to_chunks = label_to_chunks
+    result.processed_chunks = ProcessedChunks(
+        cid_to_text=cid_to_text,
+        text_to_cid={text: cid for cid, text in cid_to_text.items()},
+        period_concept_graphs=period_concept_graphs,
+        hierarchical_communities=hierarchical_communities,
+        community_to_label=community_to_label,
+        concept_to_cids=concept_to_cids,
+        cid_to_concepts=cid_to_concepts,
+        previous_cid={1: 0},
+        next_cid={0: 1},
+        period_to_cids=defaultdict(list, {"ALL": [0, 1, 2]}),
+        node_period_counts=node_period_counts,
+        edge_period_counts=edge_period_counts,
+        community_index=build_community_index(
+            hierarchical_communities, community_to_label, cid_to_concepts, 3
+        ),
+    )
+    result.cid_to_vector = {0: [1.0, 0.0], 1: [0.0, 2.0], 2: [3.0, 4.0]}
+    result.chunk_matrix = build_chunk_matrix(result.cid_to_vector)
+    return result
+
+
+class TestSaveLoadIndex:
+    def test_round_trip(self, qtd, tmp_path) -> None:
+        qtd.save_index(str(tmp_path))
+        loaded = QueryTextData()
+        processed = loaded.load_index(str(tmp_path))
+        original = qtd.processed_chunks
+
+        assert loaded.stage == QueryTextDataStage.CHUNKS_EMBEDDED
+        assert loaded.label_to_chunks == qtd.label_to_chunks
+        assert processed.cid_to_text == original.cid_to_text
+        assert processed.text_to_cid == original.text_to_cid
+        assert processed.cid_to_concepts == original.cid_to_concepts
+        assert processed.concept_to_cids == original.concept_to_cids
+        assert processed.previous_cid == original.previous_cid
+        assert processed.next_cid == original.next_cid
+        assert processed.period_to_cids == original.period_to_cids
+        assert processed.node_period_counts == original.node_period_counts
+        assert processed.edge_period_counts == original.edge_period_counts
+        assert processed.community_to_label == original.community_to_label
+        assert list(processed.hierarchical_communities) == list(
+            original.hierarchical_communities
+        )
+        assert (
+            processed.hierarchical_communities.final_level_hierarchical_clustering()
+            == original.hierarchical_communities.final_level_hierarchical_clustering()
+        )
+
+    def test_graphs(self, qtd, tmp_path) -> None:
+        qtd.save_index(str(tmp_path))
+        loaded = QueryTextData()
+        processed = loaded.load_index(str(tmp_path))
+        G = qtd.processed_chunks.period_concept_graphs["ALL"]
+        H = processed.period_concept_graphs["ALL"]
+        assert list(H.nodes(data=True)) == list(G.nodes(data=True))
+        assert sorted(H.edges(data="weight")) == sorted(G.edges(data="weight"))
+
+    def test_community_index(self, qtd, tmp_path) -> None:
+        qtd.save_index(str(tmp_path))
+        loaded = QueryTextData()
+        processed = loaded.load_index(str(tmp_path))
+        original = qtd.processed_chunks.community_index
+        index = processed.community_index
+        assert index.max_level == original.max_level
+        assert index.level_to_community_labels == original.level_to_community_labels
+        for level, matrix in original.level_to_cid_communities.items():
+            assert (index.level_to_cid_communities[level] != matrix).nnz == 0
+
+    def test_vectors_memory_mapped(self, qtd, tmp_path) -> None:
+        qtd.save_index(str(tmp_path))
+        loaded = QueryTextData()
+        loaded.load_index(str(tmp_path))
+        cids, matrix = loaded.chunk_matrix
+        assert isinstance(matrix, np.memmap)
+        assert cids.tolist() == [0, 1, 2]
+        np.testing.assert_allclose(matrix, qtd.chunk_matrix[1])
+        assert {cid: vector.tolist() for cid, vector in loaded.cid_to_vector.items()} == (
+            qtd.cid_to_vector
+        )
+
+    def test_vectors_extended_after_load(self, qtd, tmp_path) -> None:
+        qtd.save_index(str(tmp_path))
+        loaded = QueryTextData()
+        loaded.load_index(str(tmp_path))
+        assert isinstance(loaded.cid_to_vector, MappedVectors)
+        assert 1 in loaded.cid_to_vector
+        assert 3 not in loaded.cid_to_vector
+        loaded.cid_to_vector.update({3: [0.0, 5.0]})
+        loaded.chunk_matrix = extend_chunk_matrix(loaded.chunk_matrix, {3: [0.0, 5.0]})
+        assert len(loaded.cid_to_vector) == 4
+        assert list(loaded.cid_to_vector) == [0, 1, 2, 3]
+        np.testing.assert_allclose(
+            build_chunk_matrix(loaded.cid_to_vector)[1], loaded.chunk_matrix[1]
+        )
+
+    def test_chunks_since_communities(self, qtd, tmp_path) -> None:
+        qtd.chunks_since_communities = 2
+        qtd.save_index(str(tmp_path))
+        loaded = QueryTextData()
+        loaded.load_index(str(tmp_path))
+        assert loaded.chunks_since_communities == 2
+
+    def test_without_vectors(self, qtd, tmp_path) -> None:
+        qtd.cid_to_vector = None
+        qtd.chunk_matrix = None
+        qtd.save_index(str(tmp_path))
+        loaded = QueryTextData()
+        loaded.load_index(str(tmp_path))
+        assert loaded.stage == QueryTextDataStage.CHUNKS_PROCESSED
+        assert loaded.cid_to_vector is None
+
+    def test_missing_index(self, tmp_path) -> None:
+        with pytest.raises(Exception, match="No saved index found"):
+            QueryTextData().load_index(str(tmp_path))
+
+    def test_save_before_processing(self, tmp_path) -> None:
+        with pytest.raises(Exception, match="must be processed"):
+            QueryTextData().save_index(str(tmp_path))
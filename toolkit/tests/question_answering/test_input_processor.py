@@ -0,0 +1,222 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+from json import loads
+
+import numpy as np
+import pytest
+
+import toolkit.query_text_data.graph_builder as graph_builder
+import toolkit.query_text_data.input_processor as input_processor
+from toolkit.query_text_data.api import QueryTextData, QueryTextDataStage
+from toolkit.query_text_data.helper_functions import (
+    build_chunk_matrix,
+    extend_chunk_matrix,
+)
+
+FILE_TO_CHUNKS = {
+    "a.txt": ["red green blue", "green blue", "blue yellow"],
+    "b.txt": ["red yellow", "green red"],
+}
+NEW_FILE_TO_CHUNKS = {"c.txt": ["blue red", "yellow green blue", "purple red"]}
+
+
+@pytest.fixture(autouse=True)
+def word_concepts(monkeypatch) -> None:
+    monkeypatch.setattr(
+        graph_builder, "extract_concepts", lambda chunk: sorted(set(chunk.split()))
+    )
+
+
+def _process(file_to_chunks):
+    return input_processor.process_chunks(
+        file_to_chunks, max_cluster_size=3, min_edge_weight=1, min_node_degree=1
+    )
+
+
+class TestAddChunks:
+    def test_matches_full_processing(self) -> None:
+        processed = _process(FILE_TO_CHUNKS)
+        new_cids = input_processor.add_chunks(processed, NEW_FILE_TO_CHUNKS)
+        expected = _process({**FILE_TO_CHUNKS, **NEW_FILE_TO_CHUNKS})
+
+        assert new_cids == [5, 6, 7]
+        assert processed.cid_to_text == expected.cid_to_text
+        assert processed.text_to_cid == expected.text_to_cid
+        assert processed.cid_to_concepts == expected.cid_to_concepts
+        assert processed.concept_to_cids == expected.concept_to_cids
+        assert processed.node_period_counts == expected.node_period_counts
+        assert processed.edge_period_counts == expected.edge_period_counts
+        assert processed.period_to_cids == expected.period_to_cids
+        assert processed.previous_cid == expected.previous_cid
+        assert processed.next_cid == expected.next_cid
+
+    def test_adjacent_chunks_within_files(self) -> None:
+        processed = _process(FILE_TO_CHUNKS)
+        assert processed.next_cid == {0: 1, 1: 2, 3: 4}
+        assert processed.previous_cid == {1: 0, 2: 1, 4: 3}
+
+    def test_next_chunk_stays_within_file(self) -> None:
+        # the next chunk used to be bounded by the chunk count of the last file, not each file's
+        processed = _process({"a.txt": ["red green"], "b.txt": ["green blue", "blue red", "red"]})
+        assert processed.next_cid == {1: 2, 2: 3}
+        assert processed.previous_cid == {2: 1, 3: 2}
+
+    def test_update_communities_matches_full_processing(self) -> None:
+        processed = _process(FILE_TO_CHUNKS)
+        input_processor.add_chunks(processed, NEW_FILE_TO_CHUNKS)
+        input_processor.update_communities(processed, 3, 1, 1)
+        expected = _process({**FILE_TO_CHUNKS, **NEW_FILE_TO_CHUNKS})
+        assert list(processed.hierarchical_communities) == list(
+            expected.hierarchical_communities
+        )
+        assert processed.community_to_label == expected.community_to_label
+
+    def test_update_community_index_keeps_communities(self) -> None:
+        processed = _process(FILE_TO_CHUNKS)
+        communities = list(processed.hierarchical_communities)
+        input_processor.add_chunks(processed, NEW_FILE_TO_CHUNKS)
+        input_processor.update_community_index(processed)
+        assert list(processed.hierarchical_communities) == communities
+        matrix = processed.community_index.level_to_cid_communities[0]
+        assert matrix.shape[0] == 8
+        assert matrix[7].nnz > 0
+
+
+    def test_stream_matches_mapping(self) -> None:
+        processed = _process(FILE_TO_CHUNKS)
+        pairs = ((file, chunk) for file, chunks in NEW_FILE_TO_CHUNKS.items() for chunk in chunks)
+        new_cids = input_processor.add_chunks(processed, pairs)
+        expected = _process({**FILE_TO_CHUNKS, **NEW_FILE_TO_CHUNKS})
+        assert new_cids == [5, 6, 7]
+        assert processed.cid_to_concepts == expected.cid_to_concepts
+        assert processed.previous_cid == expected.previous_cid
+        assert processed.next_cid == expected.next_cid
+
+    def test_stream_extracts_concepts_as_chunks_arrive(self, monkeypatch) -> None:
+        read = []
+        extracted_after = []
+
+        def extract(chunk):
+            extracted_after.append(len(read))
+            return sorted(set(chunk.split()))
+
+        def pairs():
+            for chunk in NEW_FILE_TO_CHUNKS["c.txt"]:
+                read.append(chunk)
+                yield "c.txt", chunk
+
+        monkeypatch.setattr(graph_builder, "extract_concepts", extract)
+        input_processor.add_chunks(_process(FILE_TO_CHUNKS), pairs(), max_workers=1)
+        assert extracted_after[-3:] == [1, 2, 3]
+
+
+class TestAddDocuments:
+    @pytest.fixture()
+    def qtd(self, monkeypatch) -> QueryTextData:
+        monkeypatch.setattr(
+            input_processor,
+            "stream_file_chunks",
+            lambda input_file_bytes, *args: (
+                (name, text.decode("utf-8"))
+                for name, texts in input_file_bytes.items()
+                for text in texts
+            ),
+        )
+        result = QueryTextData()
+        result.label_to_chunks = dict(FILE_TO_CHUNKS)
+        result.process_text_chunks(max_cluster_size=3, min_edge_weight=1)
+        return result
+
+    async def test_below_drift_threshold(self, qtd) -> None:
+        communities = qtd.processed_chunks.hierarchical_communities
+        new_cids = await qtd.add_documents(
+            {"c.txt": [b"purple red"]},
+            max_cluster_size=3,
+            min_edge_weight=1,
+            community_drift_threshold=0.5,
+        )
+        assert new_cids == [5]
+        assert qtd.processed_chunks.hierarchical_communities is communities
+        assert qtd.chunks_since_communities == 1
+        assert qtd.stage == QueryTextDataStage.CHUNKS_PROCESSED
+        assert qtd.label_to_chunks["c.txt"] == ["purple red"]
+
+    async def test_above_drift_threshold(self, qtd) -> None:
+        communities = qtd.processed_chunks.hierarchical_communities
+        await qtd.add_documents(
+            {"c.txt": [b"purple red"]},
+            max_cluster_size=3,
+            min_edge_weight=1,
+            community_drift_threshold=0.5,
+        )
+        assert qtd.processed_chunks.hierarchical_communities is communities
+        await qtd.add_documents(
+            {"d.txt": [b"purple blue"]},
+            max_cluster_size=3,
+            min_edge_weight=1,
+            community_drift_threshold=0.2,
+        )
+        assert qtd.processed_chunks.hierarchical_communities is not communities
+        assert "purple" in qtd.processed_chunks.period_concept_graphs["ALL"]
+        assert qtd.chunks_since_communities == 0
+
+    async def test_duplicate_document(self, qtd) -> None:
+        with pytest.raises(Exception, match="already added"):
+            await qtd.add_documents({"a.txt": [b"red"]})
+
+    async def test_duplicate_csv_document(self, qtd) -> None:
+        qtd.label_to_chunks["b.csv_1"] = ["red"]
+        with pytest.raises(Exception, match="already added: b.csv_1"):
+            await qtd.add_documents({"b.csv": [b"red"]})
+
+    async def test_requires_processed_chunks(self) -> None:
+        with pytest.raises(Exception, match="must be processed"):
+            await QueryTextData().add_documents({"a.txt": [b"red"]})
+
+
+class TestExtendChunkMatrix:
+    def test_matches_full_build(self) -> None:
+        old = {0: [1.0, 0.0], 2: [0.0, 3.0]}
+        new = {3: [3.0, 4.0], 4: [1.0, 1.0]}
+        cids, matrix = extend_chunk_matrix(build_chunk_matrix(old), new)
+        expected_cids, expected_matrix = build_chunk_matrix({**old, **new})
+        assert cids.tolist() == expected_cids.tolist()
+        np.testing.assert_allclose(matrix, expected_matrix)
+
+    def test_nothing_new(self) -> None:
+        chunk_matrix = build_chunk_matrix({0: [1.0, 0.0]})
+        assert extend_chunk_matrix(chunk_matrix, {}) is chunk_matrix
+
+
+class TestStreamFileChunks:
+    @pytest.fixture(autouse=True)
+    def word_splitter(self, monkeypatch) -> None:
+        from toolkit.tests.AI.test_text_splitter import WordSplitter
+
+        monkeypatch.setattr(input_processor, "get_text_splitter", WordSplitter)
+
+    def test_text_blocks(self) -> None:
+        text = "héllo wörld ünïcode"
+        blocks = list(input_processor.iter_text_blocks(text.encode("utf-8"), block_size=3))
+        assert len(blocks) > 1
+        assert "".join(blocks) == text
+
+    def test_text_file(self, tmp_path) -> None:
+        path = tmp_path / "notes.txt"
+        path.write_text("one two three four five six seven")
+        chunks = list(input_processor.stream_file_chunks({"my notes.txt": str(path)}))
+        assert [label for label, _ in chunks] == ["my_notes.txt"] * 3
+        assert [loads(chunk)["text_chunk"] for _, chunk in chunks] == [
+            "one two three",
+            "four five six",
+            "seven",
+        ]
+        assert [loads(chunk)["chunk_id"] for _, chunk in chunks] == [1, 2, 3]
+
+    def test_convert_file_bytes(self) -> None:
+        label_to_chunks = input_processor.convert_file_bytes_to_chunks(
+            {"a.txt": b"one two three four", "b.csv": b"x,y\n1,2\n3,4\n"}
+        )
+        assert list(label_to_chunks.keys()) == ["a.txt", "b.csv_1", "b.csv_2"]
+        assert loads(label_to_chunks["b.csv_2"][0])["text_chunk"] == "x: 3; y:"
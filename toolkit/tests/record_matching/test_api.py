@@ -0,0 +1,128 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+
+import polars as pl
+import pytest
+
+import toolkit.AI.utils as utils
+from toolkit.match_entity_records.api import (
+    MatchEntityRecords,
+    _group_batches,
+    _parse_evaluations,
+)
+
+
+@pytest.fixture()
+def matches_df() -> pl.DataFrame:
+    group_ids = [1, 1, 2, 2, 2, 3, 3]
+    return pl.DataFrame(
+        {
+            "Group ID": group_ids,
+            "Group size": [2, 2, 3, 3, 3, 2, 2],
+            "Entity name": [f"Name {group}" for group in group_ids],
+            "Dataset": ["a"] * len(group_ids),
+            "Entity ID": [str(i) for i in range(len(group_ids))],
+            "Name similarity": [1.0] * len(group_ids),
+        }
+    )
+
+
+@pytest.fixture()
+def sent_messages(monkeypatch) -> list:
+    sent = []
+
+    async def fake_as_completed(ai_configuration, messages_list, callbacks=None, **kwargs):
+        sent.append(messages_list)
+        for index in reversed(range(len(messages_list))):
+            content = messages_list[index][0]["content"]
+            groups = sorted({int(group) for group in "123" if f"Name {group}" in content})
+            rows = [f'{group},{group + 5},"Group {group}, same"' for group in groups]
+            yield index, "\n".join(["```", *rows, "```"])
+
+    monkeypatch.setattr(utils, "map_generate_text_as_completed", fake_as_completed)
+    return sent
+
+
+class TestGroupBatches:
+    def test_whole_groups(self, matches_df) -> None:
+        batches = _group_batches(matches_df, 4)
+        assert [batch["Group ID"].unique(maintain_order=True).to_list() for batch in batches] == [
+            [1],
+            [2],
+            [3],
+        ]
+
+    def test_packs_groups(self, matches_df) -> None:
+        batches = _group_batches(matches_df, 5)
+        assert [len(batch) for batch in batches] == [5, 2]
+
+
+class TestParseEvaluations:
+    def test_skips_headers_and_unknown_groups(self) -> None:
+        response = 'Group ID,Relatedness,Explanation\n1, 8,"a, b"\n9,3,"c"\n1,2,"d"'
+        result = _parse_evaluations(response, {1})
+        assert result.to_dicts() == [
+            {"Group ID": 1, "Relatedness": 8, "Explanation": "a, b"}
+        ]
+
+    def test_empty(self) -> None:
+        assert _parse_evaluations("```\n```", {1}).is_empty()
+
+    def test_prose(self) -> None:
+        assert _parse_evaluations("garbage", {1}).is_empty()
+        assert _parse_evaluations("These look related, as names match.", {1}).is_empty()
+
+    def test_unclosed_quote(self) -> None:
+        result = _parse_evaluations('1,8,"unclosed\n2,3,"x"', {1, 2})
+        assert result["Group ID"].to_list() == [1]
+
+
+class TestEvaluateGroups:
+    async def test_all_groups_in_batches(self, matches_df, sent_messages) -> None:
+        mer = MatchEntityRecords()
+        mer.matches_df = matches_df
+        result = await mer.evaluate_groups(batch_size=2)
+        assert len(sent_messages[0]) == 3
+        assert sorted(mer.evaluations_df["Group ID"].to_list()) == [1, 2, 3]
+        assert mer.evaluations_df.filter(pl.col("Group ID") == 2)["Relatedness"][0] == 7
+        assert result.startswith("Group ID,Relatedness,Explanation\n")
+        assert not result.endswith("\n")
+        assert '3,8,"Group 3, same"' in result.splitlines()
+
+    async def test_skips_evaluated_groups(self, matches_df, sent_messages) -> None:
+        mer = MatchEntityRecords()
+        mer.matches_df = matches_df
+        mer.evaluations_df = pl.DataFrame(
+            {"Group ID": [2], "Relatedness": [1], "Explanation": ["done"]}
+        )
+        await mer.evaluate_groups(batch_size=2)
+        assert len(sent_messages[0]) == 2
+        assert mer.evaluations_df.filter(pl.col("Group ID") == 2)["Explanation"][0] == "done"
+        assert sorted(mer.evaluations_df["Group ID"].to_list()) == [1, 2, 3]
+
+        await mer.evaluate_groups()
+        assert len(sent_messages) == 1
+
+    async def test_no_matches(self, sent_messages) -> None:
+        mer = MatchEntityRecords()
+        assert await mer.evaluate_groups() == "Group ID,Relatedness,Explanation"
+        mer.matches_df = pl.DataFrame({"Entity name": ["a"]})
+        assert await mer.evaluate_groups() == "Group ID,Relatedness,Explanation"
+        assert sent_messages == []
+
+    async def test_prose_reply_keeps_other_batches(self, matches_df, monkeypatch) -> None:
+        async def fake_as_completed(ai_configuration, messages_list, callbacks=None, **kwargs):
+            for index in range(len(messages_list)):
+                content = messages_list[index][0]["content"]
+                if "Name 2" in content:
+                    yield index, "I could not evaluate this group."
+                else:
+                    group = 1 if "Name 1" in content else 3
+                    yield index, f'{group},5,"fine"'
+
+        monkeypatch.setattr(utils, "map_generate_text_as_completed", fake_as_completed)
+        mer = MatchEntityRecords()
+        mer.matches_df = matches_df
+        await mer.evaluate_groups(batch_size=2)
+        assert sorted(mer.evaluations_df["Group ID"].to_list()) == [1, 3]
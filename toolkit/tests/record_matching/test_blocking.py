@@ -0,0 +1,111 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+
+import numpy as np
+import polars as pl
+import pytest
+
+from toolkit.match_entity_records.blocking import (
+    build_blocks,
+    exact_key_blocks,
+    lsh_blocks,
+    name_ngram_blocks,
+    sorted_neighborhood_blocks,
+)
+from toolkit.match_entity_records.classes import BlockingConfig, BlockingReport
+
+
+def _as_lists(blocks) -> list:
+    return sorted(block.tolist() for block in blocks)
+
+
+@pytest.fixture()
+def merged_df() -> pl.DataFrame:
+    return pl.DataFrame(
+        {
+            "Entity ID": ["1", "2", "3", "4", "5"],
+            "Entity name": ["Acme Inc", "ACME INC.", "Globex", "Initech", "Globex"],
+            "City": ["Paris", "paris", None, "Rome", "Rome"],
+            "Dataset": ["a", "b", "a", "b", "b"],
+        }
+    )
+
+
+class TestExactKeyBlocks:
+    def test_equal_upper_cased_values(self, merged_df) -> None:
+        blocks = exact_key_blocks(merged_df, ["City"])
+        assert _as_lists(blocks) == [[0, 1], [3, 4]]
+
+    def test_several_columns(self, merged_df) -> None:
+        blocks = exact_key_blocks(merged_df, ["City", "Dataset"])
+        assert _as_lists(blocks) == [[0], [1], [3, 4]]
+
+
+class TestNameNgramBlocks:
+    def test_shared_grams(self, merged_df) -> None:
+        blocks = _as_lists(name_ngram_blocks(merged_df["Entity name"].to_list()))
+        assert [0, 1] in blocks
+        assert [2, 4] in blocks
+        assert all(3 not in block or len(block) == 1 for block in blocks)
+
+    def test_short_names_unblocked(self) -> None:
+        assert name_ngram_blocks(["ab", "ab"]) == []
+
+
+class TestSortedNeighborhoodBlocks:
+    def test_overlapping_windows(self) -> None:
+        names = ["d", "a", "c", "b", "e"]
+        blocks = sorted_neighborhood_blocks(names, window=2)
+        assert [block.tolist() for block in blocks] == [[1, 3], [2, 3], [0, 2], [0, 4]]
+
+    def test_window_larger_than_records(self) -> None:
+        blocks = sorted_neighborhood_blocks(["b", "a"], window=10)
+        assert [block.tolist() for block in blocks] == [[0, 1]]
+
+
+class TestLshBlocks:
+    def test_close_vectors_share_buckets(self) -> None:
+        rng = np.random.default_rng(1)
+        base = rng.standard_normal((20, 16))
+        embeddings = np.vstack([base, base + 1e-4 * rng.standard_normal((20, 16))])
+        blocks = lsh_blocks(embeddings, num_tables=3, num_bits=8)
+        pairs = {(a, b) for block in blocks for a in block.tolist() for b in block.tolist()}
+        assert all((i, i + 20) in pairs for i in range(20))
+
+    def test_one_partition_per_table(self) -> None:
+        embeddings = np.random.default_rng(2).standard_normal((50, 8))
+        blocks = lsh_blocks(embeddings, num_tables=2, num_bits=4)
+        assert sum(len(block) for block in blocks) == 100
+
+
+class TestBuildBlocks:
+    def test_combines_and_deduplicates(self, merged_df) -> None:
+        blocking = BlockingConfig(exact_columns=["City"], sorted_neighborhood_window=2)
+        blocks, report = build_blocks(merged_df, None, blocking)
+        lists = _as_lists(blocks)
+        assert len(lists) == len({tuple(block) for block in lists})
+        assert [0, 1] in lists
+        assert all(len(block) > 1 for block in lists)
+        assert report.num_blocks == len(blocks)
+
+    def test_skips_large_blocks(self, merged_df) -> None:
+        blocking = BlockingConfig(sorted_neighborhood_window=5, max_block_size=4)
+        blocks, report = build_blocks(merged_df, None, blocking)
+        assert blocks == []
+        assert report.skipped_blocks == 1
+
+    def test_lsh_requires_embeddings(self, merged_df) -> None:
+        with pytest.raises(ValueError, match="requires the record embeddings"):
+            build_blocks(merged_df, None, BlockingConfig(lsh_tables=1))
+
+
+class TestBlockingReport:
+    def test_reduction_ratio(self) -> None:
+        report = BlockingReport(10, [2, 3])
+        assert report.total_pairs == 45
+        assert report.candidate_pairs == 4
+        assert report.reduction_ratio == pytest.approx(1 - 4 / 45)
+
+    def test_no_records(self) -> None:
+        assert BlockingReport(0, []).reduction_ratio == 0.0
@@ -2,22 +2,33 @@
 # Licensed under the MIT license. See LICENSE file in the project.
 #
 
+import importlib.util
 import re
+import sys
+import types
 from collections import defaultdict
 
 import numpy as np
 import polars as pl
 import pytest
+from sklearn.neighbors import NearestNeighbors
 
+import toolkit.match_entity_records.detect as detect
+from toolkit.AI.utils import hash_text
 from toolkit.match_entity_records.detect import (
+    EntityGroups,
     _calculate_mean_score,
     build_attributes_dataframe,
+    build_blocked_near_map,
+    build_match_groups,
     build_matches,
     build_matches_dataset,
+    build_name_index,
     build_near_map,
     build_nearest_neighbors,
     build_sentence_pair_scores,
     convert_to_sentences,
+    score_name_pairs,
 )
 
 
@@ -49,20 +60,19 @@ class TestConvertToSentences:
         result = convert_to_sentences(merged_df, [])
 
         assert len(result) == 5
-        assert "ID1" in result[0]["text"]
+        assert "ID1" in result["text"][0]
 
     def test_skip(self, merged_df) -> None:
         result = convert_to_sentences(merged_df, ["ID1"])
 
-        for res in result:
-            assert "ID1" not in res["text"]
+        for text in result["text"]:
+            assert "ID1" not in text
 
     def test_sentence(self, merged_df) -> None:
         result = convert_to_sentences(merged_df)
 
         assert len(result) == 5
-        for re in result:
-            text = re["text"]
+        for text in result["text"]:
             assert "ID1:" in text
             assert "ENTITY NAME:" in text
             assert "VEHICLETYPE:" in text
@@ -87,8 +97,31 @@ class TestConvertToSentences:
         )
         result = convert_to_sentences(merged_df)
 
-        re = result[-1]
-        assert "VEHICLETYPE: ;" in re["text"]
+        assert "VEHICLETYPE: ;" in result["text"][-1]
+
+    def test_matches_row_sentences(self) -> None:
+        merged_df = pl.DataFrame(
+            {
+                "Entity ID": [1, 2, 3],
+                "Entity name": ["straße", "b", None],
+                "Size": [1.5, None, 1e20],
+                "Count": [1, None, 3],
+                "Active": [True, False, None],
+                "Note": ["x", "nan", None],
+            }
+        )
+        expected = []
+        for row in merged_df.iter_rows(named=True):
+            sentence = "ENTITY NAME: " + str(row["Entity name"]).upper() + "; "
+            for field in ["Size", "Count", "Active", "Note"]:
+                val = str(row[field]).upper()
+                sentence += field.upper() + ": " + ("" if val == "NAN" else val) + "; "
+            expected.append(sentence.strip())
+
+        result = convert_to_sentences(merged_df, ["Entity ID", "Entity name"])
+        assert result.columns == ["text", "hash"]
+        assert result["text"].to_list() == expected
+        assert result["hash"].to_list() == [hash_text(text) for text in expected]
 
 
 class TestBuildNearestNeighbors:
@@ -118,6 +151,82 @@ class TestBuildNearestNeighbors:
         assert len(result) == 2
         assert result[0].shape == (1000, 10)
 
+    def test_matches_brute_force(self, embeddings) -> None:
+        distances, indices = build_nearest_neighbors(embeddings, 5)
+        expected_distances, expected_indices = NearestNeighbors(
+            n_neighbors=5, metric="cosine"
+        ).fit(embeddings).kneighbors(embeddings)
+        np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+        assert (indices[:, 0] == np.arange(1000)).all()
+        # ties may be ordered differently, so compare the neighbors of each record as sets
+        assert [set(row) for row in indices.tolist()] == [
+            set(row) for row in expected_indices.tolist()
+        ]
+
+    def test_blocks(self, embeddings, monkeypatch) -> None:
+        expected = build_nearest_neighbors(embeddings, 5)
+        monkeypatch.setattr(detect, "NEAREST_NEIGHBORS_BLOCK_BYTES", 12 * 1000 * 3 * 7)
+        distances, indices = build_nearest_neighbors(embeddings, 5, max_workers=3)
+        np.testing.assert_array_equal(indices, expected[1])
+        np.testing.assert_array_equal(distances, expected[0])
+
+    def test_block_rows_share_budget_across_workers(self, monkeypatch) -> None:
+        monkeypatch.setattr(detect, "NEAREST_NEIGHBORS_BLOCK_BYTES", 12 * 1000 * 8)
+        assert detect.similarity_block_rows(1000) == 8
+        assert detect.similarity_block_rows(1000, 4) == 2
+        assert detect.similarity_block_rows(1000, 16) == 1
+
+    def test_self_first_among_duplicates(self) -> None:
+        embeddings = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+        distances, indices = build_nearest_neighbors(embeddings, 3)
+        assert indices[:, 0].tolist() == [0, 1, 2]
+        assert distances[:, :2].tolist() == [[0, 0], [0, 0], [0, 1]]
+
+    @pytest.mark.skipif(
+        importlib.util.find_spec("hnswlib") is not None, reason="hnswlib installed"
+    )
+    def test_approximate_requires_hnswlib(self, embeddings) -> None:
+        with pytest.raises(ImportError, match="hnswlib"):
+            build_nearest_neighbors(embeddings, 5, approximate=True)
+
+
+    def test_approximate_self_first_among_duplicates(self, monkeypatch) -> None:
+        class Index:
+            """Exact cosine neighbors, listing ties in id order as an HNSW index may."""
+
+            def __init__(self, space, dim) -> None:
+                self.vectors = None
+
+            def init_index(self, **kwargs) -> None:
+                pass
+
+            def set_ef(self, ef) -> None:
+                pass
+
+            def add_items(self, vectors, ids, num_threads=-1) -> None:
+                self.vectors = vectors
+
+            def knn_query(self, queries, k, num_threads=-1):
+                distances = 1 - queries @ self.vectors.T
+                indices = np.argsort(distances, axis=1, kind="stable")[:, :k]
+                return indices, np.take_along_axis(distances, indices, axis=1)
+
+        monkeypatch.setitem(sys.modules, "hnswlib", types.SimpleNamespace(Index=Index))
+        embeddings = np.array([[1.0, 0.0], [1.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+        distances, indices = build_nearest_neighbors(embeddings, 3, approximate=True)
+        assert indices.tolist() == [[0, 1, 2], [1, 0, 2], [2, 0, 1], [3, 0, 1]]
+        assert distances[:3].tolist() == [[0, 0, 0]] * 3
+        assert distances[3, 0] == 0
+
+
+class TestSelfFirst:
+    def test_missing_self_replaces_farthest(self) -> None:
+        distances = np.array([[0.1, 0.2, 0.3]], dtype=np.float32)
+        indices = np.array([[4, 5, 6]], dtype=np.int32)
+        distances, indices = detect._self_first(distances, indices)
+        assert indices.tolist() == [[0, 4, 5]]
+        np.testing.assert_allclose(distances, [[0, 0.1, 0.2]])
+
 
 class TestBuildNearMap:
     @pytest.fixture()
@@ -153,6 +262,32 @@ class TestBuildNearMap:
         assert result == expected
 
 
+class TestBuildBlockedNearMap:
+    @pytest.fixture()
+    def embeddings(self) -> np.ndarray:
+        rng = np.random.default_rng(3)
+        base = rng.standard_normal((30, 8))
+        return np.vstack([base, base + 0.01 * rng.standard_normal((30, 8))])
+
+    def test_one_block_matches_near_map(self, embeddings) -> None:
+        distances, indices = build_nearest_neighbors(embeddings, 10)
+        sentences = [f"RECORD {ix:>10}" for ix in range(len(embeddings))]
+        expected = build_near_map(distances, indices, sentences, 0.01)
+        result = build_blocked_near_map(
+            embeddings, [np.arange(len(embeddings))], 10, 0.01
+        )
+        assert {ix: sorted(nx) for ix, nx in expected.items()} == dict(result)
+
+    def test_only_within_blocks(self, embeddings) -> None:
+        blocks = [np.arange(0, 60, 2), np.arange(1, 60, 2)]
+        result = build_blocked_near_map(embeddings, blocks, 10, 0.01)
+        assert len(result) > 0
+        assert all((ix - nx) % 2 == 0 for ix, nxs in result.items() for nx in nxs)
+
+    def test_no_blocks(self, embeddings) -> None:
+        assert build_blocked_near_map(embeddings, []) == {}
+
+
 class TestBuildSentencePairScores:
     @pytest.fixture()
     def near_map(self) -> dict:
@@ -209,6 +344,30 @@ class TestBuildSentencePairScores:
         assert result == expected
 
 
+class TestScoreNamePairs:
+    def test_scores(self) -> None:
+        name_ids, name_grams = build_name_index(
+            ["Acme Corp", "ACME CORP", "Acme Corp.", "Acme Co", "AB"]
+        )
+        assert name_ids.tolist() == [0, 0, 1, 2, 3]
+        scores = score_name_pairs(
+            name_ids,
+            name_grams,
+            np.array([0, 0, 0, 4, 3]),
+            np.array([1, 2, 3, 4, 4]),
+        )
+        # ACM CME ME_ E_C _CO COR ORP vs ACM CME ME_ E_C _CO
+        assert scores.tolist() == [1, 1, 5 / 7, 1, 0]
+
+    def test_blocks(self) -> None:
+        name_ids, name_grams = build_name_index(["ABCD", "ABCE", "XBCD", "ABCD!"])
+        ix = np.array([0, 0, 1, 2])
+        nx = np.array([1, 2, 2, 3])
+        expected = score_name_pairs(name_ids, name_grams, ix, nx)
+        result = score_name_pairs(name_ids, name_grams, ix, nx, block_size=1)
+        assert result.tolist() == expected.tolist()
+
+
 class TestBuildMatches:
     @pytest.fixture()
     def merged_df(self) -> pl.DataFrame:
@@ -322,12 +481,85 @@ class TestBuildMatches:
         _, matches, _ = build_matches(sentence_pair_scores, merged_df)
         assert len(matches) == 2
 
+    def test_matches_take_final_groups(self, merged_df) -> None:
+        sentence_pair_scores = [(0, 1, 0.8), (2, 3, 0.9), (1, 2, 0.76)]
+        _, matches, _ = build_matches(sentence_pair_scores, merged_df)
+        assert sorted(matches) == [
+            (0, "A", "X"),
+            (0, "B", "X"),
+            (0, "C", "Y"),
+            (0, "D", "Y"),
+        ]
+
     def test_pair_to_match(self, merged_df, sentence_pair_scores) -> None:
         _, _, pair_to_match = build_matches(sentence_pair_scores, merged_df)
         expected = {("A::X", "B::X"): 0.8}
         assert pair_to_match == expected
 
 
+class TestEntityGroups:
+    def test_labels(self) -> None:
+        groups = EntityGroups(5)
+        groups.union(0, 1)
+        groups.union(2, 3)
+        assert [groups.group_of(entity) for entity in range(5)] == [0, 0, 1, 1, -1]
+        groups.union(0, 2)
+        assert [groups.group_of(entity) for entity in range(4)] == [1, 1, 1, 1]
+
+    def test_self_pair_groups(self) -> None:
+        groups = EntityGroups(1)
+        groups.union(0, 0)
+        assert groups.group_of(0) == 0
+
+    def test_mean_scores(self) -> None:
+        groups = EntityGroups(4)
+        groups.union(0, 1)
+        groups.add_score(0, 0.9)
+        groups.union(2, 3)
+        groups.add_score(2, 0.8)
+        groups.add_score(2, 0.7, previous=0.8)
+        assert groups.group_mean_scores() == {0: 0.9, 1: 0.7}
+        groups.union(1, 2)
+        groups.add_score(1, 0.5)
+        assert groups.group_mean_scores() == pytest.approx({1: 0.7})
+
+
+class TestBuildMatchGroups:
+    @pytest.fixture()
+    def merged_df(self) -> pl.DataFrame:
+        return pl.DataFrame(
+            {
+                "Entity name": ["A", "B", "C", "D", "A"],
+                "Dataset": ["X", "X", "Y", "Y", "X"],
+            }
+        )
+
+    def test_groups(self, merged_df) -> None:
+        match_groups = build_match_groups(
+            [(0, 1, 0.8), (2, 3, 0.9), (1, 2, 0.76), (4, 1, 1.0)], merged_df
+        )
+        # the merged group keeps the label of C::Y's group
+        assert match_groups.entity_to_group == {
+            "A::X": 1,
+            "B::X": 1,
+            "C::Y": 1,
+            "D::Y": 1,
+        }
+        # A::X and B::X scored 1.0 then 0.8, keeping the later score
+        assert match_groups.group_to_mean_similarity == pytest.approx(
+            {1: (0.8 + 0.9 + 0.76) / 3}
+        )
+        matches_df = match_groups.to_dataframe(merged_df)
+        assert matches_df.columns == ["Group ID", "Entity name", "Dataset"]
+        # the identical records 0 and 4 appear once
+        assert matches_df["Group ID"].to_list() == [1, 1, 1, 1]
+
+    def test_empty(self, merged_df) -> None:
+        match_groups = build_match_groups([], merged_df)
+        assert match_groups.entity_to_group == {}
+        assert match_groups.to_dataframe(merged_df).is_empty()
+
+
 class TestCalculateMeanScore:
     @pytest.fixture()
     def pair_to_match(self) -> dict:
@@ -0,0 +1,133 @@
+# Copyright (c) 2024 Microsoft Corporation. All rights reserved.
+# Licensed under the MIT license. See LICENSE file in the project.
+#
+
+import numpy as np
+import polars as pl
+import pytest
+
+from toolkit.match_entity_records.detect import (
+    build_match_groups,
+    build_near_map,
+    build_nearest_neighbors,
+    build_sentence_pair_scores,
+)
+from toolkit.match_entity_records.match_index import MatchIndex
+
+MAX_DISTANCE = 0.05
+JACCARD_THRESHOLD = 0.5
+
+
+@pytest.fixture()
+def records() -> tuple[pl.DataFrame, np.ndarray]:
+    rng = np.random.default_rng(4)
+    names = ["Acme Inc", "ACME INC.", "Globex", "Globex Corp", "Initech", "Hooli"]
+    num_records = 36
+    merged_df = pl.DataFrame(
+        {
+            "Entity ID": [f"{i}::d{i % 3}" for i in range(num_records)],
+            "Entity name": [names[i % len(names)] for i in range(num_records)],
+            "Dataset": [f"d{i % 3}" for i in range(num_records)],
+            "City": [["Paris", "Rome"][i % 2] for i in range(num_records)],
+        }
+    )
+    base = rng.standard_normal((len(names), 16))
+    embeddings = base[np.arange(num_records) % len(names)] + 0.02 * rng.standard_normal(
+        (num_records, 16)
+    )
+    return merged_df, embeddings
+
+
+def _pair_scores(merged_df, embeddings) -> list:
+    distances, indices = build_nearest_neighbors(embeddings, len(embeddings))
+    near_map = build_near_map(
+        distances, indices, merged_df["Entity name"].to_list(), MAX_DISTANCE
+    )
+    return build_sentence_pair_scores(near_map, merged_df)
+
+
+def _partition(entity_to_group: dict) -> set:
+    groups = {}
+    for entity, group in entity_to_group.items():
+        groups.setdefault(group, set()).add(entity)
+    return {frozenset(entities) for entities in groups.values()}
+
+
+def _create(path, merged_df, embeddings) -> MatchIndex:
+    return MatchIndex.create(
+        path,
+        merged_df,
+        embeddings,
+        _pair_scores(merged_df, embeddings),
+        MAX_DISTANCE,
+        JACCARD_THRESHOLD,
+    )
+
+
+class TestMatchIndex:
+    def test_incremental_matches_full_run(self, tmp_path, records) -> None:
+        merged_df, embeddings = records
+        index = _create(tmp_path, merged_df[:20], embeddings[:20])
+        match_groups = index.match_new_records(merged_df[20:], embeddings[20:])
+
+        full = build_match_groups(
+            _pair_scores(merged_df, embeddings), merged_df, JACCARD_THRESHOLD
+        )
+        assert _partition(match_groups.entity_to_group) == _partition(full.entity_to_group)
+        assert sorted(match_groups.rows.tolist()) == sorted(full.rows.tolist())
+        assert match_groups.group_to_mean_similarity.keys() == set(
+            match_groups.row_groups.tolist()
+        )
+
+    def test_reload_keeps_groups(self, tmp_path, records) -> None:
+        merged_df, embeddings = records
+        _create(tmp_path / "a", merged_df[:20], embeddings[:20])
+        kept = _create(tmp_path / "b", merged_df[:20], embeddings[:20])
+        loaded = MatchIndex.load(tmp_path / "a")
+        assert loaded.num_records == 20
+        assert loaded.pair_to_match == kept.pair_to_match
+
+        expected = kept.match_new_records(merged_df[20:], embeddings[20:])
+        result = loaded.match_new_records(merged_df[20:], embeddings[20:])
+        assert result.entity_to_group == expected.entity_to_group
+        assert MatchIndex.load(tmp_path / "a").num_records == 36
+
+    def test_only_groups_of_new_records(self, tmp_path, records) -> None:
+        merged_df, embeddings = records
+        index = _create(tmp_path, merged_df[:30], embeddings[:30])
+        match_groups = index.match_new_records(merged_df[30:31], embeddings[30:31])
+        assert "Acme Inc::d0" in match_groups.entity_to_group
+        assert {
+            entity.split("::")[0] for entity in match_groups.entity_to_group
+        } == {"Acme Inc"}
+        matches_df = index.matches_dataset(match_groups)
+        assert set(matches_df["Entity name"].to_list()) == {"Acme Inc"}
+
+    def test_columns_must_match(self, tmp_path, records) -> None:
+        merged_df, embeddings = records
+        index = _create(tmp_path, merged_df[:20], embeddings[:20])
+        with pytest.raises(ValueError, match="New records have columns"):
+            index.match_new_records(merged_df[20:].drop("City"), embeddings[20:])
+
+    def test_load_missing(self, tmp_path) -> None:
+        with pytest.raises(Exception, match="No saved match index"):
+            MatchIndex.load(tmp_path)
+
+    def test_new_records_append_a_part(self, tmp_path, records) -> None:
+        merged_df, embeddings = records
+        _create(tmp_path, merged_df[:20], embeddings[:20])
+        before = {
+            path.name: path.read_bytes() for path in tmp_path.iterdir() if path.name != "index.json"
+        }
+        index = MatchIndex.load(tmp_path)
+        index.match_new_records(merged_df[20:], embeddings[20:])
+        after = {path.name for path in tmp_path.iterdir()}
+        assert {name for name in after - before.keys() if name != "index.json"} == {
+            name.replace("00000", "00001") for name in before
+        }
+        assert all((tmp_path / name).read_bytes() == data for name, data in before.items())
+
+        loaded = MatchIndex.load(tmp_path)
+        assert loaded.pair_to_match == index.pair_to_match
+        assert loaded.groups.label == index.groups.label
+        assert loaded.groups.score_sum == index.groups.score_sum